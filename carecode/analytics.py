@@ -0,0 +1,344 @@
+"""Columnar encounter snapshot for epidemiology reports.
+
+Encounters joined with patient and hospital attributes are exported from
+the OLTP tables into a local NumPy snapshot (``instance/analytics``): one
+array per column, with string attributes dictionary-encoded to small
+integers. The dictionaries and metadata are stored as a JSON string in the
+same ``.npz`` file, so a refresh replaces the whole snapshot with a single
+``os.replace``. Grouped counts and time series are then computed with vectorized
+masks and ``bincount`` instead of SQL against ``medical_encounters``.
+"""
+import json
+import os
+import threading
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from sqlalchemy import or_, select
+
+from models import db, MedicalEncounter, Patient, Hospital
+
+SNAPSHOT_BATCH_SIZE = 5000
+# Rows touched shortly before the previous refresh are re-read, see rollups.py
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+EPOCH = date(1970, 1, 1)
+AGE_BANDS = ["0-4", "5-14", "15-24", "25-44", "45-64", "65+"]
+_AGE_LIMITS = np.array([5, 15, 25, 45, 65])
+UNKNOWN = "unknown"
+
+# Dictionary-encoded columns; index 0 of every dictionary is UNKNOWN
+CATEGORICAL = ("diagnosis_code", "gender", "blood_type", "province")
+NUMERIC = ("id", "day", "hospital_id", "patient_id", "age_band")
+DIMENSIONS = ("diagnosis_code", "gender", "blood_type", "province", "age_band", "hospital_id")
+SNAPSHOT_FILE = "encounters.npz"
+HEADER_ARRAY = "_header"  # dictionaries and meta, as a JSON string
+
+
+def _day_number(value):
+    return (value - EPOCH).days
+
+
+def _day_from_number(number):
+    return EPOCH + timedelta(days=int(number))
+
+
+def _age_band(date_of_birth, on_day):
+    if not date_of_birth:
+        return -1
+    years = on_day.year - date_of_birth.year - (
+        (on_day.month, on_day.day) < (date_of_birth.month, date_of_birth.day)
+    )
+    return int(np.searchsorted(_AGE_LIMITS, max(years, 0), side="right"))
+
+
+def _province(patient_address, hospital_address):
+    for address in (patient_address, hospital_address):
+        if isinstance(address, dict) and address.get("province"):
+            return address["province"].strip().title()
+    return None
+
+
+class EncounterSnapshot:
+    """Immutable set of column arrays plus the dictionaries that decode them"""
+
+    def __init__(self, columns, dictionaries, meta):
+        self.columns = columns
+        self.dictionaries = dictionaries
+        self.meta = meta
+
+    def __len__(self):
+        return len(self.columns["id"])
+
+    @classmethod
+    def empty(cls):
+        columns = {name: np.zeros(0, dtype=np.int32) for name in NUMERIC + CATEGORICAL}
+        columns["id"] = np.zeros(0, dtype=np.int64)
+        return cls(columns, {name: [UNKNOWN] for name in CATEGORICAL}, {})
+
+    # ---- persistence -------------------------------------------------------
+
+    @classmethod
+    def load(cls, directory):
+        with np.load(os.path.join(directory, SNAPSHOT_FILE)) as arrays:
+            columns = {name: arrays[name] for name in arrays.files if name != HEADER_ARRAY}
+            header = str(arrays[HEADER_ARRAY]) if HEADER_ARRAY in arrays.files else None
+        if header is None:
+            # Written before the header moved into the .npz; the next refresh rewrites it
+            with open(os.path.join(directory, "snapshot.json"), encoding="utf-8") as f:
+                header = f.read()
+        header = json.loads(header)
+        return cls(columns, header["dictionaries"], header["meta"])
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        header = json.dumps({"dictionaries": self.dictionaries, "meta": self.meta})
+        tmp = os.path.join(directory, f"encounters.{os.getpid()}.{threading.get_ident()}.tmp.npz")
+        np.savez(tmp, **self.columns, **{HEADER_ARRAY: np.array(header)})
+        os.replace(tmp, os.path.join(directory, SNAPSHOT_FILE))
+
+    # ---- queries -----------------------------------------------------------
+
+    def _mask(self, filters):
+        mask = np.ones(len(self), dtype=bool)
+        for name, value in (filters or {}).items():
+            if value is None:
+                continue
+            if name == "date_from":
+                mask &= self.columns["day"] >= _day_number(value)
+            elif name == "date_to":
+                mask &= self.columns["day"] <= _day_number(value)
+            elif name in CATEGORICAL:
+                lookup = {v: i for i, v in enumerate(self.dictionaries[name])}
+                codes = [lookup[v] for v in value if v in lookup]
+                mask &= np.isin(self.columns[name], codes)
+            elif name == "age_band":
+                mask &= np.isin(self.columns[name], [AGE_BANDS.index(v) for v in value if v in AGE_BANDS])
+            elif name in ("hospital_id", "patient_id"):
+                mask &= np.isin(self.columns[name], list(value))
+            else:
+                raise ValueError(f"Unknown filter: {name}")
+        return mask
+
+    def _decode(self, name, values):
+        if name in CATEGORICAL:
+            dictionary = self.dictionaries[name]
+            return [dictionary[v] for v in values]
+        if name == "age_band":
+            return [AGE_BANDS[v] if v >= 0 else UNKNOWN for v in values]
+        return [int(v) for v in values]
+
+    def _group_keys(self, by, mask):
+        """Combine group columns into one dense integer key per row"""
+        keys = np.zeros(int(mask.sum()), dtype=np.int64)
+        decoders = []
+        for name in by:
+            if name not in DIMENSIONS:
+                raise ValueError(f"Cannot group by {name}")
+            column = self.columns[name][mask].astype(np.int64)
+            if name == "age_band":
+                column = column + 1  # -1 (unknown) -> 0
+            uniques, inverse = np.unique(column, return_inverse=True)
+            keys = keys * len(uniques) + inverse
+            decoders.append((name, uniques, len(uniques)))
+        return keys, decoders
+
+    def group_counts(self, by, filters=None, limit=None):
+        """Encounter counts per combination of the `by` dimensions, largest first"""
+        mask = self._mask(filters)
+        keys, decoders = self._group_keys(by, mask)
+        counts = np.bincount(keys) if len(keys) else np.zeros(0, dtype=np.int64)
+        present = np.flatnonzero(counts)
+        order = present[np.argsort(-counts[present], kind="stable")]
+        if limit:
+            order = order[:limit]
+
+        # Unravel the combined key back into one index per dimension
+        parts = {}
+        remainder = order.copy()
+        for name, uniques, size in reversed(decoders):
+            values = uniques[remainder % size]
+            if name == "age_band":
+                values = values - 1
+            parts[name] = self._decode(name, values)
+            remainder //= size
+
+        return [
+            {**{name: parts[name][i] for name in by}, "count": int(counts[key])}
+            for i, key in enumerate(order)
+        ]
+
+    def time_series(self, interval="week", filters=None, by=None):
+        """Encounter counts per day/week/month, optionally split by one dimension"""
+        mask = self._mask(filters)
+        days = self.columns["day"][mask]
+        if interval == "day":
+            buckets = days
+        elif interval == "week":
+            buckets = days - (days + 3) % 7  # 1970-01-01 was a Thursday; weeks start Monday
+        elif interval == "month":
+            buckets = days.astype("datetime64[D]").astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)
+        else:
+            raise ValueError(f"Unknown interval: {interval}")
+
+        if by is None:
+            periods, counts = np.unique(buckets, return_counts=True)
+            return [
+                {"period": _day_from_number(p).isoformat(), "count": int(c)}
+                for p, c in zip(periods, counts)
+            ]
+
+        keys, decoders = self._group_keys([by], mask)
+        _, uniques, size = decoders[0]
+        combined = buckets.astype(np.int64) * size + keys
+        values, counts = np.unique(combined, return_counts=True)
+        labels = uniques[values % size] - (1 if by == "age_band" else 0)
+        decoded = self._decode(by, labels)
+        return [
+            {"period": _day_from_number(v // size).isoformat(), by: label, "count": int(c)}
+            for v, label, c in zip(values, decoded, counts)
+        ]
+
+
+# ---- export from the database --------------------------------------------
+
+
+def _encoder(dictionary):
+    lookup = {value: i for i, value in enumerate(dictionary)}
+
+    def encode(value):
+        if not value:
+            return 0
+        index = lookup.get(value)
+        if index is None:
+            index = lookup[value] = len(dictionary)
+            dictionary.append(value)
+        return index
+
+    return encode
+
+
+def _fetch_rows(dictionaries, condition=None):
+    """Stream joined encounter rows into column arrays"""
+    encoders = {name: _encoder(dictionaries[name]) for name in CATEGORICAL}
+    statement = (
+        select(
+            MedicalEncounter.id, MedicalEncounter.treatment_date, MedicalEncounter.hospital_id,
+            MedicalEncounter.patient_id, MedicalEncounter.diagnosis_code,
+            Patient.date_of_birth, Patient.gender, Patient.blood_type, Patient.address,
+            Hospital.address,
+        )
+        .join(Patient, Patient.id == MedicalEncounter.patient_id)
+        .join(Hospital, Hospital.id == MedicalEncounter.hospital_id)
+        .order_by(MedicalEncounter.id)
+        .execution_options(yield_per=SNAPSHOT_BATCH_SIZE)
+    )
+    if condition is not None:
+        statement = statement.where(condition)
+
+    chunks = {name: [] for name in NUMERIC + CATEGORICAL}
+    for partition in db.session.execute(statement).partitions():
+        rows = list(partition)
+        chunks["id"].append(np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows)))
+        chunks["day"].append(np.fromiter((_day_number(r[1]) for r in rows), dtype=np.int32, count=len(rows)))
+        chunks["hospital_id"].append(np.fromiter((r[2] for r in rows), dtype=np.int32, count=len(rows)))
+        chunks["patient_id"].append(np.fromiter((r[3] for r in rows), dtype=np.int32, count=len(rows)))
+        chunks["diagnosis_code"].append(np.fromiter(
+            (encoders["diagnosis_code"]((r[4] or "").strip().upper()) for r in rows), dtype=np.int32, count=len(rows)))
+        chunks["age_band"].append(np.fromiter((_age_band(r[5], r[1]) for r in rows), dtype=np.int8, count=len(rows)))
+        chunks["gender"].append(np.fromiter((encoders["gender"](r[6]) for r in rows), dtype=np.int16, count=len(rows)))
+        chunks["blood_type"].append(np.fromiter((encoders["blood_type"](r[7]) for r in rows), dtype=np.int16, count=len(rows)))
+        chunks["province"].append(np.fromiter(
+            (encoders["province"](_province(r[8], r[9])) for r in rows), dtype=np.int16, count=len(rows)))
+
+    empty = EncounterSnapshot.empty().columns
+    return {
+        name: np.concatenate(parts) if parts else empty[name].astype(
+            np.int64 if name == "id" else np.int32)
+        for name, parts in chunks.items()
+    }
+
+
+def build_snapshot(directory, full=False):
+    """Create or incrementally refresh the snapshot; returns rows written"""
+    started_at = datetime.utcnow()
+    snapshot = None
+    if not full and os.path.exists(os.path.join(directory, SNAPSHOT_FILE)):
+        snapshot = EncounterSnapshot.load(directory)
+
+    if snapshot is None or "watermark" not in snapshot.meta:
+        dictionaries = {name: [UNKNOWN] for name in CATEGORICAL}
+        columns = _fetch_rows(dictionaries)
+        changed = len(columns["id"])
+    else:
+        dictionaries = {name: list(values) for name, values in snapshot.dictionaries.items()}
+        since = datetime.fromisoformat(snapshot.meta["watermark"]) - WATERMARK_OVERLAP
+        changed_patients = select(Patient.id).where(Patient.updated_at >= since)
+        fresh = _fetch_rows(dictionaries, or_(
+            MedicalEncounter.id > snapshot.meta["max_id"],
+            MedicalEncounter.updated_at >= since,
+            MedicalEncounter.patient_id.in_(changed_patients),
+        ))
+        changed = len(fresh["id"])
+        # Replace re-read rows, append new ones, keep id order
+        keep = ~np.isin(snapshot.columns["id"], fresh["id"])
+        columns = {
+            name: np.concatenate([snapshot.columns[name][keep], fresh[name].astype(snapshot.columns[name].dtype)])
+            for name in snapshot.columns
+        }
+        order = np.argsort(columns["id"], kind="stable")
+        columns = {name: values[order] for name, values in columns.items()}
+
+    meta = {
+        "watermark": started_at.isoformat(),
+        "max_id": int(columns["id"].max()) if len(columns["id"]) else 0,
+        "rows": int(len(columns["id"])),
+    }
+    EncounterSnapshot(columns, dictionaries, meta).save(directory)
+    return changed
+
+
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+def load_snapshot(directory):
+    """Snapshot for a directory, reloaded only when the file is replaced; None if absent"""
+    try:
+        stat = os.stat(os.path.join(directory, SNAPSHOT_FILE))
+    except OSError:
+        return None
+    # A refresh renames a new file into place, so the inode changes even within one mtime tick
+    version = (stat.st_ino, stat.st_mtime_ns)
+    with _loaded_lock:
+        cached = _loaded.get(directory)
+        if cached is None or cached[0] != version:
+            cached = _loaded[directory] = (version, EncounterSnapshot.load(directory))
+        return cached[1]
+
+
+def snapshot_directory(instance_path):
+    return os.path.join(instance_path, "analytics")
+
+
+def epidemiology_report(snapshot, hospital_ids, weeks=12, top=10):
+    """Breakdowns shown on the reports page for a set of hospitals"""
+    if snapshot is None:
+        return None
+    filters = {
+        "hospital_id": hospital_ids,
+        "date_from": date.today() - timedelta(weeks=weeks),
+    }
+    return {
+        "top_diagnoses": snapshot.group_counts(["diagnosis_code"], filters, limit=top),
+        "age_bands": sorted(
+            snapshot.group_counts(["age_band"], filters),
+            key=lambda row: AGE_BANDS.index(row["age_band"]) if row["age_band"] in AGE_BANDS else len(AGE_BANDS),
+        ),
+        "genders": snapshot.group_counts(["gender"], filters),
+        "blood_types": snapshot.group_counts(["blood_type"], filters),
+        "provinces": snapshot.group_counts(["province"], filters),
+        "weekly": snapshot.time_series("week", filters),
+        "weeks": weeks,
+        "refreshed_at": datetime.fromisoformat(snapshot.meta["watermark"]) if "watermark" in snapshot.meta else None,
+    }
@@ -1,29 +1,50 @@
-from flask import (Flask, render_template, request, redirect, url_for, flash, session, jsonify, abort, )
-from flask_sqlalchemy import SQLAlchemy
+from flask import (Flask, render_template, request, redirect, url_for, flash, session, jsonify, abort, Response,
+                   send_file, )
 from flask_wtf import CSRFProtect
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.security import check_password_hash
 from functools import wraps
-from datetime import datetime, date, timedelta
-import uuid
-import qrcode
-import base64
+from datetime import datetime, date, timedelta, timezone
 from io import BytesIO
+import base64
 import json
-from datetime import datetime, timezone
 import uuid
-import base64
-import io
-from flask import Flask, render_template, request, redirect, url_for, flash, session, abort, jsonify, Response
-from datetime import datetime, timezone, timedelta
-from flask import request, jsonify, session, render_template, abort, redirect, url_for, flash, send_file
-now = datetime.now(timezone.utc)
 
 
 # Import models and forms
 from models import (db, Ministry, Hospital, HospitalAdmin, Patient, PatientIdentifier, Doctor, MedicalEncounter,
-                     AuditLog, PatientHospital, )
+                     AuditLog, PatientHospital, ExportJob, Job, PatientDuplicateCandidate, )
+from doctor_import import parse_doctor_file, import_doctors, stage_rows
+from prescriptions import backfill_encounter_medicines, drug_utilization, patients_prescribed
+from icd10 import get_catalog
+from record_search import search_encounters
+from fhir_export import RESOURCE_TYPES, export_directory
+from jobs import WorkerPool, enqueue, init_jobs
+from cache import init_cache
+from assets import build as build_assets, init_assets
+from credentials import authenticate, hash_password, init_credentials, rebuild_credentials
+from startup import init_startup
+from edge import (MAX_BATCH_SIZE as EDGE_MAX_BATCH_SIZE, apply_push as apply_edge_push,
+                  changes_since as edge_changes_since, export_snapshot, init_edge, make_token as make_edge_token,
+                  revoke_token as revoke_edge_token, run_sync as run_edge_sync,
+                  token_hospital as edge_token_hospital)
+from outbox import compact as compact_outbox, init_outbox, purge as purge_outbox, status as outbox_status
+from live_events import dashboard_channels, init_live_events, stream as event_stream
+from rollups import refresh_rollups, ministry_summary
+from analytics import DIMENSIONS, build_snapshot, epidemiology_report, load_snapshot, snapshot_directory
+from surveillance import WINDOW_DAYS, init_surveillance
+from cohorts import LIST_CRITERIA, init_cohorts, members_page
+from name_keys import backfill_name_keys, name_search_clause
+from patient_summaries import get_summary, init_patient_summaries, rebuild_all_summaries
+from timeline import PAGE_SIZE as TIMELINE_PAGE_SIZE, patient_timeline, timeline_entry
+from qr_rate_limit import init_qr_rate_limiter
+from qr_sheets import FORMATS as QR_SHEET_FORMATS, iter_sheet_archive, load_cards
+from qr_scans import MAX_BATCH_SIZE as QR_BATCH_SIZE, validate_scans
+from mpi import attributes, cluster_patients, find_candidates, identifier_owner, rebuild_blocking_keys, refresh_blocking_keys
+import os
+import click
 from forms import (LoginForm, HospitalForm, HospitalAdminForm, PatientForm, PatientIdentifierForm, DoctorForm,
-                   MedicalEncounterForm, PatientSearchForm, ChangePasswordForm, ProfileUpdateForm,
+                   DoctorImportForm, MedicalEncounterForm, PatientSearchForm, ChangePasswordForm, ProfileUpdateForm,
                    MedicalRecordSearchForm, json_to_contact_info, json_to_address, contact_info_to_form_data,
                    address_to_form_data, specialties_to_form_data, form_data_to_specialties, )
 
@@ -34,17 +55,50 @@ def create_app():
     # Configuration
     app.config["SECRET_KEY"] = "your-secret-key-change-in-production"
     csrf=CSRFProtect(app)
-    app.config["SQLALCHEMY_DATABASE_URI"] = (
-        "mysql+pymysql://root@localhost:3308/carecode?charset=utf8mb4"
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get(
+        "CARECODE_DATABASE_URL", "mysql+pymysql://root@localhost:3308/carecode?charset=utf8mb4"
     )
+    # Edge mode (see edge.py): serve one hospital from a local snapshot and sync with central
+    app.config["EDGE_HOSPITAL_ID"] = int(os.environ.get("CARECODE_EDGE_HOSPITAL_ID") or 0) or None
+    app.config["EDGE_CENTRAL_URL"] = os.environ.get("CARECODE_CENTRAL_URL")
+    app.config["EDGE_SYNC_TOKEN"] = os.environ.get("CARECODE_EDGE_TOKEN")
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # Reverse proxies in front of the WSGI server whose X-Forwarded-For is trusted, so
+    # request.remote_addr (rate limits, audit logs) is the client's. 0 when clients connect
+    # directly; under uvicorn (asgi.py) use its --forwarded-allow-ips instead.
+    app.config["PROXY_X_FOR"] = int(os.environ.get("CARECODE_PROXY_X_FOR") or 0)
+    # Also match names with ILIKE (a table scan) while patient_name_keys is being backfilled
+    app.config["NAME_SEARCH_SUBSTRING_FALLBACK"] = os.environ.get("CARECODE_NAME_SEARCH_FALLBACK") == "1"
+    # Stream live dashboard events; asgi.py turns this on, WSGI workers can't afford idle streams
+    app.config["LIVE_EVENTS"] = os.environ.get("CARECODE_LIVE_EVENTS") == "1"
+    # werkzeug method syntax; existing hashes are upgraded as users log in
+    app.config["PASSWORD_HASH_METHOD"] = os.environ.get("CARECODE_PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+    # Work done before the first request, see startup.py: templates, pool, reference, indexes
+    app.config["WARMUP"] = tuple(
+        step.strip() for step in os.environ.get("CARECODE_WARMUP", "").split(",") if step.strip()
+    )
+    app.config["ICD10_CATALOG_PATH"] = os.path.join(app.root_path, "data", "icd10_codes.tsv")
     app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
         "pool_pre_ping": True,
         "pool_recycle": 300,
     }
 
+    if app.config["PROXY_X_FOR"]:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["PROXY_X_FOR"])
+
     # Initialize extensions
     db.init_app(app)
+    surveillance = init_surveillance(app)
+    cohort_index = init_cohorts(app)
+    init_patient_summaries()
+    qr_limiter = init_qr_rate_limiter(app)
+    init_jobs(app)
+    live_events = init_live_events(app)
+    cache = init_cache(app)
+    init_outbox(app)
+    init_edge(app)
+    init_credentials(app)
+    asset_bundles = init_assets(app)
 
     # Authentication decorators
     def login_required(f):
@@ -93,6 +147,8 @@ def create_app():
 
     def generate_qr_code(data):
         """Generate QR code and return base64 encoded image"""
+        import qrcode  # Loaded on first use, like Patient.generate_qr_code
+
         qr = qrcode.QRCode(version=1, box_size=10, border=5)
         qr.add_data(data)
         qr.make(fit=True)
@@ -105,6 +161,11 @@ def create_app():
         return base64.b64encode(buffer.getvalue()).decode()
 
     # Routes
+    @app.route("/assets/<path:filename>")
+    def assets(filename):
+        """Fingerprinted CSS/JS bundles, precompressed and cached for good"""
+        return asset_bundles.response(filename)
+
     @app.route("/")
     def index():
         if "user_id" in session:
@@ -118,31 +179,17 @@ def create_app():
 
         form = LoginForm()
         if form.validate_on_submit():
-            username = form.username.data
-            password = form.password.data
-
-            # Try hospital admin login
-            hospital_admin = HospitalAdmin.query.filter_by(
-                username=username, is_active=True
-            ).first()
-            if hospital_admin and check_password_hash(
-                    hospital_admin.password_hash, password
-            ):
-                session["user_id"] = hospital_admin.id
-                session["user_type"] = "hospital_admin"
-                session["username"] = hospital_admin.username
-                session["hospital_id"] = hospital_admin.hospital_id
-                flash(f"Welcome, {hospital_admin.full_name}!", "success")
-                return redirect(url_for("dashboard"))
-
-            # Try doctor login
-            doctor = Doctor.query.filter_by(license_no=username, is_active=True).first()
-            if doctor and check_password_hash(doctor.password_hash, password):
-                session["user_id"] = doctor.id
-                session["user_type"] = "doctor"
-                session["username"] = doctor.license_no
-                session["hospital_id"] = doctor.hospital_id
-                flash(f"Welcome, Dr. {doctor.full_name}!", "success")
+            # One indexed lookup over admins, doctors and ministries
+            credential = authenticate(form.username.data, form.password.data)
+            if credential:
+                session["user_id"] = credential.user_id
+                session["user_type"] = credential.user_type
+                session["username"] = credential.login_name
+                session["hospital_id"] = credential.hospital_id
+                if credential.user_type == "ministry":
+                    session["ministry_id"] = credential.user_id
+                title = "Dr. " if credential.user_type == "doctor" else ""
+                flash(f"Welcome, {title}{credential.display_name}!", "success")
                 return redirect(url_for("dashboard"))
 
             flash("Invalid username or password", "error")
@@ -155,6 +202,42 @@ def create_app():
         flash("You have been logged out", "info")
         return redirect(url_for("index"))
 
+    @cache.cached("hospital_counts", tags=lambda hospital_id: [f"hospital:{hospital_id}"])
+    def hospital_counts(hospital_id):
+        return {
+            "total_patients": Patient.query.filter_by(created_by_hospital=hospital_id).count(),
+            "total_doctors": Doctor.query.filter_by(hospital_id=hospital_id).count(),
+            "total_encounters": MedicalEncounter.query.filter_by(hospital_id=hospital_id).count(),
+        }
+
+    # Keyed by day as well, since "today" moves without any commit
+    @cache.cached("doctor_counts", tags=lambda doctor_id: [f"doctor:{doctor_id}"],
+                  key=lambda doctor_id: f"{doctor_id}:{date.today().isoformat()}")
+    def doctor_counts(doctor_id):
+        return {
+            "today_encounters": MedicalEncounter.query.filter_by(
+                doctor_id=doctor_id, treatment_date=date.today()
+            ).count(),
+            "total_encounters": MedicalEncounter.query.filter_by(doctor_id=doctor_id).count(),
+            "total_patients_treated": db.session.query(MedicalEncounter.patient_id)
+            .filter_by(doctor_id=doctor_id)
+            .distinct()
+            .count(),
+        }
+
+    @cache.fragment("recent_encounters", tags=lambda scope, scope_id: [f"{scope}:{scope_id}"])
+    def recent_encounters_fragment(scope, scope_id):
+        """Rendered list items of the five latest encounters of a hospital or doctor"""
+        column = MedicalEncounter.hospital_id if scope == "hospital" else MedicalEncounter.doctor_id
+        encounters = (
+            MedicalEncounter.query.options(db.joinedload(MedicalEncounter.patient))
+            .filter(column == scope_id)
+            .order_by(MedicalEncounter.created_at.desc())
+            .limit(5)
+            .all()
+        )
+        return render_template("_recent_encounters.html", recent_encounters=encounters)
+
     @app.route("/dashboard")
     @login_required
     def dashboard():
@@ -164,52 +247,57 @@ def create_app():
         if user_type == "hospital_admin":
             admin = HospitalAdmin.query.get(session["user_id"])
             hospital = Hospital.query.get(session["hospital_id"])
+            counts = hospital_counts(hospital.id)
             context.update(
                 {
                     "admin": admin,
                     "hospital": hospital,
-                    "total_patients": Patient.query.filter_by(
-                        created_by_hospital=hospital.id
-                    ).count(),
-                    "total_doctors": Doctor.query.filter_by(
-                        hospital_id=hospital.id
-                    ).count(),
-                    "recent_encounters": MedicalEncounter.query.filter_by(
-                        hospital_id=hospital.id
-                    )
-                    .order_by(MedicalEncounter.created_at.desc())
-                    .limit(5)
-                    .all(),
+                    "total_patients": counts["total_patients"],
+                    "total_doctors": counts["total_doctors"],
+                    "recent_encounters_html": recent_encounters_fragment("hospital", hospital.id),
                 }
             )
+            context["counters"] = [
+                ("total_patients", "Patients", context["total_patients"], "primary"),
+                ("total_doctors", "Doctors", context["total_doctors"], "success"),
+            ]
 
         elif user_type == "doctor":
             doctor = Doctor.query.get(session["user_id"])
             hospital = Hospital.query.get(session["hospital_id"])
+            counts = doctor_counts(doctor.id)
             context.update(
                 {
                     "doctor": doctor,
                     "hospital": hospital,
-                    "today_encounters": MedicalEncounter.query.filter_by(
-                        doctor_id=doctor.id, treatment_date=date.today()
-                    ).count(),
-                    "total_patients_treated": db.session.query(
-                        MedicalEncounter.patient_id
-                    )
-                    .filter_by(doctor_id=doctor.id)
-                    .distinct()
-                    .count(),
-                    "recent_encounters": MedicalEncounter.query.filter_by(
-                        doctor_id=doctor.id
-                    )
-                    .order_by(MedicalEncounter.created_at.desc())
-                    .limit(5)
-                    .all(),
+                    "today_encounters": counts["today_encounters"],
+                    "total_patients_treated": counts["total_patients_treated"],
+                    "recent_encounters_html": recent_encounters_fragment("doctor", doctor.id),
                 }
             )
+            context["counters"] = [
+                ("today_encounters", "Encounters Today", context["today_encounters"], "primary"),
+                ("total_patients_treated", "Patients Treated", context["total_patients_treated"], "success"),
+            ]
 
         return render_template("dashboard.html", **context)
 
+    @app.route("/events/dashboard")
+    @login_required
+    def dashboard_events():
+        """Server-sent events with new encounters and counter deltas for the dashboard"""
+        if not app.config["LIVE_EVENTS"]:
+            # 204 tells EventSource not to reconnect; the page keeps its rendered counters
+            return "", 204
+        channels = dashboard_channels(session)
+        if not channels:
+            abort(403)
+        return Response(
+            event_stream(live_events, channels),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
     # Hospital Admin routes
     @app.route("/hospitals")
     @hospital_admin_required
@@ -283,7 +371,8 @@ def create_app():
     @app.route("/patients")
     @login_required
     def patients():
-        search_form = PatientSearchForm()
+        # The search form is submitted with GET, so read it from the query string
+        search_form = PatientSearchForm(request.args, meta={"csrf": False})
         query = Patient.query
 
         # Hospital admins and doctors can only see their hospital's patients
@@ -294,16 +383,21 @@ def create_app():
         # Apply search filters
         if search_form.validate() and search_form.search_term.data:
             search_term = f"%{search_form.search_term.data}%"
+            # Names go through the phonetic key index, so spelling variants match
+            name_clause = name_search_clause(
+                search_form.search_term.data, app.config["NAME_SEARCH_SUBSTRING_FALLBACK"]
+            )
+
             if search_form.search_type.data == "name":
-                query = query.filter(Patient.full_name.ilike(search_term))
+                query = query.filter(name_clause)
             elif search_form.search_type.data == "email":
                 query = query.filter(Patient.email.ilike(search_term))
             elif search_form.search_type.data == "phone":
                 # Search in JSON contact_info field
                 query = query.filter(
                     db.or_(
-                        Patient.contact_info['phone_primary'].astext.ilike(search_term),
-                        Patient.contact_info['phone_secondary'].astext.ilike(search_term)
+                        Patient.contact_info['phone_primary'].as_string().ilike(search_term),
+                        Patient.contact_info['phone_secondary'].as_string().ilike(search_term)
                     )
                 )
             elif search_form.search_type.data == "identifier":
@@ -313,10 +407,10 @@ def create_app():
             else:  # all fields
                 query = query.filter(
                     db.or_(
-                        Patient.full_name.ilike(search_term),
+                        name_clause,
                         Patient.email.ilike(search_term),
                         Patient.guardian_number.ilike(search_term),
-                        Patient.contact_info['phone_primary'].astext.ilike(search_term)
+                        Patient.contact_info['phone_primary'].as_string().ilike(search_term)
                     )
                 )
 
@@ -338,25 +432,34 @@ def create_app():
         """QR Scanner page for doctors"""
         return render_template("qr_scanner.html")
 
-    import qrcode
-    import io
-    import base64
-    from flask import request, url_for, render_template
-
     # New public route for QR code access
     @app.route('/patient/qr/<token>')
     def patient_qr_view(token):
         """Public route accessible via QR code - no login required"""
-        patient = Patient.query.filter_by(qr_token=token, is_active=True).first()
+        # Decided before any query so token guessing cannot reach the database
+        verdict, retry_after = qr_limiter.check(request.remote_addr, token)
+        if verdict == "rate_limited":
+            return "Too many requests. Please try again shortly.", 429, {"Retry-After": str(int(retry_after) + 1)}
+        if verdict == "invalid":
+            flash('Invalid or expired patient QR code.', 'error')
+            return redirect(url_for('index'))
 
-        if not patient:
+        summary = get_summary(qr_token=token)
+        if summary is None:
+            qr_limiter.remember_invalid(token)
+
+        if not summary or not summary.is_active:
             flash('Invalid or expired patient QR code.', 'error')
             return redirect(url_for('index'))
 
-        # Log the QR access for audit purposes
-        # You might want to add audit logging here
+        # Clinical details are only shown to signed-in staff of a hospital that treats the patient
+        show_clinical = session.get("hospital_id") in summary.hospital_ids
+        log_audit("patient_qr_viewed", patient_id=summary.patient_id,
+                  details={"clinical": show_clinical})
+        db.session.commit()
 
-        return render_template('patient_qr_view.html', patient=patient)
+        return render_template('patient_qr_view.html', summary=json.loads(summary.document),
+                               show_clinical=show_clinical)
 
 
 
@@ -381,22 +484,49 @@ def create_app():
         # if patient.created_by_hospital != session["hospital_id"]:
         #     abort(403)
 
-        encounters = (
-            MedicalEncounter.query.filter_by(patient_id=patient_id)
-            .order_by(MedicalEncounter.treatment_date.desc())
-            .all()
-        )
+        # First page only; the template loads older encounters from the timeline API
+        encounters, next_cursor = patient_timeline(patient_id)
         identifiers = PatientIdentifier.query.filter_by(patient_id=patient_id).all()
 
         log_audit("patient_viewed", patient_id=patient_id)
+        db.session.commit()
 
         return render_template(
             "patients/detail.html",
             patient=patient,
             encounters=encounters,
+            next_cursor=next_cursor,
             identifiers=identifiers,
         )
 
+    @app.route("/api/patients/<int:patient_id>/timeline")
+    @login_required
+    def patient_timeline_api(patient_id):
+        """Encounters newest first, paged with ?cursor=, filterable by hospital and date"""
+        patient = Patient.query.get_or_404(patient_id)
+        # The hospitals on the patient's summary card: where registered or since seen
+        if not can_access_patient(patient.id):
+            abort(403)
+        limit = max(1, min(request.args.get("limit", TIMELINE_PAGE_SIZE, type=int), 100))
+
+        encounters, next_cursor = patient_timeline(
+            patient.id,
+            hospital_id=request.args.get("hospital_id", type=int),
+            date_from=request.args.get("date_from", type=date.fromisoformat),
+            date_to=request.args.get("date_to", type=date.fromisoformat),
+            cursor=request.args.get("cursor"),
+            limit=limit,
+        )
+
+        entries = []
+        for encounter in encounters:
+            entry = timeline_entry(encounter)
+            if session.get("user_type") == "doctor" and encounter.doctor_id == session.get("user_id"):
+                entry["edit_url"] = url_for("edit_encounter", encounter_id=encounter.id)
+            entries.append(entry)
+
+        return jsonify({"encounters": entries, "next_cursor": next_cursor})
+
     @app.route("/patients/<int:patient_id>/edit", methods=["GET", "POST"])
     @login_required
     def edit_patient(patient_id):
@@ -432,6 +562,8 @@ def create_app():
             patient.blood_type = form.blood_type.data or None
             patient.guardian_number = form.guardian_number.data
             patient.updated_at = datetime.now(timezone.utc)
+            db.session.flush()
+            refresh_blocking_keys(patient)
 
             db.session.commit()
 
@@ -475,10 +607,10 @@ def create_app():
         form = PatientIdentifierForm()
 
         if form.validate_on_submit():
-            # Check for duplicate identifier
+            # Check for duplicate identifier, in any spelling (e.g. old and new NIC formats)
             existing = PatientIdentifier.query.filter_by(
                 id_type=form.id_type.data, id_value=form.id_value.data
-            ).first()
+            ).first() or identifier_owner(form.id_type.data, form.id_value.data, exclude_id=patient_id)
 
             if existing:
                 flash("This identifier already exists for another patient", "error")
@@ -494,6 +626,8 @@ def create_app():
             )
 
             db.session.add(identifier)
+            db.session.flush()
+            refresh_blocking_keys(patient)
             db.session.commit()
 
             log_audit(
@@ -536,7 +670,7 @@ def create_app():
             doctor = Doctor(
                 hospital_id=session["hospital_id"],
                 license_no=form.license_no.data,
-                password_hash=generate_password_hash(form.password.data),
+                password_hash=hash_password(form.password.data),
                 full_name=form.full_name.data,
                 nic=form.nic.data,
                 contact_info=contact_info,
@@ -561,6 +695,50 @@ def create_app():
 
         return render_template("doctors/add.html", form=form)
 
+    @app.route("/doctors/import", methods=["GET", "POST"])
+    @hospital_admin_required
+    def import_doctors_view():
+        """Upload a doctor registry; the import runs as a background job.
+
+        Redirects to ?job=<id>, which shows the job's progress and then its
+        summary (also at /api/jobs/<id>).
+        """
+        form = DoctorImportForm()
+        if form.validate_on_submit():
+            upload = form.registry_file.data
+            try:
+                rows = parse_doctor_file(upload.stream, upload.filename)
+            except ValueError as e:
+                flash(f"Could not read registry file: {str(e)}", "error")
+                return render_template("doctors/import.html", form=form, job=None, result=None)
+
+            job = enqueue(
+                "doctor_import",
+                {
+                    "staged_file": stage_rows(app.instance_path, rows),
+                    "hospital_id": session["hospital_id"],
+                    "filename": upload.filename,
+                    "acting_user_type": session.get("user_type"),
+                    "acting_user_id": session.get("user_id"),
+                },
+                hospital_id=session["hospital_id"],
+                requested_by_type=session.get("user_type"),
+                requested_by_id=session.get("user_id"),
+            )
+            log_audit("doctors_import_requested", details={"filename": upload.filename, "rows": len(rows)})
+            db.session.commit()
+
+            flash(f"Import of {len(rows)} rows queued as job #{job.id}.", "success")
+            return redirect(url_for("import_doctors_view", job=job.id))
+
+        job = None
+        if request.args.get("job", type=int):
+            job = db.session.get(Job, request.args.get("job", type=int))
+            if job is None or job.name != "doctor_import" or job.hospital_id != session["hospital_id"]:
+                abort(404)
+        result = job.result if job is not None and job.status == "succeeded" else None
+        return render_template("doctors/import.html", form=form, job=job, result=result)
+
     @app.route("/doctors/<int:doctor_id>/edit", methods=["GET", "POST"])
     @hospital_admin_required
     def edit_doctor(doctor_id):
@@ -584,7 +762,7 @@ def create_app():
 
             doctor.license_no = form.license_no.data
             if form.password.data:  # Only update password if provided
-                doctor.password_hash = generate_password_hash(form.password.data)
+                doctor.password_hash = hash_password(form.password.data)
             doctor.full_name = form.full_name.data
             doctor.nic = form.nic.data
             doctor.contact_info = contact_info
@@ -691,10 +869,10 @@ def create_app():
                 hospital_id=session["hospital_id"],
                 diagnosis_text=form.diagnosis_text.data,
                 diagnosis_code=form.diagnosis_code.data,
-                medicines=medicines,
                 suggestions=form.suggestions.data,
                 treatment_date=form.treatment_date.data,
             )
+            encounter.set_prescriptions(medicines)
 
             db.session.add(encounter)
             db.session.commit()
@@ -708,6 +886,8 @@ def create_app():
                 },
             )
             flash("Medical encounter recorded successfully!", "success")
+            if form.diagnosis_code_warning:
+                flash(form.diagnosis_code_warning, "warning")
             return redirect(url_for("patient_detail", patient_id=patient_id))
 
         return render_template(
@@ -730,9 +910,9 @@ def create_app():
             encounter.receipt_number = form.receipt_number.data
             encounter.diagnosis_text = form.diagnosis_text.data
             encounter.diagnosis_code = form.diagnosis_code.data
-            encounter.medicines = medicines
             encounter.suggestions = form.suggestions.data
             encounter.treatment_date = form.treatment_date.data
+            encounter.set_prescriptions(medicines)
 
             db.session.commit()
 
@@ -745,6 +925,8 @@ def create_app():
                 },
             )
             flash("Medical encounter updated successfully!", "success")
+            if form.diagnosis_code_warning:
+                flash(form.diagnosis_code_warning, "warning")
             return redirect(url_for("patient_detail", patient_id=encounter.patient_id))
 
         # Pre-populate form
@@ -756,8 +938,7 @@ def create_app():
             form.suggestions.data = encounter.suggestions
             form.treatment_date.data = encounter.treatment_date
 
-            if encounter.medicines:
-                form.populate_medicine_fields(encounter.medicines)
+            form.populate_medicine_fields(encounter.medicine_list())
 
         return render_template("encounters/edit.html", form=form, encounter=encounter)
 
@@ -779,7 +960,7 @@ def create_app():
         patients = (
             query.filter(
                 db.or_(
-                    Patient.full_name.ilike(search_term),
+                    name_search_clause(term, app.config["NAME_SEARCH_SUBSTRING_FALLBACK"]),
                     Patient.email.ilike(search_term),
                 )
             )
@@ -816,6 +997,16 @@ def create_app():
 
         return jsonify(results)
 
+    @app.route("/api/icd10/search")
+    @login_required
+    def icd10_search_api():
+        """Autocomplete ICD-10 codes by code prefix or description words"""
+        term = request.args.get("q", "").strip()
+        if not term:
+            return jsonify([])
+        limit = min(request.args.get("limit", 10, type=int), 50)
+        return jsonify(get_catalog().search(term, limit=limit))
+
     @app.route("/profile", methods=["GET", "POST"])
     @login_required
     def profile():
@@ -887,7 +1078,7 @@ def create_app():
                 return render_template("change_password.html", form=form)
 
             # Update password
-            user.password_hash = generate_password_hash(form.new_password.data)
+            user.password_hash = hash_password(form.new_password.data)
             db.session.commit()
 
             log_audit("password_changed", details={"user_type": user_type})
@@ -896,10 +1087,8 @@ def create_app():
 
         return render_template("change_password.html", form=form)
 
-    @app.route("/medical-records")
-    @login_required
-    def medical_records():
-        search_form = MedicalRecordSearchForm()
+    def scoped_encounter_search(search_form, cursor):
+        """Run the record search within the current user's access scope"""
         query = MedicalEncounter.query
 
         # Apply hospital restrictions
@@ -908,38 +1097,70 @@ def create_app():
         elif session.get("user_type") == "hospital_admin":
             query = query.filter_by(hospital_id=session["hospital_id"])
 
-        # Apply search filters if provided
-        if request.args.get("search"):
-            if search_form.patient_name.data:
-                query = query.join(Patient).filter(
-                    Patient.full_name.ilike(f"%{search_form.patient_name.data}%")
-                )
-            if search_form.doctor_name.data:
-                query = query.join(Doctor).filter(
-                    Doctor.full_name.ilike(f"%{search_form.doctor_name.data}%")
-                )
-            if search_form.diagnosis_keyword.data:
-                query = query.filter(
-                    MedicalEncounter.diagnosis_text.ilike(
-                        f"%{search_form.diagnosis_keyword.data}%"
-                    )
-                )
-            if search_form.date_from.data:
-                query = query.filter(
-                    MedicalEncounter.treatment_date >= search_form.date_from.data
-                )
-            if search_form.date_to.data:
-                query = query.filter(
-                    MedicalEncounter.treatment_date <= search_form.date_to.data
-                )
+        query = query.options(
+            db.joinedload(MedicalEncounter.patient),
+            db.joinedload(MedicalEncounter.doctor),
+            db.joinedload(MedicalEncounter.hospital),
+            db.selectinload(MedicalEncounter.prescriptions),
+        )
+        return search_encounters(
+            query,
+            patient_name=search_form.patient_name.data,
+            doctor_name=search_form.doctor_name.data,
+            keyword=search_form.diagnosis_keyword.data,
+            date_from=search_form.date_from.data,
+            date_to=search_form.date_to.data,
+            cursor=cursor,
+        )
 
-        encounters = (
-            query.order_by(MedicalEncounter.treatment_date.desc()).limit(100).all()
+    @app.route("/medical-records")
+    @login_required
+    def medical_records():
+        # GET search: read filters from the query string rather than a POST body
+        search_form = MedicalRecordSearchForm(request.args, meta={"csrf": False})
+        search_form.validate()
+
+        encounters, next_cursor = scoped_encounter_search(
+            search_form, request.args.get("cursor")
         )
+        next_page_args = None
+        if next_cursor:
+            next_page_args = request.args.to_dict()
+            next_page_args["cursor"] = next_cursor
+
         return render_template(
-            "medical_records.html", encounters=encounters, search_form=search_form
+            "medical_records.html",
+            encounters=encounters,
+            search_form=search_form,
+            next_page_args=next_page_args,
         )
 
+    @app.route("/api/medical-records/search")
+    @login_required
+    def medical_records_search_api():
+        search_form = MedicalRecordSearchForm(request.args, meta={"csrf": False})
+        search_form.validate()
+
+        encounters, next_cursor = scoped_encounter_search(
+            search_form, request.args.get("cursor")
+        )
+        return jsonify({
+            "results": [
+                {
+                    "id": encounter.id,
+                    "date": encounter.treatment_date.strftime("%Y-%m-%d"),
+                    "patient_id": encounter.patient_id,
+                    "patient": encounter.patient.full_name,
+                    "doctor": encounter.doctor.full_name if encounter.doctor else "Unknown",
+                    "hospital": encounter.hospital.name,
+                    "diagnosis": encounter.diagnosis_text,
+                    "diagnosis_code": encounter.diagnosis_code,
+                }
+                for encounter in encounters
+            ],
+            "next_cursor": next_cursor,
+        })
+
     @app.route("/reports")
     @login_required
     def reports():
@@ -947,45 +1168,407 @@ def create_app():
 
         if user_type == "hospital_admin":
             hospital = Hospital.query.get(session["hospital_id"])
-
-            total_patients = Patient.query.filter_by(
-                created_by_hospital=hospital.id
-            ).count()
-            total_doctors = Doctor.query.filter_by(hospital_id=hospital.id).count()
-            total_encounters = MedicalEncounter.query.filter_by(
-                hospital_id=hospital.id
-            ).count()
+            counts = hospital_counts(hospital.id)
 
             context = {
                 "hospital": hospital,
-                "total_patients": total_patients,
-                "total_doctors": total_doctors,
-                "total_encounters": total_encounters,
+                "total_patients": counts["total_patients"],
+                "total_doctors": counts["total_doctors"],
+                "total_encounters": counts["total_encounters"],
+                "analytics": epidemiology_report(
+                    load_snapshot(snapshot_directory(app.instance_path)), [hospital.id]
+                ),
             }
 
         elif user_type == "doctor":
             doctor = Doctor.query.get(session["user_id"])
             hospital = Hospital.query.get(session["hospital_id"])
-
-            total_encounters = MedicalEncounter.query.filter_by(
-                doctor_id=doctor.id
-            ).count()
-            total_patients = (
-                db.session.query(MedicalEncounter.patient_id)
-                .filter_by(doctor_id=doctor.id)
-                .distinct()
-                .count()
-            )
+            counts = doctor_counts(doctor.id)
 
             context = {
                 "doctor": doctor,
                 "hospital": hospital,
-                "total_encounters": total_encounters,
-                "total_patients": total_patients,
+                "total_encounters": counts["total_encounters"],
+                "total_patients": counts["total_patients_treated"],
+            }
+
+        elif user_type == "ministry":
+            ministry = Ministry.query.get(session["ministry_id"])
+            hospitals = (
+                Hospital.query.filter_by(ministry_id=ministry.id)
+                .order_by(Hospital.name)
+                .all()
+            )
+
+            # Precomputed by the refresh-rollups command; no counting here
+            context = {
+                "ministry": ministry,
+                "hospitals": hospitals,
+                "total_hospitals": len(hospitals),
+                **ministry_summary(ministry.id),
+                "analytics": epidemiology_report(
+                    load_snapshot(snapshot_directory(app.instance_path)), [h.id for h in hospitals]
+                ),
             }
 
         return render_template("reports.html", **context, user_type=user_type)
 
+    @app.route("/api/reports/drug-utilization")
+    @hospital_admin_required
+    def drug_utilization_api():
+        """Top prescribed drugs for the admin's hospital, or patients for one drug"""
+        date_from = request.args.get("date_from", type=date.fromisoformat)
+        date_to = request.args.get("date_to", type=date.fromisoformat)
+        drug = request.args.get("drug", "").strip()
+
+        if drug:
+            return jsonify({
+                "drug_name": drug,
+                "patients": patients_prescribed(
+                    drug, session["hospital_id"], date_from, date_to
+                ),
+            })
+
+        limit = min(request.args.get("limit", 50, type=int), 500)
+        return jsonify({
+            "drugs": drug_utilization(session["hospital_id"], date_from, date_to, limit),
+        })
+
+    @app.route("/api/analytics/encounters")
+    @login_required
+    def encounter_analytics_api():
+        """Grouped encounter counts or a time series from the analytics snapshot"""
+        user_type = session.get("user_type")
+        if user_type == "ministry":
+            hospital_ids = [
+                h.id for h in Hospital.query.filter_by(ministry_id=session["ministry_id"])
+            ]
+        elif user_type == "hospital_admin":
+            hospital_ids = [session["hospital_id"]]
+        else:
+            abort(403)
+
+        snapshot = load_snapshot(snapshot_directory(app.instance_path))
+        if snapshot is None:
+            return jsonify({"error": "Analytics snapshot has not been built yet"}), 503
+
+        by = [d.strip() for d in request.args.get("by", "diagnosis_code").split(",") if d.strip()]
+        unknown = [d for d in by if d not in DIMENSIONS]
+        if unknown:
+            return jsonify({"error": f"Unknown dimension: {', '.join(unknown)}"}), 400
+
+        filters = {
+            "hospital_id": hospital_ids,
+            "date_from": request.args.get("date_from", type=date.fromisoformat),
+            "date_to": request.args.get("date_to", type=date.fromisoformat),
+        }
+        for name in ("diagnosis_code", "gender", "blood_type", "province", "age_band"):
+            values = request.args.getlist(name)
+            if values:
+                filters[name] = values
+
+        interval = request.args.get("interval")
+        if interval:
+            if interval not in ("day", "week", "month") or len(by) > 1:
+                return jsonify({"error": "interval must be day, week or month with at most one dimension"}), 400
+            split = by[0] if "by" in request.args else None
+            rows = snapshot.time_series(interval, filters, by=split)
+        else:
+            limit = min(request.args.get("limit", 100, type=int), 1000)
+            rows = snapshot.group_counts(by, filters, limit=limit)
+
+        return jsonify({"rows": rows, "refreshed_at": snapshot.meta.get("watermark")})
+
+    @app.route("/api/surveillance")
+    @login_required
+    def surveillance_api():
+        """Daily encounter counts per diagnosis and region, with spike alerts"""
+        if session.get("user_type") not in ("ministry", "hospital_admin"):
+            abort(403)
+
+        days = max(1, min(request.args.get("days", 14, type=int), WINDOW_DAYS))
+        level = "district" if request.args.get("level") == "district" else "province"
+        province = request.args.get("province", "").strip().title() or None
+        code = request.args.get("code", "").strip().upper() or None
+        limit = min(request.args.get("limit", 50, type=int), 500)
+
+        surveillance.ensure_current()
+        first_day = date.today() - timedelta(days=days - 1)
+        series = [
+            {
+                "diagnosis_code": series_code,
+                "region": region,
+                "total": sum(cells.values()),
+                "daily": [
+                    {"date": day.isoformat(), "count": cells.get(day.toordinal(), 0)}
+                    for day in (first_day + timedelta(days=i) for i in range(days))
+                ],
+            }
+            for (series_code, region), cells in surveillance.daily_counts(days, level, province, code).items()
+        ]
+        series.sort(key=lambda s: -s["total"])
+
+        return jsonify({
+            "as_of": datetime.utcnow().isoformat(),
+            "level": level,
+            "series": series[:limit],
+            "spikes": surveillance.spikes(level, province, code),
+        })
+
+    def edge_site():
+        """Hospital of the edge site calling a sync endpoint; 401/404 otherwise"""
+        if app.config["EDGE_HOSPITAL_ID"]:
+            abort(404)  # edge sites sync with central, not with each other
+        hospital_id = edge_token_hospital(app, request.headers.get("Authorization"))
+        if hospital_id is None:
+            abort(401)
+        return hospital_id
+
+    @app.route("/api/edge/changes")
+    def edge_changes():
+        """Central changes for an edge site after its last applied offset"""
+        hospital_id = edge_site()
+        after = request.args.get("after", 0, type=int)
+        limit = min(max(request.args.get("limit", 200, type=int), 1), EDGE_MAX_BATCH_SIZE)
+        changes, offset = edge_changes_since(hospital_id, after, limit)
+        return jsonify({"changes": changes, "offset": offset})
+
+    @app.route("/api/edge/push", methods=["POST"])
+    @csrf.exempt
+    def edge_push():
+        """Apply a batch of changes made at an edge site"""
+        hospital_id = edge_site()
+        changes = (request.get_json(silent=True) or {}).get("changes")
+        if not isinstance(changes, list) or len(changes) > EDGE_MAX_BATCH_SIZE:
+            return jsonify({"error": f"Send a list of at most {EDGE_MAX_BATCH_SIZE} changes"}), 400
+        return jsonify({"results": apply_edge_push(hospital_id, changes)})
+
+    @app.route("/api/cache/stats")
+    @login_required
+    def cache_stats():
+        """Hit/miss metrics per cache and backend size"""
+        if session.get("user_type") not in ("ministry", "hospital_admin"):
+            abort(403)
+        return jsonify({"as_of": datetime.utcnow().isoformat(), **cache.stats()})
+
+    @app.route("/api/qr-rate-limit")
+    @login_required
+    def qr_rate_limit_counters():
+        """Counters of the public QR route limiter, shared by all workers on this host"""
+        if session.get("user_type") not in ("ministry", "hospital_admin"):
+            abort(403)
+        return jsonify({"as_of": datetime.utcnow().isoformat(), "counters": qr_limiter.counters()})
+
+    def parse_cohort_criteria(data):
+        """Validate a cohort criteria JSON object; raises ValueError"""
+        if not isinstance(data, dict):
+            raise ValueError("criteria must be an object")
+        criteria = {}
+        for name in LIST_CRITERIA:
+            if data.get(name) is not None:
+                values = data[name] if isinstance(data[name], list) else [data[name]]
+                criteria[name] = [int(v) for v in values] if name == "hospital_id" else [str(v) for v in values]
+        for name in ("age_min", "age_max"):
+            if data.get(name) is not None:
+                criteria[name] = int(data[name])
+        if data.get("diagnosis_codes"):
+            codes = data["diagnosis_codes"]
+            criteria["diagnosis_codes"] = [str(c) for c in (codes if isinstance(codes, list) else [codes])]
+        for name in ("diagnosed_from", "diagnosed_to"):
+            if data.get(name):
+                criteria[name] = date.fromisoformat(data[name])
+        if data.get("exclude"):
+            criteria["exclude"] = parse_cohort_criteria(data["exclude"])
+        return criteria
+
+    @app.route("/api/cohorts", methods=["POST"])
+    @login_required
+    def cohort_api():
+        """Count and page through the patients matching a cohort definition"""
+        user_type = session.get("user_type")
+        if user_type == "ministry":
+            scope = [h.id for h in Hospital.query.filter_by(ministry_id=session["ministry_id"])]
+        elif user_type == "hospital_admin":
+            scope = [session["hospital_id"]]
+        else:
+            abort(403)
+
+        data = request.get_json(silent=True) or {}
+        try:
+            criteria = parse_cohort_criteria(data.get("criteria", {}))
+        except (ValueError, TypeError) as e:
+            return jsonify({"error": f"Invalid criteria: {e}"}), 400
+        if "hospital_id" in criteria:
+            if not set(criteria["hospital_id"]) & set(scope):
+                return jsonify({"error": "Requested hospitals are outside your scope"}), 403
+            criteria["hospital_id"] = [h for h in criteria["hospital_id"] if h in scope]
+
+        cohort_index.ensure_current()
+        bitmap = cohort_index.evaluate(criteria, scope=scope)
+        response = {"count": len(bitmap)}
+
+        if data.get("members"):
+            limit = max(1, min(int(data.get("limit", 100)), 1000))
+            ids, next_cursor = members_page(bitmap, after=int(data.get("cursor") or 0), limit=limit)
+            patients = {p.id: p for p in Patient.query.filter(Patient.id.in_(ids))} if ids else {}
+            response["members"] = [
+                {
+                    "id": patients[i].id,
+                    "full_name": patients[i].full_name,
+                    "date_of_birth": patients[i].date_of_birth.isoformat() if patients[i].date_of_birth else None,
+                    "gender": patients[i].gender,
+                    "blood_type": patients[i].blood_type,
+                    "phone": (patients[i].contact_info or {}).get("phone_primary"),
+                }
+                for i in ids if i in patients
+            ]
+            response["next_cursor"] = next_cursor
+
+            log_audit("cohort_members_listed", details={
+                "criteria": data.get("criteria"), "count": response["count"], "returned": len(response["members"]),
+            })
+            db.session.commit()
+
+        return jsonify(response)
+
+    # FHIR bulk data export
+    def fhir_outcome(status_code, message):
+        return jsonify({
+            "resourceType": "OperationOutcome",
+            "issue": [{"severity": "error", "code": "processing", "diagnostics": message}],
+        }), status_code
+
+    @app.route("/fhir/$export")
+    @hospital_admin_required
+    def fhir_export_kickoff():
+        """Start an asynchronous bulk export of the admin's hospital"""
+        output_format = request.args.get("_outputFormat")
+        if output_format and output_format not in ("ndjson", "application/ndjson", "application/fhir+ndjson"):
+            return fhir_outcome(400, f"Unsupported _outputFormat: {output_format}")
+
+        requested = request.args.get("_type")
+        resource_types = [t.strip() for t in requested.split(",") if t.strip()] if requested else list(RESOURCE_TYPES)
+        unsupported = [t for t in resource_types if t not in RESOURCE_TYPES]
+        if unsupported:
+            return fhir_outcome(400, f"Unsupported _type: {', '.join(unsupported)}")
+
+        since = None
+        if request.args.get("_since"):
+            try:
+                since = datetime.fromisoformat(request.args["_since"])
+            except ValueError:
+                return fhir_outcome(400, "_since must be an ISO 8601 instant")
+            if since.tzinfo:
+                since = since.astimezone(timezone.utc).replace(tzinfo=None)
+
+        job = ExportJob(
+            id=str(uuid.uuid4()),
+            hospital_id=session["hospital_id"],
+            requested_by_type=session.get("user_type"),
+            requested_by_id=session.get("user_id"),
+            request_url=request.url,
+            resource_types=resource_types,
+            since=since,
+        )
+        db.session.add(job)
+        enqueue(
+            "fhir_export",
+            {"job_id": job.id},
+            hospital_id=job.hospital_id,
+            requested_by_type=job.requested_by_type,
+            requested_by_id=job.requested_by_id,
+        )
+        log_audit(
+            "fhir_export_requested",
+            details={"job_id": job.id, "types": resource_types, "since": request.args.get("_since")},
+        )
+        db.session.commit()
+
+        response = Response(status=202)
+        response.headers["Content-Location"] = url_for("fhir_export_status", job_id=job.id, _external=True)
+        return response
+
+    def get_export_job(job_id):
+        job = db.session.get(ExportJob, job_id)
+        if not job:
+            abort(404)
+        if job.hospital_id != session["hospital_id"]:
+            abort(403)
+        return job
+
+    @app.route("/fhir/export-status/<job_id>")
+    @hospital_admin_required
+    def fhir_export_status(job_id):
+        job = get_export_job(job_id)
+
+        if job.status in ("accepted", "in_progress"):
+            response = Response(status=202)
+            response.headers["X-Progress"] = job.status.replace("_", " ")
+            response.headers["Retry-After"] = "5"
+            return response
+
+        if job.status == "failed":
+            return fhir_outcome(500, job.error or "Export failed")
+
+        return jsonify({
+            "transactionTime": job.started_at.replace(tzinfo=timezone.utc).isoformat(),
+            "request": job.request_url,
+            "requiresAccessToken": True,
+            "output": [
+                {
+                    "type": entry["type"],
+                    "url": url_for(
+                        "fhir_export_file", job_id=job.id, resource_type=entry["type"], _external=True
+                    ),
+                    "count": entry["count"],
+                }
+                for entry in job.output or []
+            ],
+            "error": [],
+        })
+
+    @app.route("/fhir/export-files/<job_id>/<resource_type>.ndjson")
+    @hospital_admin_required
+    def fhir_export_file(job_id, resource_type):
+        job = get_export_job(job_id)
+        if job.status != "completed" or resource_type not in job.resource_types:
+            abort(404)
+
+        path = os.path.join(export_directory(app.instance_path, job.id), f"{resource_type}.ndjson")
+        if not os.path.exists(path):
+            abort(404)
+        return send_file(path, mimetype="application/fhir+ndjson")
+
+    @app.route("/api/jobs/<int:job_id>")
+    @login_required
+    def job_status(job_id):
+        """Status of a background job, for the user who requested it or their hospital's admin"""
+        job = db.session.get(Job, job_id)
+        if not job:
+            abort(404)
+        own = job.requested_by_type == session.get("user_type") and job.requested_by_id == session.get("user_id")
+        hospital_admin = session.get("user_type") == "hospital_admin" and job.hospital_id == session.get("hospital_id")
+        if not (own or hospital_admin):
+            abort(403)
+
+        response = jsonify({
+            "id": job.id,
+            "name": job.name,
+            "status": job.status,
+            "priority": job.priority,
+            "attempts": job.attempts,
+            "max_attempts": job.max_attempts,
+            "run_after": job.run_after.isoformat() if job.status == "queued" else None,
+            "result": job.result,
+            "error": job.error,
+            "created_at": job.created_at.isoformat(),
+            "started_at": job.started_at.isoformat() if job.started_at else None,
+            "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        })
+        if job.status in ("queued", "running"):
+            response.headers["Retry-After"] = "5"
+        return response
+
     @app.route("/audit-logs")
     @hospital_admin_required
     def audit_logs():
@@ -994,55 +1577,22 @@ def create_app():
         logs = query.order_by(AuditLog.created_at.desc()).limit(100).all()
         return render_template("audit_logs.html", logs=logs)
 
-    @app.route("/api/patient/<patient_id>/summary")
+    @app.route("/api/patient/<int:patient_id>/summary")
     @login_required
     def patient_summary_api(patient_id):
-        patient = Patient.query.get_or_404(patient_id)
+        """Serve the stored summary card, honouring If-None-Match"""
+        summary = get_summary(patient_id)
+        if summary is None:
+            abort(404)
 
-        # Check access permissions
-        if not can_access_patient(patient.id):
+        # Access is checked against the hospitals recorded on the card itself
+        if session.get("hospital_id") not in summary.hospital_ids:
             abort(403)
 
-        recent_encounters = (
-            MedicalEncounter.query.filter_by(patient_id=patient_id)
-            .order_by(MedicalEncounter.treatment_date.desc())
-            .limit(5)
-            .all()
-        )
-
-        encounters_data = []
-        for encounter in recent_encounters:
-            encounters_data.append(
-                {
-                    "id": encounter.id,
-                    "date": encounter.treatment_date.strftime("%Y-%m-%d"),
-                    "doctor": (
-                        encounter.doctor.full_name if encounter.doctor else "Unknown"
-                    ),
-                    "diagnosis": encounter.diagnosis_text,
-                    "hospital": encounter.hospital.name,
-                }
-            )
-
-        return jsonify(
-            {
-                "patient": {
-                    "id": patient.id,
-                    "name": patient.full_name,
-                    "dob": (
-                        patient.date_of_birth.strftime("%Y-%m-%d")
-                        if patient.date_of_birth
-                        else None
-                    ),
-                    "blood_type": patient.blood_type,
-                    "gender": patient.gender,
-                },
-                "recent_encounters": encounters_data,
-                "total_encounters": MedicalEncounter.query.filter_by(
-                    patient_id=patient_id
-                ).count(),
-            }
-        )
+        response = Response(summary.document, mimetype="application/json")
+        response.set_etag(summary.etag)
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response.make_conditional(request)
 
 
 
@@ -1068,6 +1618,18 @@ def create_app():
 
 
     # Modify your add_patient route to include auto QR generation
+    def registration_attributes(form, cleaned_data):
+        """MPI matching attributes of a submitted PatientForm"""
+        return attributes(
+            full_name=cleaned_data.get('full_name', form.full_name.data),
+            date_of_birth=form.date_of_birth.data,
+            gender=form.gender.data,
+            email=cleaned_data.get('email'),
+            phones=[cleaned_data.get('phone_primary'), cleaned_data.get('phone_secondary'),
+                    cleaned_data.get('guardian_number')],
+            identifiers=form.identifiers(),
+        )
+
     @app.route("/patients/add", methods=["GET", "POST"])
     @hospital_admin_required
     def add_patient():
@@ -1101,6 +1663,18 @@ def create_app():
                     email=cleaned_data.get('email', form.email.data),
                 )
 
+                # Offer existing records of the same person before creating another one
+                if not form.confirm_new.data:
+                    duplicate_candidates = find_candidates(registration_attributes(form, cleaned_data))
+                    if duplicate_candidates:
+                        form.confirm_new.data = "1"
+                        return render_template("patients/add.html", form=form, hospital=hospital,
+                                               duplicate_candidates=duplicate_candidates)
+
+                if any(identifier_owner(id_type, id_value) for id_type, id_value in form.identifiers()):
+                    flash("This identifier already exists for another patient", "error")
+                    return render_template("patients/add.html", form=form, hospital=hospital)
+
                 # Create Patient instance
                 patient = Patient(
                     full_name=cleaned_data.get('full_name', form.full_name.data.strip()),
@@ -1126,6 +1700,10 @@ def create_app():
                     last_seen=datetime.now(timezone.utc),
                 )
                 db.session.add(patient_hospital)
+                for id_type, id_value in form.identifiers():
+                    db.session.add(PatientIdentifier(patient_id=patient.id, id_type=id_type, id_value=id_value))
+                db.session.flush()
+                refresh_blocking_keys(patient)
 
                 # AUTO-GENERATE QR TOKEN FOR THE NEW PATIENT
 
@@ -1162,6 +1740,87 @@ def create_app():
         # Render form if GET request or validation fails
         return render_template("patients/add.html", form=form, hospital=hospital)
 
+    @app.route("/patients/<int:patient_id>/link-hospital", methods=["POST"])
+    @hospital_admin_required
+    def link_patient_to_hospital(patient_id):
+        """Register an existing patient at this hospital instead of creating a duplicate.
+
+        Posted with the add-patient form. The patient must still be a duplicate
+        candidate for the submitted registration details, so an admin cannot
+        link, and so gain access to, a patient they were never offered.
+        """
+        patient = Patient.query.filter_by(id=patient_id, is_active=True).first_or_404()
+        hospital_id = session["hospital_id"]
+
+        form = PatientForm()
+        if not form.validate_on_submit():
+            flash("Enter the patient's registration details to link an existing record.", "error")
+            return redirect(url_for("add_patient"))
+        candidates = find_candidates(registration_attributes(form, form.clean_data()))
+        if patient_id not in {candidate.id for candidate, _, _ in candidates}:
+            log_audit("patient_link_refused", patient_id=patient_id,
+                      details={"reason": "registration details do not match"})
+            db.session.commit()
+            abort(403)
+
+        patient_hospital = PatientHospital.query.filter_by(
+            patient_id=patient_id, hospital_id=hospital_id
+        ).first()
+        if patient_hospital:
+            patient_hospital.last_seen = datetime.now(timezone.utc)
+        else:
+            db.session.add(PatientHospital(
+                patient_id=patient_id,
+                hospital_id=hospital_id,
+                first_seen=datetime.now(timezone.utc),
+                last_seen=datetime.now(timezone.utc),
+            ))
+
+        log_audit("patient_linked_to_hospital", patient_id=patient_id,
+                  details={"patient_name": patient.full_name})
+        db.session.commit()
+
+        flash(f'Existing patient "{patient.full_name}" linked to this hospital.', "success")
+        return redirect(url_for("patient_detail", patient_id=patient_id))
+
+    @app.route("/api/mpi/duplicates")
+    @login_required
+    def mpi_duplicates_api():
+        """Pending duplicate patient pairs found by the mpi-cluster job"""
+        if session.get("user_type") != "ministry":
+            abort(403)
+        in_ministry = db.select(Hospital.id).filter_by(ministry_id=session["ministry_id"])
+        after = request.args.get("after", 0, type=int)
+        limit = min(request.args.get("limit", 100, type=int), 500)
+
+        candidates = (
+            PatientDuplicateCandidate.query
+            .filter(
+                PatientDuplicateCandidate.status == request.args.get("status", "pending"),
+                PatientDuplicateCandidate.id > after,
+                PatientDuplicateCandidate.patient_id.in_(
+                    db.select(Patient.id).where(Patient.created_by_hospital.in_(in_ministry))
+                ),
+            )
+            .order_by(PatientDuplicateCandidate.id)
+            .limit(limit)
+            .all()
+        )
+        return jsonify({
+            "duplicates": [
+                {
+                    "id": c.id,
+                    "cluster_id": c.cluster_id,
+                    "patient_id": c.patient_id,
+                    "duplicate_id": c.duplicate_id,
+                    "score": c.score,
+                    "reasons": c.reasons,
+                }
+                for c in candidates
+            ],
+            "next_after": candidates[-1].id if len(candidates) == limit else None,
+        })
+
     # Add a new route for QR code download
     @app.route("/api/validate-qr", methods=["POST"])
     @doctor_required
@@ -1195,6 +1854,7 @@ def create_app():
                     "hospital_id": session["hospital_id"]
                 }
             )
+            db.session.commit()
 
             return jsonify({
                 "success": True,
@@ -1207,6 +1867,43 @@ def create_app():
             app.logger.error(f"Error validating QR token: {str(e)}")
             return jsonify({"success": False, "error": "Server error occurred"})
 
+    @app.route("/api/validate-qr/batch", methods=["POST"])
+    @doctor_required
+    def validate_qr_batch():
+        """Validate scans queued by an offline scanner; replayed scan ids return their first result"""
+        data = request.get_json(silent=True) or {}
+        scans = data.get("scans")
+        if not isinstance(scans, list) or not scans:
+            return jsonify({"success": False, "error": "A non-empty list of scans is required"}), 400
+        if len(scans) > QR_BATCH_SIZE:
+            return jsonify({"success": False, "error": f"At most {QR_BATCH_SIZE} scans per batch"}), 400
+
+        try:
+            results = validate_scans(
+                scans,
+                doctor_id=session["user_id"],
+                hospital_id=session["hospital_id"],
+                audit={
+                    "acting_user_type": session.get("user_type"),
+                    "acting_user_id": session.get("user_id"),
+                    "ip_address": request.remote_addr,
+                    "user_agent": request.headers.get("User-Agent", ""),
+                },
+            )
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Error validating QR batch: {str(e)}")
+            return jsonify({"success": False, "error": "Server error occurred"}), 500
+
+        for result in results:
+            if result.get("success"):
+                result["redirect_url"] = url_for("patient_detail", patient_id=result["patient_id"])
+        return jsonify({
+            "success": True,
+            "results": results,
+            "valid": sum(1 for r in results if r.get("success")),
+        })
+
     @app.route("/patients/<int:patient_id>/qr-download")
     @login_required
     def download_patient_qr(patient_id):
@@ -1237,6 +1934,39 @@ def create_app():
             flash("Error downloading QR code", "error")
             return redirect(url_for("patient_detail", patient_id=patient_id))
 
+    @app.route("/patients/qr-sheets", methods=["POST"])
+    @login_required
+    def download_qr_sheets():
+        """Zip of printable QR card sheets for the hospital's patients, or a selection of them"""
+        hospital_id = session.get("hospital_id")
+        if not hospital_id or session.get("user_type") not in ("hospital_admin", "doctor"):
+            abort(403)
+
+        fmt = request.form.get("format", "pdf")
+        if fmt not in QR_SHEET_FORMATS:
+            abort(400)
+        patient_ids = None
+        if request.form.get("patient_ids", "").strip():
+            try:
+                patient_ids = [int(i) for i in request.form["patient_ids"].replace(",", " ").split()]
+            except ValueError:
+                abort(400)
+
+        cards = load_cards(hospital_id, request.url_root.rstrip("/"), patient_ids)
+        if not cards:
+            flash("No active patients to print QR cards for", "warning")
+            return redirect(url_for("patients"))
+
+        log_audit("qr_sheets_downloaded", details={"patients": len(cards), "format": fmt,
+                                                   "selection": patient_ids is not None})
+        db.session.commit()
+
+        return Response(
+            iter_sheet_archive(cards, fmt),
+            mimetype="application/zip",
+            headers={"Content-Disposition": f'attachment; filename="qr_cards_{hospital_id}_{date.today():%Y%m%d}.zip"'},
+        )
+
     @app.errorhandler(404)
     def not_found_error(error):
         return render_template("errors/404.html"), 404
@@ -1310,7 +2040,7 @@ def create_app():
         admin = HospitalAdmin(
             hospital_id=hospital.id,
             username="admin",
-            password_hash=generate_password_hash("password123"),
+            password_hash=hash_password("password123"),
             full_name="Hospital Administrator",
             email="admin@hospital.com",
         )
@@ -1320,7 +2050,7 @@ def create_app():
         doctor = Doctor(
             hospital_id=hospital.id,
             license_no="DOC001",
-            password_hash=generate_password_hash("password123"),
+            password_hash=hash_password("password123"),
             full_name="Dr. Sample Doctor",
             email="doctor@hospital.com",
             specialties=["General Medicine"],
@@ -1369,8 +2099,185 @@ def create_app():
         print("Hospital admin: admin / password123")
         print("Doctor: DOC001 / password123")
 
+    @app.cli.command("import-doctors")
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    @click.option("--hospital-id", type=int, required=True, help="Hospital the doctors belong to.")
+    @click.option("--workers", type=int, default=None, help="Hashing processes (defaults to all cores).")
+    def import_doctors_command(path, hospital_id, workers):
+        """Bulk import doctors from a CSV or JSON registry file."""
+        with open(path, "rb") as f:
+            rows = parse_doctor_file(f, path)
+        result = import_doctors(rows, hospital_id, workers=workers)
+        for error in result["errors"]:
+            print(f'Row {error["row"]} ({error["license_no"]}): {"; ".join(error["errors"])}')
+        print(f'Imported {result["imported"]} doctors, {result["failed"]} rows rejected.')
+
+    @app.cli.command("refresh-rollups")
+    @click.option("--full", is_flag=True, help="Rebuild every rollup instead of only changed days.")
+    def refresh_rollups_command(full):
+        """Refresh per-hospital reporting rollups."""
+        cells = refresh_rollups(full=full)
+        print(f"Refreshed {cells} hospital-day rollups.")
+
+    @app.cli.command("refresh-analytics-snapshot")
+    @click.option("--full", is_flag=True, help="Rebuild the snapshot instead of merging changed encounters.")
+    def refresh_analytics_snapshot_command(full):
+        """Export encounters into the columnar analytics snapshot."""
+        rows = build_snapshot(snapshot_directory(app.instance_path), full=full)
+        print(f"Wrote {rows} encounters to the analytics snapshot.")
+
+    @app.cli.command("surveillance-checkpoint")
+    def surveillance_checkpoint_command():
+        """Catch the surveillance counts up and write a fresh checkpoint."""
+        surveillance.ensure_current()
+        surveillance.save_checkpoint()
+        print("Surveillance checkpoint written.")
+
+    @app.cli.command("backfill-name-keys")
+    def backfill_name_keys_command():
+        """Compute phonetic name search keys for existing patients."""
+        total = backfill_name_keys(progress=lambda last_id, total: print(f"...up to patient {last_id}: {total} patients"))
+        print(f"Computed name keys for {total} patients.")
+
+    @app.cli.command("rebuild-patient-summaries")
+    def rebuild_patient_summaries_command():
+        """Rebuild every stored patient summary card."""
+        total = rebuild_all_summaries(progress=lambda last_id, total: print(f"...up to patient {last_id}: {total} patients"))
+        print(f"Rebuilt {total} patient summaries.")
+
+    @app.cli.command("mpi-cluster")
+    @click.option("--ministry-id", type=int, default=None, help="Only patients registered under this ministry.")
+    @click.option("--rebuild-keys", is_flag=True, help="Recompute every patient's blocking keys first.")
+    def mpi_cluster_command(ministry_id, rebuild_keys):
+        """Find clusters of duplicate patient records for review."""
+        if rebuild_keys:
+            indexed = rebuild_blocking_keys(progress=lambda last_id, total: print(f"...indexed {total} patients"))
+            print(f"Rebuilt blocking keys for {indexed} patients.")
+
+        def progress(done, total, matches):
+            print(f"...scored {done}/{total} pairs, {matches} matches")
+
+        pairs, stored, clusters = cluster_patients(ministry_id, progress=progress)
+        print(f"Compared {pairs} pairs; stored {stored} duplicate candidates in {clusters} clusters.")
+
+    @app.cli.command("backfill-encounter-medicines")
+    @click.option("--batch-size", type=int, default=1000, help="Encounters per batch.")
+    def backfill_encounter_medicines_command(batch_size):
+        """Copy legacy encounter medicines JSON into encounter_medicines."""
+        def progress(last_id, encounters, rows):
+            print(f"...up to encounter {last_id}: {encounters} encounters, {rows} medicines")
+
+        encounters, rows = backfill_encounter_medicines(batch_size, progress=progress)
+        print(f"Backfilled {rows} medicines from {encounters} encounters.")
+
+    @app.cli.command("jobs-worker")
+    @click.option("--threads", type=int, default=4, help="Jobs run concurrently.")
+    @click.option("--task", "names", multiple=True, help="Only run these tasks (repeatable).")
+    def jobs_worker_command(threads, names):
+        """Run background jobs in the foreground until interrupted."""
+        pool = WorkerPool(app, threads, names=list(names) or None).start()
+        print(f"Job worker running {threads} threads; press Ctrl+C to stop.")
+        try:
+            while not pool.stop.wait(1):
+                pass
+        except KeyboardInterrupt:
+            print("Stopping; waiting for running jobs to finish...")
+            pool.shutdown()
+
+    @app.cli.command("outbox-maintain")
+    @click.option("--compact-after-hours", type=float, default=24, help="Fold per-row events older than this.")
+    @click.option("--retention-days", type=float, default=7, help="Keep acknowledged events this long.")
+    @click.option("--max-age-days", type=float, default=None, help="Also delete unacknowledged events this old.")
+    def outbox_maintain_command(compact_after_hours, retention_days, max_age_days):
+        """Compact and purge the change outbox."""
+        compacted = compact_outbox(timedelta(hours=compact_after_hours))
+        print(f"Compacted away {compacted} superseded events.")
+        purged = purge_outbox(
+            timedelta(days=retention_days), timedelta(days=max_age_days) if max_age_days is not None else None
+        )
+        print(f"Purged {purged} events.")
+
+    @app.cli.command("outbox-status")
+    def outbox_status_command():
+        """Show the outbox bounds and each consumer's lag."""
+        info = outbox_status()
+        print(f"Events {info['first_offset']}..{info['last_offset']} ({info['events']} retained)")
+        for consumer in info["consumers"]:
+            print(f"  {consumer['name']}: at {consumer['position']}, {consumer['lag']} behind")
+
+    @app.cli.command("edge-snapshot")
+    @click.option("--hospital-id", type=int, required=True, help="Hospital the edge site serves.")
+    @click.option("--output", type=click.Path(dir_okay=False, writable=True), required=True, help="SQLite file to write.")
+    @click.option("--encounter-days", type=int, default=365, help="Days of encounters to include.")
+    def edge_snapshot_command(hospital_id, output, encounter_days):
+        """Export a SQLite snapshot of one hospital for an edge site."""
+        def progress(table, rows):
+            print(f"  {table}: {rows} rows")
+
+        export_snapshot(hospital_id, output, encounter_days, progress=progress)
+        print(f"Wrote edge snapshot for hospital {hospital_id} to {output}.")
+
+    @app.cli.command("edge-token")
+    @click.option("--hospital-id", type=int, required=True, help="Hospital the edge site serves.")
+    @click.option("--revoke", is_flag=True, help="Invalidate the current token without issuing another.")
+    def edge_token_command(hospital_id, revoke):
+        """Print a new sync token an edge site uses to reach central; its previous token stops working."""
+        if revoke:
+            revoke_edge_token(hospital_id)
+            db.session.commit()
+            print(f"Revoked the edge sync token of hospital {hospital_id}.")
+            return
+        token = make_edge_token(app, hospital_id)
+        db.session.commit()
+        print(token)
+
+    @app.cli.command("edge-sync")
+    @click.option("--every", type=int, default=None, help="Keep syncing every N seconds.")
+    @click.option("--batch-size", type=int, default=200, help="Rows per request.")
+    def edge_sync_command(every, batch_size):
+        """Exchange changes with the central database (edge sites only)."""
+        if not (app.config["EDGE_HOSPITAL_ID"] and app.config["EDGE_CENTRAL_URL"] and app.config["EDGE_SYNC_TOKEN"]):
+            raise click.UsageError(
+                "Set CARECODE_EDGE_HOSPITAL_ID, CARECODE_CENTRAL_URL and CARECODE_EDGE_TOKEN to sync"
+            )
+        for result in run_edge_sync(app, every, batch_size):
+            print(f"Pulled {result['pulled']}, pushed {result['pushed']}, "
+                  f"{result['refused']} not applied (see edge_conflicts).")
+
+    @app.cli.command("assets-build")
+    def assets_build_command():
+        """Build the fingerprinted CSS/JS bundles into static/dist."""
+        manifest = build_assets(asset_bundles.src_dir, asset_bundles.dist_dir)
+        for name, filename in sorted(manifest["bundles"].items()):
+            sizes = manifest["sizes"][name]
+            print(f"  {filename}: {sizes['identity']} bytes, gzip {sizes['gzip']}, brotli {sizes.get('br', '-')}")
+        print(f"Built {len(manifest['bundles'])} bundles.")
+
+    @app.cli.command("rebuild-credentials")
+    def rebuild_credentials_command():
+        """Rebuild the login index from admin, doctor and ministry accounts."""
+        def progress(user_type, total):
+            print(f"  indexed {user_type} accounts ({total} so far)")
+
+        total = rebuild_credentials(progress=progress)
+        print(f"Indexed {total} accounts.")
+
+    @app.cli.command("qr-sheets")
+    @click.option("--hospital-id", type=int, required=True, help="Hospital whose patients get cards.")
+    @click.option("--base-url", required=True, help="Public site URL the QR codes point to.")
+    @click.option("--format", "fmt", type=click.Choice(QR_SHEET_FORMATS), default="pdf")
+    @click.option("--output", type=click.Path(dir_okay=False, writable=True), required=True, help="Zip file to write.")
+    def qr_sheets_command(hospital_id, base_url, fmt, output):
+        """Render printable QR card sheets for a hospital's patients."""
+        cards = load_cards(hospital_id, base_url.rstrip("/"))
+        with open(output, "wb") as f:
+            for chunk in iter_sheet_archive(cards, fmt):
+                f.write(chunk)
+        print(f"Wrote QR cards for {len(cards)} patients to {output}.")
+
     # Add this route to your app.py file
 
+    init_startup(app)
 
     return app
 
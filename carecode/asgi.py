@@ -0,0 +1,247 @@
+"""Async (ASGI) serving mode for the high fan-out JSON read APIs.
+
+Patient typeahead, summary cards, QR validation and the dashboard event
+stream are small or long-idle requests that spend nearly all their time
+waiting, on the database or for events. Under the threaded Flask server
+each one holds a worker thread for that whole time. This Starlette app
+serves these endpoints on one event loop, using async SQLAlchemy over the
+same models: aiomysql for MySQL, aiosqlite for SQLite.
+
+Sessions are shared with the Flask app. The Flask session cookie is
+verified with the Flask app's own signing serializer, and CSRF tokens are
+checked the way Flask-WTF issues them, so a browser signed in to Flask can
+call these endpoints unchanged. Every other path is passed to the Flask
+app itself (through a2wsgi's thread pool), so the whole site can be served
+from one uvicorn process. That is required for the dashboard's live
+events: the events are published in the process that commits a write.
+Alternatively, run it next to the Flask server and route only the read
+paths to it at the reverse proxy::
+
+    uvicorn asgi:application --app-dir carecode --port 8001 --workers 2
+
+``bench_asgi.py`` compares throughput and latency percentiles of the two
+servers.
+"""
+import hmac
+import json
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from flask.sessions import SecureCookieSessionInterface
+from itsdangerous import BadData, URLSafeTimedSerializer
+from sqlalchemy import or_, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, RedirectResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.http import parse_etags
+
+from app import app as flask_app
+from live_events import async_stream, dashboard_channels
+from models import AuditLog, Patient, PatientIdentifier, PatientSummary
+from name_keys import name_search_clause
+from patient_summaries import get_summary
+from qr_scans import qr_token_from_url
+
+ASYNC_DRIVERS = {"mysql": "mysql+aiomysql", "sqlite": "sqlite+aiosqlite"}
+CSRF_HEADERS = ("X-CSRFToken", "X-CSRF-Token")
+
+# Dashboards served through this app stream from dashboard_events() below
+flask_app.config["LIVE_EVENTS"] = True
+
+
+def async_database_url(url):
+    """The Flask app's database URL with the matching async driver"""
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+
+
+def _create_engine():
+    url = async_database_url(flask_app.config["SQLALCHEMY_DATABASE_URI"])
+    options = {}
+    if url.get_backend_name() == "mysql":
+        options = {
+            **flask_app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}),
+            "pool_size": flask_app.config.get("ASYNC_POOL_SIZE", 20),
+            "max_overflow": flask_app.config.get("ASYNC_MAX_OVERFLOW", 20),
+        }
+    return create_async_engine(url, **options)
+
+
+engine = _create_engine()
+Session = async_sessionmaker(engine, expire_on_commit=False)
+_session_serializer = SecureCookieSessionInterface().get_signing_serializer(flask_app)
+_csrf_serializer = URLSafeTimedSerializer(flask_app.config["SECRET_KEY"], salt="wtf-csrf-token")
+
+
+def flask_session(request):
+    """The signed-in user's Flask session, read-only; {} when absent or invalid"""
+    cookie = request.cookies.get(flask_app.config["SESSION_COOKIE_NAME"])
+    if not cookie:
+        return {}
+    try:
+        return _session_serializer.loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadData:
+        return {}
+
+
+def csrf_valid(request, session):
+    """Same check as Flask-WTF's CSRFProtect for a header-supplied token"""
+    if not flask_app.config.get("WTF_CSRF_ENABLED", True):
+        return True
+    token = next((request.headers[h] for h in CSRF_HEADERS if h in request.headers), None)
+    if not token or "csrf_token" not in session:
+        return False
+    try:
+        raw = _csrf_serializer.loads(token, max_age=flask_app.config.get("WTF_CSRF_TIME_LIMIT", 3600))
+    except BadData:
+        return False
+    return hmac.compare_digest(session["csrf_token"], raw)
+
+
+async def search_patients(request):
+    """Async twin of the Flask search_patients_api()"""
+    session = flask_session(request)
+    if "user_id" not in session:
+        return RedirectResponse("/login", status_code=302)
+    term = request.query_params.get("term", "").strip()
+    if len(term) < 2:
+        return JSONResponse([])
+
+    search_term = f"%{term}%"
+    in_hospital = select(Patient).where(Patient.created_by_hospital == session.get("hospital_id"))
+    async with Session() as db_session:
+        patients = (await db_session.scalars(
+            in_hospital.where(or_(
+                name_search_clause(term, flask_app.config["NAME_SEARCH_SUBSTRING_FALLBACK"]),
+                Patient.email.ilike(search_term),
+            )).limit(10)
+        )).all()
+        identifier_patients = (await db_session.scalars(
+            in_hospital.join(PatientIdentifier).where(PatientIdentifier.id_value.ilike(search_term)).limit(5)
+        )).all()
+
+    all_patients = {p.id: p for p in patients + identifier_patients}
+    return JSONResponse([
+        {
+            "id": patient.id,
+            "name": patient.full_name,
+            "email": patient.email or "",
+            "dob": patient.date_of_birth.strftime("%Y-%m-%d") if patient.date_of_birth else "",
+            "blood_type": patient.blood_type or "",
+        }
+        for patient in all_patients.values()
+    ])
+
+
+def _build_summary(patient_id):
+    # First request for a card: build it with the sync code path in a thread
+    with flask_app.app_context():
+        summary = get_summary(patient_id)
+        return None if summary is None else (summary.document, summary.etag, summary.hospital_ids)
+
+
+async def patient_summary(request):
+    """Async twin of the Flask patient_summary_api()"""
+    session = flask_session(request)
+    if "user_id" not in session:
+        return RedirectResponse("/login", status_code=302)
+    patient_id = request.path_params["patient_id"]
+
+    async with Session() as db_session:
+        summary = await db_session.get(PatientSummary, patient_id)
+        card = None if summary is None else (summary.document, summary.etag, summary.hospital_ids)
+    if card is None:
+        card = await run_in_threadpool(_build_summary, patient_id)
+    if card is None:
+        return JSONResponse({"error": "Not found"}, status_code=404)
+
+    document, etag, hospital_ids = card
+    if session.get("hospital_id") not in hospital_ids:
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+
+    headers = {"ETag": f'"{etag}"', "Cache-Control": "private, no-cache"}
+    if parse_etags(request.headers.get("If-None-Match")).contains(etag):
+        return Response(status_code=304, headers=headers)
+    return Response(document, media_type="application/json", headers=headers)
+
+
+async def validate_qr(request):
+    """Async twin of the Flask validate_qr_token()"""
+    session = flask_session(request)
+    if session.get("user_type") != "doctor":
+        return JSONResponse({"success": False, "error": "Doctor access required"}, status_code=403)
+    if not csrf_valid(request, session):
+        return JSONResponse({"success": False, "error": "The CSRF token is missing or invalid"}, status_code=400)
+
+    try:
+        data = await request.json()
+    except json.JSONDecodeError:
+        data = None
+    qr_url = (data or {}).get("qr_url", "").strip() if isinstance(data, dict) else ""
+    if not qr_url:
+        return JSONResponse({"success": False, "error": "QR URL is required"})
+    token = qr_token_from_url(qr_url)
+    if not token:
+        return JSONResponse({"success": False, "error": "Invalid QR code format"})
+
+    async with Session() as db_session:
+        patient = (await db_session.scalars(
+            select(Patient).where(Patient.qr_token == token, Patient.is_active.is_(True)).limit(1)
+        )).first()
+        if not patient:
+            return JSONResponse({"success": False, "error": "Invalid QR code"})
+
+        db_session.add(AuditLog(
+            acting_user_type=session.get("user_type"),
+            acting_user_id=session.get("user_id"),
+            patient_id=patient.id,
+            hospital_id=session.get("hospital_id"),
+            action="qr_scanned_by_doctor",
+            details={"doctor_id": session["user_id"], "hospital_id": session.get("hospital_id")},
+            ip_address=request.client.host if request.client else None,
+            user_agent=request.headers.get("User-Agent", ""),
+        ))
+        await db_session.commit()
+
+    return JSONResponse({
+        "success": True,
+        "patient_id": patient.id,
+        "patient_name": patient.full_name,
+        "redirect_url": f"/patients/{patient.id}",
+    })
+
+
+async def dashboard_events(request):
+    """Async twin of the Flask dashboard_events()"""
+    session = flask_session(request)
+    if "user_id" not in session:
+        return RedirectResponse("/login", status_code=302)
+    channels = dashboard_channels(session)
+    if not channels:
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+    return StreamingResponse(
+        async_stream(flask_app.extensions["live_events"], channels),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await engine.dispose()
+
+
+application = Starlette(
+    routes=[
+        Route("/search/patients", search_patients),
+        Route("/api/patient/{patient_id:int}/summary", patient_summary),
+        Route("/api/validate-qr", validate_qr, methods=["POST"]),
+        Route("/events/dashboard", dashboard_events),
+        Mount("/", app=WSGIMiddleware(flask_app, workers=flask_app.config.get("ASGI_WSGI_THREADS", 40))),
+    ],
+    lifespan=lifespan,
+)
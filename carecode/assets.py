@@ -0,0 +1,203 @@
+"""Fingerprinted, precompressed CSS and JS bundles.
+
+Styles and scripts live in ``static/src``. BUNDLES names the bundles and
+the source files concatenated into each one:
+
+``app.css``/``app.js``   every page that extends base.html
+``standalone.css``       the audit log, medical records and reports pages,
+                         which still carry their own navbar and Bootstrap
+``<page>.js``            scripts for a single page. These stay separate
+                         because pages define globals with the same names
+                         (showToast, togglePassword).
+
+A build writes each bundle to ``static/dist`` under a name carrying a hash
+of its content, e.g. ``app.3f9c2e71d0.css``, and writes gzip and brotli
+copies next to it. Brotli needs the ``brotli`` package and is skipped
+without it. CSS is minified by dropping comments and whitespace. JS is
+concatenated as written, and compression takes most of what a minifier
+would save. ``manifest.json`` maps bundle names to built files. Templates
+call ``asset_url("app.css")`` for the current URL.
+
+``/assets/<file>`` serves the built files with the best encoding the
+client accepts. Responses are marked immutable for a year, because a
+change to a bundle changes its name. A proxy can serve ``static/dist``
+directly instead (nginx ``gzip_static``/``brotli_static``).
+
+init_assets() rebuilds when a source is newer than the manifest, so a
+fresh checkout works without a build step. In debug mode it also
+rebuilds on every asset_url() call after an edit. ``flask assets-build``
+builds ahead of a deploy. The files of the previous build are kept, so
+pages rendered by workers still on it keep loading.
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+
+from flask import current_app, request, send_file, url_for
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BUNDLES = {
+    "app.css": ["css/base.css", "css/landing.css", "css/patients.css", "css/qr-scanner.css"],
+    "app.js": ["js/base.js", "js/live-activity.js", "js/medicines.js", "js/diagnosis-code.js"],
+    "standalone.css": ["css/audit-logs.css", "css/medical-records.css", "css/reports.css"],
+    "login.js": ["js/login.js"],
+    "register-ministry.js": ["js/register-ministry.js"],
+    "patient-form.js": ["js/patient-form.js"],
+    "patient-detail.js": ["js/patient-detail.js"],
+    "qr-scanner.js": ["js/qr-scanner.js"],
+    "audit-logs.js": ["js/audit-logs.js"],
+    "medical-records.js": ["js/medical-records.js"],
+}
+MIMETYPES = {".css": "text/css; charset=utf-8", ".js": "text/javascript; charset=utf-8"}
+# Content-Encoding -> file suffix, in order of preference
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+MAX_AGE = 365 * 24 * 3600
+MANIFEST = "manifest.json"
+
+_CSS_COMMENT = re.compile(r"/\*.*?\*/", re.S)
+_CSS_SPACE = re.compile(r"\s+")
+_CSS_PUNCTUATION = re.compile(r"\s*([{};:,])\s*")
+
+
+def minify_css(css):
+    css = _CSS_SPACE.sub(" ", _CSS_COMMENT.sub("", css))
+    return _CSS_PUNCTUATION.sub(r"\1", css).replace(";}", "}").strip()
+
+
+def _write(path, data):
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _read_manifest(dist_dir):
+    try:
+        with open(os.path.join(dist_dir, MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"bundles": {}, "previous": {}}
+
+
+def build(src_dir, dist_dir):
+    """Build every bundle; returns the manifest"""
+    os.makedirs(dist_dir, exist_ok=True)
+    old = _read_manifest(dist_dir)
+    bundles, sizes = {}, {}
+    for name, sources in BUNDLES.items():
+        parts = []
+        for source in sources:
+            with open(os.path.join(src_dir, source), encoding="utf-8") as f:
+                parts.append(f.read())
+        stem, ext = os.path.splitext(name)
+        if ext == ".css":
+            data = "\n".join(minify_css(part) for part in parts).encode()
+        else:
+            # A lone semicolon keeps a source without a trailing one from running into the next
+            data = "\n;\n".join(part.rstrip() for part in parts).encode() + b"\n"
+        filename = f"{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+        path = os.path.join(dist_dir, filename)
+        compressors = {".gz": lambda: gzip.compress(data, 9, mtime=0)}
+        if brotli is not None:
+            compressors[".br"] = lambda: brotli.compress(data, quality=11)
+        for suffix, compress in compressors.items():
+            if not os.path.exists(path + suffix):
+                _write(path + suffix, compress())
+        if not os.path.exists(path):
+            _write(path, data)
+        bundles[name] = filename
+        sizes[name] = {
+            encoding: os.path.getsize(path + suffix)
+            for encoding, suffix in {"identity": "", **ENCODINGS}.items()
+            if os.path.exists(path + suffix)
+        }
+
+    previous = old["bundles"] if old["bundles"] != bundles else old.get("previous", {})
+    manifest = {"bundles": bundles, "previous": previous, "sizes": sizes}
+    _write(os.path.join(dist_dir, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode())
+
+    keep = {MANIFEST} | {
+        filename + suffix
+        for filename in list(bundles.values()) + list(previous.values())
+        for suffix in ("", *ENCODINGS.values())
+    }
+    for entry in os.listdir(dist_dir):
+        if entry not in keep and ".tmp" not in entry:
+            os.remove(os.path.join(dist_dir, entry))
+    return manifest
+
+
+class Assets:
+    def __init__(self, src_dir, dist_dir):
+        self.src_dir = src_dir
+        self.dist_dir = dist_dir
+        self.manifest = {"bundles": {}}
+        self._lock = threading.Lock()
+
+    def _stale(self):
+        try:
+            built = os.path.getmtime(os.path.join(self.dist_dir, MANIFEST))
+        except OSError:
+            return True
+        return any(
+            os.path.getmtime(os.path.join(self.src_dir, source)) > built
+            for sources in BUNDLES.values() for source in sources
+        )
+
+    def load(self):
+        with self._lock:
+            if self._stale():
+                self.manifest = build(self.src_dir, self.dist_dir)
+            else:
+                self.manifest = _read_manifest(self.dist_dir)
+        return self.manifest
+
+    def url(self, name):
+        if current_app.debug and self._stale():
+            self.load()
+        return url_for("assets", filename=self.manifest["bundles"][name])
+
+    def response(self, filename):
+        """The built file, in the best encoding the client accepts"""
+        path = safe_join(self.dist_dir, filename)
+        ext = os.path.splitext(filename)[1]
+        if path is None or ext not in MIMETYPES or not os.path.isfile(path):
+            raise NotFound()
+
+        available = [e for e, suffix in ENCODINGS.items() if os.path.isfile(path + suffix)]
+        encoding = request.accept_encodings.best_match(available) if available else None
+        response = send_file(
+            path + ENCODINGS[encoding] if encoding else path,
+            mimetype=MIMETYPES[ext],
+            max_age=MAX_AGE,
+            conditional=True,
+        )
+        if encoding:
+            response.content_encoding = encoding
+        response.vary.add("Accept-Encoding")
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+
+def asset_url(name):
+    """URL of a bundle's current build, for templates"""
+    return current_app.extensions["assets"].url(name)
+
+
+def init_assets(app):
+    """Load the bundle manifest, building it if any source changed"""
+    assets = Assets(os.path.join(app.static_folder, "src"), os.path.join(app.static_folder, "dist"))
+    assets.load()
+    app.extensions["assets"] = assets
+    app.add_template_global(asset_url)
+    return assets
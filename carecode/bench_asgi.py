@@ -0,0 +1,87 @@
+"""Load test the read APIs on the threaded Flask server and the ASGI app.
+
+Sends the same requests to each base URL at a fixed client concurrency and
+prints throughput and latency percentiles, e.g.::
+
+    python bench_asgi.py --cookie "session=..." --concurrency 64 --requests 5000 \\
+        --path "/search/patients?term=per" --path /api/patient/1/summary \\
+        http://127.0.0.1:5000 http://127.0.0.1:8001
+
+Copy the session cookie from a signed-in browser. Both servers must be
+configured with the same SECRET_KEY and database.
+"""
+import argparse
+import http.client
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def run(base_url, paths, cookie, concurrency, requests):
+    target = urlsplit(base_url)
+    local = threading.local()
+
+    def connection():
+        if not hasattr(local, "conn"):
+            local.conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=30)
+        return local.conn
+
+    def call(i):
+        path = paths[i % len(paths)]
+        started = time.perf_counter()
+        try:
+            conn = connection()
+            conn.request("GET", path, headers={"Cookie": cookie} if cookie else {})
+            response = conn.getresponse()
+            response.read()
+            ok = response.status < 400
+        except (OSError, http.client.HTTPException):
+            local.__dict__.pop("conn", None)
+            ok = False
+        return time.perf_counter() - started, ok
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(call, range(min(concurrency, requests))))  # open connections
+        started = time.perf_counter()
+        results = list(pool.map(call, range(requests)))
+        elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency * 1000 for latency, ok in results if ok)
+    return {
+        "requests": requests,
+        "errors": sum(1 for _, ok in results if not ok),
+        "throughput": requests / elapsed,
+        "mean": statistics.fmean(latencies) if latencies else 0.0,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("base_urls", nargs="+", help="Servers to compare, e.g. http://127.0.0.1:5000")
+    parser.add_argument("--path", dest="paths", action="append", help="Request path (repeatable)")
+    parser.add_argument("--cookie", default="", help="Cookie header of a signed-in session")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+    paths = args.paths or ["/search/patients?term=per"]
+
+    print(f"{'server':<32}{'req/s':>10}{'mean ms':>10}{'p50':>9}{'p95':>9}{'p99':>9}{'errors':>8}")
+    for base_url in args.base_urls:
+        r = run(base_url, paths, args.cookie, args.concurrency, args.requests)
+        print(f"{base_url:<32}{r['throughput']:>10.1f}{r['mean']:>10.1f}{r['p50']:>9.1f}"
+              f"{r['p95']:>9.1f}{r['p99']:>9.1f}{r['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
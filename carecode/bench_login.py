@@ -0,0 +1,101 @@
+"""Measure password hash cost and login throughput.
+
+Hash mode times hashing and verification for candidate PASSWORD_HASH_METHOD
+values, to pick a cost that fits the login servers' cores::
+
+    python bench_login.py hashes scrypt:32768:8:1 scrypt:16384:8:1 pbkdf2:sha256:600000
+
+Server mode signs in repeatedly against a running app, each attempt
+fetching the login form for its CSRF token and posting it, and prints
+throughput and latency percentiles::
+
+    python bench_login.py server --username DOC001 --password password123 \\
+        --concurrency 16 --requests 500 http://127.0.0.1:5000
+"""
+import argparse
+import http.client
+import re
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from bench_asgi import percentile
+
+CSRF_FIELD = re.compile(rb'name="csrf_token"[^>]*value="([^"]+)"')
+
+
+def bench_hashes(methods, rounds):
+    print(f"{'method':<28}{'hash ms':>10}{'verify ms':>11}{'logins/s/core':>15}")
+    for method in methods:
+        started = time.perf_counter()
+        hashes = [generate_password_hash("correct horse battery", method=method) for _ in range(rounds)]
+        hash_ms = (time.perf_counter() - started) * 1000 / rounds
+        started = time.perf_counter()
+        for h in hashes:
+            check_password_hash(h, "correct horse battery")
+        verify_ms = (time.perf_counter() - started) * 1000 / rounds
+        print(f"{method:<28}{hash_ms:>10.1f}{verify_ms:>11.1f}{1000 / verify_ms:>15.1f}")
+
+
+def bench_server(base_url, username, password, concurrency, requests):
+    target = urlsplit(base_url)
+
+    def login(_):
+        conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=30)
+        started = time.perf_counter()
+        try:
+            conn.request("GET", "/login")
+            response = conn.getresponse()
+            token = CSRF_FIELD.search(response.read())
+            cookie = (response.getheader("Set-Cookie") or "").split(";", 1)[0]
+            body = urlencode({"csrf_token": token.group(1).decode() if token else "",
+                              "username": username, "password": password})
+            conn.request("POST", "/login", body=body, headers={
+                "Content-Type": "application/x-www-form-urlencoded", "Cookie": cookie,
+            })
+            response = conn.getresponse()
+            response.read()
+            ok = response.status == 302 and "/dashboard" in (response.getheader("Location") or "")
+        except (OSError, http.client.HTTPException):
+            ok = False
+        finally:
+            conn.close()
+        return time.perf_counter() - started, ok
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        started = time.perf_counter()
+        results = list(pool.map(login, range(requests)))
+        elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency * 1000 for latency, ok in results if ok)
+    print(f"{'logins/s':>10}{'mean ms':>10}{'p50':>9}{'p95':>9}{'p99':>9}{'failed':>8}")
+    print(f"{requests / elapsed:>10.1f}{statistics.fmean(latencies) if latencies else 0.0:>10.1f}"
+          f"{percentile(latencies, 0.50):>9.1f}{percentile(latencies, 0.95):>9.1f}"
+          f"{percentile(latencies, 0.99):>9.1f}{sum(1 for _, ok in results if not ok):>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    modes = parser.add_subparsers(dest="mode", required=True)
+    hashes = modes.add_parser("hashes", help="Time hash methods locally")
+    hashes.add_argument("methods", nargs="+", help="werkzeug methods, e.g. scrypt:32768:8:1")
+    hashes.add_argument("--rounds", type=int, default=20)
+    server = modes.add_parser("server", help="Sign in repeatedly against a running app")
+    server.add_argument("base_url", help="e.g. http://127.0.0.1:5000")
+    server.add_argument("--username", required=True)
+    server.add_argument("--password", required=True)
+    server.add_argument("--concurrency", type=int, default=16)
+    server.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    if args.mode == "hashes":
+        bench_hashes(args.methods, args.rounds)
+    else:
+        bench_server(args.base_url, args.username, args.password, args.concurrency, args.requests)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Measure worker startup: import time, warmup and the first requests.
+
+Each run starts a fresh interpreter, imports ``app`` (which builds the app
+and runs WARMUP), then sends the given paths through the test client twice,
+as a new worker would see them. Every --warmup value is measured over
+--runs processes and the medians are printed, e.g.::
+
+    python bench_startup.py --path /login --path "/api/icd10/search?q=diab" \\
+        --user doctor:1:1 --warmup "" --warmup templates,pool,reference
+
+--user signs the requests in as user_type:user_id[:hospital_id].
+--importtime also lists the slowest modules to import.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+CHILD = r"""
+import json, sys, time
+started = time.perf_counter()
+import app as module
+imported = time.perf_counter() - started
+app = module.app
+warmup = sum(app.extensions["startup"]["warmup"].values())
+paths, user = json.loads(sys.argv[1]), json.loads(sys.argv[2])
+client = app.test_client()
+if user:
+    with client.session_transaction() as session:
+        session.update(user)
+requests = []
+for attempt in range(2):
+    for path in paths:
+        started = time.perf_counter()
+        status = client.get(path).status_code
+        requests.append((time.perf_counter() - started, status))
+print(json.dumps({"import": imported - warmup, "warmup": warmup, "requests": requests}))
+"""
+
+
+def parse_user(spec):
+    if not spec:
+        return {}
+    user_type, user_id, *hospital = spec.split(":")
+    user = {"user_type": user_type, "user_id": int(user_id), "username": "bench"}
+    if hospital:
+        user["hospital_id"] = int(hospital[0])
+    return user
+
+
+def measure(warmup, paths, user, runs):
+    env = dict(os.environ, CARECODE_WARMUP=warmup)
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, "-c", CHILD, json.dumps(paths), json.dumps(user)],
+            cwd=here, env=env, check=True, capture_output=True, text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        result["process"] = time.perf_counter() - started
+        results.append(result)
+    return results
+
+
+def import_profile(top):
+    here = os.path.dirname(os.path.abspath(__file__))
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=here, env=dict(os.environ, CARECODE_WARMUP=""), check=True, capture_output=True, text=True,
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "|" in line and "cumulative" not in line:
+            _, cumulative, name = line.split("|")
+            # Only modules imported directly by app.py or its siblings, not their dependencies' internals
+            if len(name) - len(name.lstrip()) <= 3:
+                rows.append((int(cumulative) / 1000, name.strip()))
+    print(f"{'module':<40}{'cumulative ms':>15}")
+    for ms, name in sorted(rows, reverse=True)[:top]:
+        print(f"{name:<40}{ms:>15.1f}")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--path", action="append", default=[], help="Path to request; repeat for several")
+    parser.add_argument("--user", help="Sign in as user_type:user_id[:hospital_id]")
+    parser.add_argument("--warmup", action="append", help="CARECODE_WARMUP value to compare; repeat for several")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--importtime", type=int, default=0, metavar="N", help="Also list the N slowest imports")
+    args = parser.parse_args()
+    paths = args.path or ["/login"]
+    configs = args.warmup if args.warmup is not None else ["", "templates,pool,reference"]
+
+    if args.importtime:
+        import_profile(args.importtime)
+
+    print(f"{'warmup':<28}{'process ms':>11}{'import ms':>11}{'warmup ms':>11}"
+          f"{'1st req ms':>12}{'2nd req ms':>12}  path")
+    for warmup in configs:
+        results = measure(warmup, paths, parse_user(args.user), args.runs)
+        summary = f"{warmup or '(none)':<28}" + "".join(
+            f"{statistics.median(r[key] for r in results) * 1000:>11.1f}" for key in ("process", "import", "warmup")
+        )
+        for i, path in enumerate(paths):
+            first = statistics.median(r["requests"][i][0] for r in results) * 1000
+            second = statistics.median(r["requests"][len(paths) + i][0] for r in results) * 1000
+            status = results[-1]["requests"][i][1]
+            print(f"{summary if i == 0 else '':<61}{first:>12.1f}{second:>12.1f}  {path} ({status})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""Tagged read-through cache with commit-driven invalidation.
+
+Cached values carry tags such as ``hospital:3``, ``patient:42`` or
+``doctor:7``. After every commit that touches a Patient, MedicalEncounter,
+Doctor, Hospital or PatientHospital row, the tags of that row are
+invalidated, including the old values of foreign keys that moved. Bulk
+``db.insert()``/``update()`` statements are not seen (see model_events).
+
+There are two backends:
+
+* ``MemoryBackend``: a per-process LRU bounded by entry count and
+  approximate size, with a TTL on every entry. This is the default and
+  the local stand-in for the shared backend. Other processes only see an
+  invalidation when their entries expire.
+* ``RedisBackend``: shared by every process. Selected by setting
+  CACHE_BACKEND to a redis:// URL, which needs the ``redis`` package.
+
+Every tag has a generation number that invalidation bumps. A value
+computed while one of its tags was invalidated is not stored, so a reader
+racing a commit cannot cache stale data.
+"""
+import functools
+import logging
+import pickle
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from markupsafe import Markup
+from sqlalchemy import inspect
+
+from model_events import subscribe
+from models import Doctor, Hospital, MedicalEncounter, Patient, PatientHospital
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+DEFAULT_TTL = 300
+MAX_ENTRIES = 10000
+MAX_BYTES = 64 * 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def _size(value):
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+
+class MemoryBackend:
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, expires_at, tags, size)
+        self._tag_keys = defaultdict(set)
+        self._generations = defaultdict(int)
+        self._bytes = 0
+        self.evictions = 0
+
+    def _drop(self, key):
+        _, _, tags, size = self._entries.pop(key)
+        self._bytes -= size
+        for tag in tags:
+            keys = self._tag_keys.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tag_keys[tag]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            if entry[1] <= time.monotonic():
+                self._drop(key)
+                return _MISSING
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def generations(self, tags):
+        with self._lock:
+            return [self._generations[tag] for tag in tags]
+
+    def set(self, key, value, ttl, tags=(), generations=None):
+        """Store unless a tag was invalidated since `generations` was read"""
+        size = _size(value)
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            if generations is not None and generations != [self._generations[t] for t in tags]:
+                return False
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, time.monotonic() + ttl, tuple(tags), size)
+            self._bytes += size
+            for tag in tags:
+                self._tag_keys[tag].add(key)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+    def invalidate_tags(self, tags):
+        with self._lock:
+            removed = 0
+            for tag in tags:
+                self._generations[tag] += 1
+                for key in list(self._tag_keys.get(tag, ())):
+                    self._drop(key)
+                    removed += 1
+            return removed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tag_keys.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+            }
+
+
+class RedisBackend:
+    """Shared backend: pickled values with TTLs, a set of keys and a generation counter per tag"""
+
+    def __init__(self, url, prefix="carecode:cache:"):
+        if redis is None:
+            raise RuntimeError("CACHE_BACKEND is a Redis URL but the redis package is not installed")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def _key(self, key):
+        return f"{self.prefix}{key}"
+
+    def _tag(self, tag, kind):
+        return f"{self.prefix}tag:{kind}:{tag}"
+
+    def get(self, key):
+        data = self.client.get(self._key(key))
+        return _MISSING if data is None else pickle.loads(data)
+
+    def generations(self, tags):
+        if not tags:
+            return []
+        return [int(v or 0) for v in self.client.mget([self._tag(t, "gen") for t in tags])]
+
+    def set(self, key, value, ttl, tags=(), generations=None):
+        if generations is not None and generations != self.generations(tags):
+            return False
+        pipe = self.client.pipeline()
+        pipe.set(self._key(key), pickle.dumps(value, pickle.HIGHEST_PROTOCOL), ex=max(1, int(ttl)))
+        for tag in tags:
+            pipe.sadd(self._tag(tag, "keys"), self._key(key))
+            pipe.expire(self._tag(tag, "keys"), max(1, int(ttl)) * 2)
+        pipe.execute()
+        return True
+
+    def delete(self, key):
+        self.client.delete(self._key(key))
+
+    def invalidate_tags(self, tags):
+        removed = 0
+        for tag in tags:
+            self.client.incr(self._tag(tag, "gen"))
+            keys = self.client.smembers(self._tag(tag, "keys"))
+            if keys:
+                removed += self.client.delete(*keys)
+            self.client.delete(self._tag(tag, "keys"))
+        return removed
+
+    def clear(self):
+        for key in self.client.scan_iter(f"{self.prefix}*"):
+            self.client.delete(key)
+
+    def stats(self):
+        return {"backend": "redis"}
+
+
+class Cache:
+    def __init__(self, backend, default_ttl=DEFAULT_TTL):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._metrics = defaultdict(lambda: {"hits": 0, "misses": 0, "stores": 0, "skipped": 0})
+        self.invalidations = 0
+
+    def _count(self, name, metric):
+        with self._lock:
+            self._metrics[name][metric] += 1
+
+    def get_or_compute(self, name, key, compute, ttl=None, tags=()):
+        full_key = f"{name}:{key}"
+        value = self.backend.get(full_key)
+        if value is not _MISSING:
+            self._count(name, "hits")
+            return value
+        self._count(name, "misses")
+        tags = list(tags)
+        generations = self.backend.generations(tags)
+        value = compute()
+        stored = self.backend.set(full_key, value, ttl or self.default_ttl, tags, generations)
+        self._count(name, "stores" if stored else "skipped")
+        return value
+
+    def cached(self, name, ttl=None, tags=None, key=None):
+        """Cache a function's result per arguments.
+
+        `tags` and `key` are callables taking the function's arguments; the
+        key defaults to the repr of the arguments.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                cache_key = key(*args, **kwargs) if key else repr((args, sorted(kwargs.items())))
+                entry_tags = tags(*args, **kwargs) if tags else ()
+                return self.get_or_compute(name, cache_key, lambda: func(*args, **kwargs), ttl, entry_tags)
+            wrapper.uncached = func
+            return wrapper
+        return decorator
+
+    def fragment(self, name, ttl=None, tags=None, key=None):
+        """cached() for functions rendering HTML fragments; returns Markup for templates"""
+        def decorator(func):
+            inner = self.cached(name, ttl, tags, key)(lambda *a, **kw: str(func(*a, **kw)))
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                return Markup(inner(*args, **kwargs))
+            return wrapper
+        return decorator
+
+    def invalidate(self, tags):
+        tags = sorted(set(tags))
+        if tags:
+            self.backend.invalidate_tags(tags)
+            with self._lock:
+                self.invalidations += len(tags)
+
+    def stats(self):
+        with self._lock:
+            metrics = {name: dict(m) for name, m in self._metrics.items()}
+            invalidations = self.invalidations
+        for m in metrics.values():
+            lookups = m["hits"] + m["misses"]
+            m["hit_ratio"] = round(m["hits"] / lookups, 3) if lookups else None
+        return {"backend": self.backend.stats(), "invalidated_tags": invalidations, "caches": metrics}
+
+
+# Model -> [(tag prefix, attribute)] of the tags a committed row invalidates
+TAGGED_COLUMNS = {
+    Patient: [("patient", "id"), ("hospital", "created_by_hospital")],
+    MedicalEncounter: [("patient", "patient_id"), ("doctor", "doctor_id"), ("hospital", "hospital_id")],
+    Doctor: [("doctor", "id"), ("hospital", "hospital_id")],
+    Hospital: [("hospital", "id"), ("ministry", "ministry_id")],
+    PatientHospital: [("patient", "patient_id"), ("hospital", "hospital_id")],
+}
+
+
+def row_tags(obj):
+    """Tags of a flushed row, for current and previous foreign key values"""
+    state = inspect(obj)
+    tags = set()
+    for prefix, attr in TAGGED_COLUMNS[type(obj)]:
+        history = state.attrs[attr].history
+        for value in (*history.unchanged, *history.added, *history.deleted, getattr(obj, attr)):
+            if value is not None:
+                tags.add(f"{prefix}:{value}")
+    return {"tags": sorted(tags)}
+
+
+def init_cache(app):
+    """Create the app's cache from CACHE_* config and invalidate it after commits"""
+    config = app.config
+    url = config.get("CACHE_BACKEND", "memory")
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        backend = RedisBackend(url)
+    else:
+        backend = MemoryBackend(config.get("CACHE_MAX_ENTRIES", MAX_ENTRIES), config.get("CACHE_MAX_BYTES", MAX_BYTES))
+    cache = Cache(backend, config.get("CACHE_DEFAULT_TTL", DEFAULT_TTL))
+    app.extensions["cache"] = cache
+
+    def invalidate(events):
+        cache.invalidate(tag for _, values in events for tag in values["tags"])
+
+    subscribe(tuple(TAGGED_COLUMNS), invalidate, capture=row_tags)
+    return cache
@@ -0,0 +1,395 @@
+"""Ad-hoc patient cohorts evaluated over in-memory bitmap indexes.
+
+Every indexed attribute value (blood type, gender, birth year, province,
+hospital, and diagnosis code per treatment month) owns a bitmap whose bit N
+is set when patient N has that value. A bitmap splits ids into chunks of
+65536 (``id >> 16``) and keeps one Python integer per chunk that has members,
+so AND/OR/AND NOT are big-integer operations that run in C chunk by chunk, and
+memory follows the number of patients rather than the highest id (edge
+databases number their rows from 1e9). The index is built once per worker, kept current from commit events, and caught up from ``updated_at``
+for writes made by other workers.
+"""
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from model_events import subscribe
+from models import db, Patient, PatientHospital, MedicalEncounter
+
+CATCH_UP_INTERVAL = 30
+WATERMARK_OVERLAP = timedelta(minutes=5)
+PAGE_SIZE = 100
+CHUNK_BITS = 16
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+LIST_CRITERIA = ("blood_type", "gender", "province", "hospital_id")
+
+
+def _province(address):
+    if isinstance(address, dict) and address.get("province"):
+        return address["province"].strip().title()
+    return None
+
+
+def _month(day):
+    return day.year * 12 + day.month - 1
+
+
+def _years_before(day, years):
+    try:
+        return day.replace(year=day.year - years)
+    except ValueError:  # 29 February
+        return day.replace(year=day.year - years, day=28)
+
+
+def _iter_bits(bits, offset):
+    """Positions of the set bits of an int, plus offset, in ascending order"""
+    position = offset
+    while bits:
+        shift = (bits & -bits).bit_length() - 1
+        position += shift
+        yield position
+        bits >>= shift + 1
+        position += 1
+
+
+class Bitmap:
+    """Set of patient ids as one int per 65536-id chunk that has members"""
+    __slots__ = ("_chunks",)
+
+    def __init__(self, ids=()):
+        self._chunks = {}  # id >> CHUNK_BITS -> int with bit (id & CHUNK_MASK) set
+        for patient_id in ids:
+            self.add(patient_id)
+
+    @classmethod
+    def _from_chunks(cls, chunks):
+        bitmap = cls()
+        bitmap._chunks = chunks
+        return bitmap
+
+    def add(self, patient_id):
+        chunk = patient_id >> CHUNK_BITS
+        self._chunks[chunk] = self._chunks.get(chunk, 0) | (1 << (patient_id & CHUNK_MASK))
+
+    def discard(self, patient_id):
+        chunk = patient_id >> CHUNK_BITS
+        bits = self._chunks.get(chunk, 0) & ~(1 << (patient_id & CHUNK_MASK))
+        if bits:
+            self._chunks[chunk] = bits
+        else:
+            self._chunks.pop(chunk, None)
+
+    def copy(self):
+        return Bitmap._from_chunks(dict(self._chunks))
+
+    def __contains__(self, patient_id):
+        return bool(self._chunks.get(patient_id >> CHUNK_BITS, 0) >> (patient_id & CHUNK_MASK) & 1)
+
+    def __len__(self):
+        return sum(bits.bit_count() for bits in self._chunks.values())
+
+    def __bool__(self):
+        return bool(self._chunks)
+
+    def __ior__(self, other):
+        for chunk, bits in other._chunks.items():
+            self._chunks[chunk] = self._chunks.get(chunk, 0) | bits
+        return self
+
+    def __or__(self, other):
+        return self.copy().__ior__(other)
+
+    def __and__(self, other):
+        small, large = sorted((self._chunks, other._chunks), key=len)
+        chunks = {}
+        for chunk, bits in small.items():
+            bits &= large.get(chunk, 0)
+            if bits:
+                chunks[chunk] = bits
+        return Bitmap._from_chunks(chunks)
+
+    def __sub__(self, other):
+        chunks = {}
+        for chunk, bits in self._chunks.items():
+            bits &= ~other._chunks.get(chunk, 0)
+            if bits:
+                chunks[chunk] = bits
+        return Bitmap._from_chunks(chunks)
+
+    def __iter__(self):
+        return iter_members(self)
+
+
+def iter_members(bitmap, after=0):
+    """Patient ids in a bitmap in ascending order, starting above `after`"""
+    first = (after + 1) >> CHUNK_BITS
+    for chunk in sorted(c for c in bitmap._chunks if c >= first):
+        bits, offset = bitmap._chunks[chunk], chunk << CHUNK_BITS
+        if chunk == first:
+            skip = (after + 1) & CHUNK_MASK
+            bits, offset = bits >> skip, offset + skip
+        yield from _iter_bits(bits, offset)
+
+
+class CohortIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._bitmaps = {}  # (attribute, value) -> Bitmap
+        self._patient_keys = {}  # patient id -> attribute keys currently set for it
+        self._birth_dates = {}  # patient id -> date of birth, for exact age edges
+        self._all = Bitmap()
+        self._loaded = False
+        self._watermark = None
+        self._max_link_id = 0
+        self._caught_up_at = 0.0
+
+    # ---- maintenance -------------------------------------------------------
+
+    def _set(self, key, patient_id):
+        self._bitmaps.setdefault(key, Bitmap()).add(patient_id)
+
+    def _clear(self, key, patient_id):
+        bitmap = self._bitmaps.get(key)
+        if bitmap is not None:
+            bitmap.discard(patient_id)
+            if not bitmap:
+                del self._bitmaps[key]
+
+    def _index_patient(self, values):
+        """(Re)index a patient's own attributes from a dict of column values"""
+        patient_id = values["id"]
+        keys = set()
+        if values.get("is_active", True):
+            for attribute in ("blood_type", "gender"):
+                if values.get(attribute):
+                    keys.add((attribute, values[attribute]))
+            province = _province(values.get("address"))
+            if province:
+                keys.add(("province", province))
+            keys.add(("hospital_id", values["created_by_hospital"]))
+            if values.get("date_of_birth"):
+                keys.add(("birth_year", values["date_of_birth"].year))
+
+        for key in self._patient_keys.get(patient_id, set()) - keys:
+            self._clear(key, patient_id)
+        for key in keys:
+            self._set(key, patient_id)
+        self._patient_keys[patient_id] = keys
+
+        if values.get("date_of_birth"):
+            self._birth_dates[patient_id] = values["date_of_birth"]
+        else:
+            self._birth_dates.pop(patient_id, None)
+        if values.get("is_active", True):
+            self._all.add(patient_id)
+        else:
+            self._all.discard(patient_id)
+
+    def _index_diagnosis(self, patient_id, code, treatment_date):
+        if code:
+            self._set(("diagnosis", code.strip().upper(), _month(treatment_date)), patient_id)
+
+    def _reindex_diagnoses(self, session, patient_ids):
+        """Rebuild diagnosis bits for patients whose encounters changed or were removed"""
+        patient_ids = set(patient_ids)
+        mask = Bitmap(patient_ids)
+        for key in [k for k in self._bitmaps if k[0] == "diagnosis"]:
+            if self._bitmaps[key] & mask:
+                bitmap = self._bitmaps[key] - mask
+                if bitmap:
+                    self._bitmaps[key] = bitmap
+                else:
+                    del self._bitmaps[key]
+        rows = session.execute(
+            select(MedicalEncounter.patient_id, MedicalEncounter.diagnosis_code, MedicalEncounter.treatment_date)
+            .where(MedicalEncounter.patient_id.in_(patient_ids))
+        )
+        for patient_id, code, treatment_date in rows:
+            self._index_diagnosis(patient_id, code, treatment_date)
+
+    def _load_patients(self, session, condition=None):
+        statement = select(
+            Patient.id, Patient.blood_type, Patient.gender, Patient.address,
+            Patient.created_by_hospital, Patient.date_of_birth, Patient.is_active,
+        ).execution_options(yield_per=5000)
+        if condition is not None:
+            statement = statement.where(condition)
+        for row in session.execute(statement):
+            self._index_patient(row._asdict())
+
+    def _load_links(self, session):
+        statement = (
+            select(PatientHospital.id, PatientHospital.patient_id, PatientHospital.hospital_id)
+            .where(PatientHospital.id > self._max_link_id)
+            .execution_options(yield_per=5000)
+        )
+        for link_id, patient_id, hospital_id in session.execute(statement):
+            self._set(("hospital_id", hospital_id), patient_id)
+            self._max_link_id = max(self._max_link_id, link_id)
+
+    def build(self):
+        """Index every patient, hospital link and encounter diagnosis"""
+        started_at = datetime.utcnow()
+        with self._lock, Session(db.engine) as session:
+            self._bitmaps, self._patient_keys, self._birth_dates, self._all = {}, {}, {}, Bitmap()
+            self._max_link_id = 0
+            self._load_patients(session)
+            self._load_links(session)
+            statement = select(
+                MedicalEncounter.patient_id, MedicalEncounter.diagnosis_code, MedicalEncounter.treatment_date,
+            ).execution_options(yield_per=5000)
+            for patient_id, code, treatment_date in session.execute(statement):
+                self._index_diagnosis(patient_id, code, treatment_date)
+            self._watermark = started_at
+            self._caught_up_at = time.monotonic()
+            self._loaded = True
+
+    def catch_up(self):
+        """Apply writes committed by other workers since the last catch-up"""
+        started_at = datetime.utcnow()
+        since = self._watermark - WATERMARK_OVERLAP
+        with self._lock, Session(db.engine) as session:
+            self._load_patients(session, Patient.updated_at >= since)
+            self._load_links(session)
+            changed = session.scalars(
+                select(MedicalEncounter.patient_id).where(MedicalEncounter.updated_at >= since).distinct()
+            ).all()
+            if changed:
+                self._reindex_diagnoses(session, changed)
+            self._watermark = started_at
+            self._caught_up_at = time.monotonic()
+
+    def ensure_current(self):
+        with self._lock:
+            if not self._loaded:
+                self.build()
+            elif time.monotonic() - self._caught_up_at > CATCH_UP_INTERVAL:
+                self.catch_up()
+
+    def handle_patient_events(self, events):
+        if not self._loaded:
+            return
+        with self._lock:
+            for kind, values in events:
+                if kind == "delete":
+                    self._index_patient({**values, "is_active": False})
+                else:
+                    self._index_patient(values)
+
+    def handle_link_events(self, events):
+        if not self._loaded:
+            return
+        with self._lock:
+            for kind, values in events:
+                if kind == "insert":
+                    self._set(("hospital_id", values["hospital_id"]), values["patient_id"])
+
+    def handle_encounter_events(self, events):
+        if not self._loaded:
+            return
+        reindex = set()
+        with self._lock:
+            for kind, values in events:
+                if kind == "insert":
+                    self._index_diagnosis(values["patient_id"], values["diagnosis_code"], values["treatment_date"])
+                else:
+                    reindex.add(values["patient_id"])
+            if reindex:
+                with Session(db.engine) as session:
+                    self._reindex_diagnoses(session, reindex)
+
+    # ---- queries -----------------------------------------------------------
+
+    def _any_of(self, attribute, values):
+        bitmap = Bitmap()
+        for value in values:
+            bitmap |= self._bitmaps.get((attribute, value), Bitmap())
+        return bitmap
+
+    def _age_bitmap(self, age_min, age_max):
+        """Patients whose age today is within [age_min, age_max]"""
+        today = date.today()
+        born_after = _years_before(today, (age_max if age_max is not None else 150) + 1)
+        born_by = _years_before(today, age_min or 0)
+        bitmap = Bitmap()
+        for year in range(born_after.year, born_by.year + 1):
+            year_bitmap = self._bitmaps.get(("birth_year", year), Bitmap())
+            if year in (born_after.year, born_by.year):
+                # Boundary years are only partly inside the range; check exact dates
+                for patient_id in iter_members(year_bitmap):
+                    if born_after < self._birth_dates[patient_id] <= born_by:
+                        bitmap.add(patient_id)
+            else:
+                bitmap |= year_bitmap
+        return bitmap
+
+    def _diagnosis_bitmap(self, codes, date_from=None, date_to=None):
+        """Patients with an encounter coded with (a child of) any code in the month range"""
+        prefixes = tuple(c.strip().upper() for c in codes)
+        first = _month(date_from) if date_from else None
+        last = _month(date_to) if date_to else None
+        bitmap = Bitmap()
+        for key, value in self._bitmaps.items():
+            if key[0] != "diagnosis" or not key[1].startswith(prefixes):
+                continue
+            if (first is None or key[2] >= first) and (last is None or key[2] <= last):
+                bitmap |= value
+        return bitmap
+
+    def evaluate(self, criteria, scope=None):
+        """Bitmap of active patients matching every given criterion.
+
+        criteria keys: blood_type, gender, province, hospital_id (lists, OR'd),
+        age_min/age_max, diagnosis_codes with optional diagnosed_from and
+        diagnosed_to (matched by treatment month), and exclude (a nested
+        criteria dict whose matches are removed). An empty list matches
+        nobody. `scope`, a list of hospital ids, limits the result to those
+        hospitals' patients whatever the criteria say.
+        """
+        with self._lock:
+            bitmap = self._all.copy()
+            if scope is not None:
+                bitmap &= self._any_of("hospital_id", scope)
+            for attribute in LIST_CRITERIA:
+                if criteria.get(attribute) is not None:
+                    values = criteria[attribute]
+                    if attribute == "province":
+                        values = [v.strip().title() for v in values]
+                    bitmap &= self._any_of(attribute, values)
+            if criteria.get("age_min") is not None or criteria.get("age_max") is not None:
+                bitmap &= self._age_bitmap(criteria.get("age_min"), criteria.get("age_max"))
+            if criteria.get("diagnosis_codes"):
+                bitmap &= self._diagnosis_bitmap(
+                    criteria["diagnosis_codes"], criteria.get("diagnosed_from"), criteria.get("diagnosed_to"),
+                )
+            if criteria.get("exclude"):
+                bitmap -= self.evaluate(criteria["exclude"])
+            return bitmap
+
+
+def members_page(bitmap, after=0, limit=PAGE_SIZE):
+    """Up to `limit` member ids after a cursor id, and the next cursor"""
+    ids = []
+    for patient_id in iter_members(bitmap, after):
+        if len(ids) == limit:
+            return ids, ids[-1]
+        ids.append(patient_id)
+    return ids, None
+
+
+def init_cohorts(app):
+    index = CohortIndex()
+    app.extensions["cohorts"] = index
+    subscribe(Patient, index.handle_patient_events, capture=lambda p: {
+        "id": p.id, "blood_type": p.blood_type, "gender": p.gender, "address": p.address,
+        "created_by_hospital": p.created_by_hospital, "date_of_birth": p.date_of_birth, "is_active": p.is_active,
+    })
+    subscribe(PatientHospital, index.handle_link_events)
+    subscribe(MedicalEncounter, index.handle_encounter_events, capture=lambda e: {
+        "patient_id": e.patient_id, "diagnosis_code": e.diagnosis_code, "treatment_date": e.treatment_date,
+    })
+    return index
@@ -0,0 +1,164 @@
+"""Unified login credentials and tunable password hashing.
+
+Hospital admins, doctors and ministry admins sign in through one form but
+live in three tables. ``user_credentials`` indexes all of them by login
+name (username, license number or ministry admin username). Each row holds
+the password hash, the active flag and what the session needs, so a login
+is one indexed lookup and normally one hash verification. A flush
+listener keeps the index in step in the same transaction as the account
+change. Bulk inserts call ``index_accounts()``, and ``flask
+rebuild-credentials`` fills the index for existing accounts. Until it has
+run, a login name with no credential rows is looked up in the account
+tables and the accounts found are indexed, so nobody is locked out.
+
+Passwords are hashed with PASSWORD_HASH_METHOD, in werkzeug's syntax, e.g.
+``scrypt:32768:8:1`` or ``pbkdf2:sha256:600000``. When a login succeeds
+with a hash made under other parameters, the password is rehashed, so a
+change of cost takes effect as users sign in.
+"""
+from datetime import datetime
+
+from sqlalchemy import delete, event, update
+from sqlalchemy.orm import Session
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from models import db, Doctor, HospitalAdmin, Ministry, UserCredential
+
+DEFAULT_METHOD = "scrypt:32768:8:1"
+REBUILD_BATCH_SIZE = 1000
+
+# Model -> (user type, login name attribute, display name attribute)
+ACCOUNTS = {
+    HospitalAdmin: ("hospital_admin", "username", "full_name"),
+    Doctor: ("doctor", "license_no", "full_name"),
+    Ministry: ("ministry", "admin_username", "name"),
+}
+MODELS = {user_type: model for model, (user_type, _, _) in ACCOUNTS.items()}
+# Tried in this order when one login name belongs to several kinds of account
+LOGIN_ORDER = ("hospital_admin", "doctor", "ministry")
+
+_configured = DEFAULT_METHOD
+_method = None
+
+
+def hash_method():
+    """The configured hash method with werkzeug's defaults filled in"""
+    global _method
+    if _method is None:
+        # Hashing once is the only way to learn werkzeug's defaults; done lazily as it costs a full hash
+        _method = generate_password_hash("", method=_configured).split("$", 1)[0]
+    return _method
+
+
+def hash_password(password):
+    return generate_password_hash(password, method=hash_method())
+
+
+def needs_rehash(password_hash):
+    return password_hash.split("$", 1)[0] != hash_method()
+
+
+def _values(obj):
+    user_type, login_attr, name_attr = ACCOUNTS[type(obj)]
+    return {
+        "login_name": getattr(obj, login_attr),
+        "user_type": user_type,
+        "user_id": obj.id,
+        "password_hash": obj.password_hash,
+        "is_active": obj.is_active is not False,
+        "hospital_id": getattr(obj, "hospital_id", None),
+        "display_name": getattr(obj, name_attr),
+        "updated_at": datetime.utcnow(),
+    }
+
+
+def _upsert(connection, values):
+    result = connection.execute(
+        update(UserCredential)
+        .where(UserCredential.user_type == values["user_type"], UserCredential.user_id == values["user_id"])
+        .values(**values)
+    )
+    if result.rowcount == 0:
+        connection.execute(UserCredential.__table__.insert(), [values])
+
+
+def index_accounts(session, accounts):
+    """Index accounts written outside the ORM unit of work (bulk inserts)"""
+    connection = session.connection()
+    for obj in accounts:
+        _upsert(connection, _values(obj))
+
+
+@event.listens_for(Session, "after_flush")
+def _index_changes(session, flush_context):
+    changed = [obj for obj in session.new if type(obj) in ACCOUNTS]
+    changed += [
+        obj for obj in session.dirty
+        if type(obj) in ACCOUNTS and session.is_modified(obj, include_collections=False)
+    ]
+    removed = [obj for obj in session.deleted if type(obj) in ACCOUNTS]
+    if not changed and not removed:
+        return
+    connection = session.connection()
+    for obj in changed:
+        _upsert(connection, _values(obj))
+    for obj in removed:
+        user_type = ACCOUNTS[type(obj)][0]
+        connection.execute(
+            delete(UserCredential).where(UserCredential.user_type == user_type, UserCredential.user_id == obj.id)
+        )
+
+
+def _index_unindexed(login_name):
+    """Index the accounts with this login name found in the account tables"""
+    accounts = []
+    for model, (_, login_attr, _) in ACCOUNTS.items():
+        accounts += model.query.filter(getattr(model, login_attr) == login_name).all()
+    if not accounts:
+        return []
+    index_accounts(db.session, accounts)
+    db.session.commit()
+    return UserCredential.query.filter_by(login_name=login_name).all()
+
+
+def authenticate(login_name, password):
+    """The active credential for a login name and password, or None"""
+    candidates = UserCredential.query.filter_by(login_name=login_name).all()
+    if not candidates:
+        candidates = _index_unindexed(login_name)
+    candidates = [c for c in candidates if c.is_active]
+    candidates.sort(key=lambda c: LOGIN_ORDER.index(c.user_type))
+    for credential in candidates:
+        if check_password_hash(credential.password_hash, password):
+            if needs_rehash(credential.password_hash):
+                account = db.session.get(MODELS[credential.user_type], credential.user_id)
+                account.password_hash = hash_password(password)
+                db.session.commit()
+            return credential
+    return None
+
+
+def rebuild_credentials(progress=None):
+    """Re-index every account, one kind at a time; returns rows written"""
+    total = 0
+    for model, (user_type, _, _) in ACCOUNTS.items():
+        db.session.execute(delete(UserCredential).where(UserCredential.user_type == user_type))
+        last_id = 0
+        while True:
+            batch = model.query.filter(model.id > last_id).order_by(model.id).limit(REBUILD_BATCH_SIZE).all()
+            if not batch:
+                break
+            db.session.execute(UserCredential.__table__.insert(), [_values(obj) for obj in batch])
+            last_id = batch[-1].id
+            total += len(batch)
+        db.session.commit()
+        if progress:
+            progress(user_type, total)
+    return total
+
+
+def init_credentials(app):
+    """Hash new passwords with PASSWORD_HASH_METHOD"""
+    global _configured, _method
+    _configured, _method = app.config.get("PASSWORD_HASH_METHOD", DEFAULT_METHOD), None
+    app.extensions["credentials"] = {"method": _configured}
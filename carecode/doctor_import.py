@@ -0,0 +1,254 @@
+"""Bulk doctor onboarding from ministry registry files (CSV or JSON).
+
+Uniqueness checks run as set-based IN queries instead of one query per
+doctor, password hashing is spread over a process pool, and rows are
+inserted in batches. The pool is spawned rather than forked, as qr_sheets'
+is, because the import runs inside a multi-threaded process.
+
+The ``flask import-doctors`` command imports synchronously. The web upload
+stages the parsed rows in the instance folder and runs them as a
+``doctor_import`` job, so no request waits for the hashing.
+"""
+import csv
+import io
+import json
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from email_validator import validate_email, EmailNotValidError
+from flask import current_app
+from werkzeug.security import generate_password_hash
+
+from models import db, AuditLog, Doctor
+from forms import json_to_contact_info, form_data_to_specialties
+from credentials import hash_method, index_accounts
+from jobs import task
+from model_events import record_bulk
+from outbox import record as record_outbox
+
+BATCH_SIZE = 500
+LOOKUP_CHUNK_SIZE = 1000
+# Below this many passwords a process pool costs more than it saves
+MIN_PARALLEL_HASHES = 16
+STAGING_DIRECTORY = "doctor_imports"
+
+
+def parse_doctor_file(stream, filename):
+    """Read doctor rows from an uploaded CSV or JSON file"""
+    raw = stream.read()
+    if isinstance(raw, bytes):
+        raw = raw.decode("utf-8-sig")
+
+    if filename.lower().endswith(".json"):
+        data = json.loads(raw)
+        if isinstance(data, dict):
+            data = data.get("doctors", [])
+        if not isinstance(data, list):
+            raise ValueError("JSON file must contain a list of doctors")
+        return [row for row in data if isinstance(row, dict)]
+
+    return list(csv.DictReader(io.StringIO(raw)))
+
+
+def _clean(value):
+    if value is None:
+        return ""
+    return str(value).strip()
+
+
+def _row_specialties(row):
+    """Accept either a 'specialties' list / semicolon string or specialty_1..3 columns"""
+    specialties = row.get("specialties")
+    if isinstance(specialties, list):
+        return form_data_to_specialties(*[_clean(s) for s in specialties[:3]])
+    if specialties:
+        return form_data_to_specialties(*[s for s in str(specialties).split(";")][:3])
+    return form_data_to_specialties(
+        _clean(row.get("specialty_1")), _clean(row.get("specialty_2")), _clean(row.get("specialty_3"))
+    )
+
+
+def _existing_values(column, values):
+    """Return the subset of values already present in a Doctor column, chunked IN queries"""
+    values = list(values)
+    existing = set()
+    for start in range(0, len(values), LOOKUP_CHUNK_SIZE):
+        chunk = values[start:start + LOOKUP_CHUNK_SIZE]
+        existing.update(
+            value for (value,) in db.session.query(column).filter(column.in_(chunk))
+        )
+    return existing
+
+
+def validate_doctor_rows(rows):
+    """Validate rows, returning (valid_rows, errors).
+
+    Field checks mirror DoctorForm; duplicates inside the file and against the
+    database are detected with one IN query per chunk rather than per row.
+    """
+    errors = []
+    candidates = []
+    seen_licenses = set()
+    seen_emails = set()
+
+    for line_no, row in enumerate(rows, start=1):
+        license_no = _clean(row.get("license_no"))
+        full_name = " ".join(_clean(row.get("full_name")).split())
+        email = _clean(row.get("email")).lower()
+        password = _clean(row.get("password"))
+
+        row_errors = []
+        if not 3 <= len(license_no) <= 100:
+            row_errors.append("license_no must be 3-100 characters")
+        if not 2 <= len(full_name) <= 255:
+            row_errors.append("full_name must be 2-255 characters")
+        if len(password) < 8:
+            row_errors.append("password must be at least 8 characters long")
+        try:
+            validate_email(email, check_deliverability=False)
+        except EmailNotValidError:
+            row_errors.append("invalid email")
+
+        if license_no in seen_licenses:
+            row_errors.append("duplicate license_no in file")
+        if email and email in seen_emails:
+            row_errors.append("duplicate email in file")
+
+        if row_errors:
+            errors.append({"row": line_no, "license_no": license_no, "errors": row_errors})
+            continue
+
+        seen_licenses.add(license_no)
+        seen_emails.add(email)
+        candidates.append({
+            "row": line_no,
+            "license_no": license_no,
+            "full_name": full_name,
+            "email": email,
+            "password": password,
+            "nic": _clean(row.get("nic")) or None,
+            "phone_primary": _clean(row.get("phone_primary")),
+            "phone_secondary": _clean(row.get("phone_secondary")),
+            "specialties": _row_specialties(row),
+            "is_active": _clean(row.get("is_active")).lower() not in ("0", "false", "no"),
+        })
+
+    taken_licenses = _existing_values(Doctor.license_no, seen_licenses)
+    taken_emails = _existing_values(Doctor.email, seen_emails)
+
+    valid = []
+    for candidate in candidates:
+        row_errors = []
+        if candidate["license_no"] in taken_licenses:
+            row_errors.append("License number already exists")
+        if candidate["email"] in taken_emails:
+            row_errors.append("Email already registered")
+        if row_errors:
+            errors.append({"row": candidate["row"], "license_no": candidate["license_no"], "errors": row_errors})
+        else:
+            valid.append(candidate)
+
+    errors.sort(key=lambda e: e["row"])
+    return valid, errors
+
+
+def hash_passwords(passwords, workers=None):
+    """Hash passwords on a process pool using all available cores"""
+    passwords = list(passwords)
+    workers = workers or os.cpu_count() or 1
+    # The method is passed along: worker processes don't load the app config
+    hash_password = partial(generate_password_hash, method=hash_method())
+    if workers == 1 or len(passwords) < MIN_PARALLEL_HASHES:
+        return [hash_password(p) for p in passwords]
+
+    chunksize = max(1, len(passwords) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return list(pool.map(hash_password, passwords, chunksize=chunksize))
+
+
+def import_doctors(rows, hospital_id, batch_size=BATCH_SIZE, workers=None):
+    """Validate, hash and insert doctors for a hospital.
+
+    Returns a summary dict with the number imported and per-row errors. Only
+    valid rows are inserted; all batches are committed together.
+    """
+    valid, errors = validate_doctor_rows(rows)
+    hashes = hash_passwords((row["password"] for row in valid), workers=workers)
+
+    mappings = []
+    for row, password_hash in zip(valid, hashes):
+        mappings.append({
+            "hospital_id": hospital_id,
+            "license_no": row["license_no"],
+            "password_hash": password_hash,
+            "full_name": row["full_name"],
+            "nic": row["nic"],
+            "contact_info": json_to_contact_info(
+                phone_primary=row["phone_primary"],
+                phone_secondary=row["phone_secondary"],
+                email=row["email"],
+            ),
+            "email": row["email"],
+            "specialties": row["specialties"],
+            "is_active": row["is_active"],
+        })
+
+    try:
+        for start in range(0, len(mappings), batch_size):
+            batch = mappings[start:start + batch_size]
+            db.session.execute(db.insert(Doctor), batch)
+            doctors = Doctor.query.filter(Doctor.license_no.in_([m["license_no"] for m in batch])).all()
+            # Core inserts skip the flush listeners; hand the rows to each read model
+            record_outbox(db.session, "insert", doctors)
+            index_accounts(db.session, doctors)
+            record_bulk(db.session, "insert", doctors)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return {
+        "imported": len(mappings),
+        "failed": len(errors),
+        "errors": errors,
+        "license_numbers": [m["license_no"] for m in mappings],
+    }
+
+
+def stage_rows(instance_path, rows):
+    """Write parsed rows for an import job, readable by this user only; returns the file name"""
+    directory = os.path.join(instance_path, STAGING_DIRECTORY)
+    os.makedirs(directory, exist_ok=True)
+    name = f"{uuid.uuid4().hex}.json"
+    fd = os.open(os.path.join(directory, name), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(rows, f)
+    return name
+
+
+# A single attempt: the staged rows hold plaintext passwords and are removed
+# once it ends, and a retry after a committed import would report every row
+# as a duplicate
+@task("doctor_import", max_attempts=1)
+def import_task(staged_file, hospital_id, filename, acting_user_type=None, acting_user_id=None):
+    path = os.path.join(current_app.instance_path, STAGING_DIRECTORY, os.path.basename(staged_file))
+    try:
+        with open(path, encoding="utf-8") as f:
+            rows = json.load(f)
+        result = import_doctors(rows, hospital_id)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+    db.session.add(AuditLog(
+        acting_user_type=acting_user_type,
+        acting_user_id=acting_user_id,
+        hospital_id=hospital_id,
+        action="doctors_imported",
+        details={"filename": filename, "imported": result["imported"], "failed": result["failed"]},
+    ))
+    db.session.commit()
+    return result
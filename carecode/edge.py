@@ -0,0 +1,592 @@
+"""Offline edge mode for hospitals with unreliable links to the central database.
+
+An edge site runs the normal app against a SQLite snapshot of one
+hospital. The snapshot holds the hospital's patients (registered there or
+linked to it) with their identifiers, its doctors and admins, and its
+encounters from the last ENCOUNTER_DAYS::
+
+    flask edge-snapshot --hospital-id 3 --output clinic3.db     # at central
+    flask edge-token --hospital-id 3                             # at central
+    CARECODE_DATABASE_URL=sqlite:////srv/clinic3.db CARECODE_EDGE_HOSPITAL_ID=3 \\
+    CARECODE_CENTRAL_URL=https://central.example CARECODE_EDGE_TOKEN=... flask run
+    flask edge-sync --every 300                                  # at the edge
+
+Sync sends only changed rows, in batches, read from the change outbox
+(outbox.py) on each side:
+
+* pull: central outbox events after the edge's stored offset, limited to
+  the hospital, each with the row's current values. Rows with local
+  changes not pushed yet are skipped; the push settles them.
+* push: the edge's own outbox events, folded to one change per row. An
+  update or delete carries the ``updated_at`` it was based on. Central
+  applies it only while its row still has that version, compared to the
+  second (the precision of MySQL DATETIME). Otherwise central keeps its
+  version and returns it; the edge applies it and records both versions in
+  ``edge_conflicts``. Identifiers and patient links have no
+  ``updated_at``, so the last write wins.
+
+Sync tokens are signed and carry a per-hospital version stored centrally
+in ``edge_site_tokens``. Issuing a token for a hospital invalidates the
+one before it, and ``flask edge-token --revoke`` invalidates it outright.
+
+Rows created at the edge take ids from EDGE_ID_BASE up, so they never
+collide with central ids pulled later. Central assigns its own ids, and
+both sides keep the mapping in ``edge_id_map``, which also makes a retried
+push of the same insert a no-op. Audit log entries written at the edge
+stay local.
+"""
+import json
+import logging
+import os
+import time
+import urllib.request
+from datetime import date, datetime, timedelta
+
+from flask import current_app, has_app_context
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import Date, DateTime, create_engine, event, func, inspect, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import (db, Doctor, EdgeConflict, EdgeIdMap, EdgeSiteToken, EdgeSyncState, EncounterMedicine, Hospital, HospitalAdmin,
+                    MedicalEncounter, Ministry, OutboxEvent, Patient, PatientBlockingKey, PatientHospital,
+                    PatientIdentifier, PatientNameKey, UserCredential)
+from mpi import refresh_blocking_keys
+from outbox import TRACKED, ack, read_after, register as register_consumer, suppressed
+
+EDGE_ID_BASE = 1_000_000_000
+ENCOUNTER_DAYS = 365
+BATCH_SIZE = 200
+MAX_BATCH_SIZE = 1000
+COPY_BATCH_SIZE = 1000
+PUSH_CONSUMER = "edge-push"
+TOKEN_SALT = "edge-sync"
+
+MODELS = {model.__tablename__: model for model in TRACKED}
+# Columns that may reference rows created at an edge site -> referenced table
+REFERENCES = {
+    "patient_identifiers": {"patient_id": "patients"},
+    "medical_encounters": {"patient_id": "patients", "doctor_id": "doctors"},
+    "patient_hospitals": {"patient_id": "patients"},
+}
+
+logger = logging.getLogger(__name__)
+
+
+# ---- tokens --------------------------------------------------------------
+
+def _serializer(app):
+    return URLSafeSerializer(app.config["SECRET_KEY"], salt=TOKEN_SALT)
+
+
+def _site_token(hospital_id):
+    site = db.session.get(EdgeSiteToken, hospital_id)
+    if site is None:
+        site = EdgeSiteToken(hospital_id=hospital_id, version=0)
+        db.session.add(site)
+    return site
+
+
+def make_token(app, hospital_id):
+    """A new sync token for the hospital's edge site, replacing any earlier one (the caller commits)"""
+    site = _site_token(hospital_id)
+    site.version += 1
+    site.issued_at, site.revoked_at = datetime.utcnow(), None
+    return _serializer(app).dumps({"hospital_id": hospital_id, "version": site.version})
+
+
+def revoke_token(hospital_id):
+    """Invalidate the hospital's current sync token (the caller commits)"""
+    site = _site_token(hospital_id)
+    site.version += 1
+    site.revoked_at = datetime.utcnow()
+
+
+def token_hospital(app, authorization):
+    """Hospital id of a valid, current "Bearer <token>" header, else None"""
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        payload = _serializer(app).loads(token)
+        hospital_id, version = payload["hospital_id"], payload["version"]
+    except (BadSignature, KeyError, TypeError):
+        return None
+    current = db.session.scalar(select(EdgeSiteToken.version).where(EdgeSiteToken.hospital_id == hospital_id))
+    return hospital_id if current is not None and current == version else None
+
+
+# ---- rows ----------------------------------------------------------------
+
+def _jsonable(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _version(value):
+    """updated_at compared to the second, the precision of MySQL DATETIME"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.replace(microsecond=0) if value else None
+
+
+def row_data(obj):
+    """Every column of a synced row, JSON-ready; encounters include their prescriptions"""
+    data = {attr.key: _jsonable(getattr(obj, attr.key)) for attr in inspect(obj).mapper.column_attrs}
+    if isinstance(obj, MedicalEncounter):
+        data["prescriptions"] = [
+            {"name": m.drug_name, "code": m.drug_code, "dosage": m.dosage, "frequency": m.frequency,
+             "duration": m.duration}
+            for m in obj.prescriptions
+        ]
+    return data
+
+
+def _column_value(column, value):
+    if value is None:
+        return None
+    if isinstance(column.type, DateTime):
+        return datetime.fromisoformat(value)
+    if isinstance(column.type, Date):
+        return date.fromisoformat(value)
+    return value
+
+
+def _assign(obj, data):
+    # updated_at is set explicitly, so the row keeps the version it was sent with
+    for attr in inspect(type(obj)).column_attrs:
+        if attr.key != "id" and attr.key in data:
+            setattr(obj, attr.key, _column_value(attr.columns[0], data[attr.key]))
+
+
+def _after_write(obj, data):
+    """Keep derived rows in step, as the app's own forms do"""
+    if isinstance(obj, MedicalEncounter) and "prescriptions" in data:
+        obj.set_prescriptions(data["prescriptions"])
+    db.session.flush()
+    if isinstance(obj, Patient):
+        refresh_blocking_keys(obj)
+    elif isinstance(obj, PatientIdentifier):
+        patient = db.session.get(Patient, obj.patient_id)
+        if patient is not None:
+            refresh_blocking_keys(patient)
+
+
+def _translate(data, entity, to_id):
+    for column, target in REFERENCES.get(entity, {}).items():
+        if data.get(column) is not None:
+            data[column] = to_id(target, data[column])
+
+
+def _central_id(hospital_id, entity, edge_id):
+    """Central id for an id sent by an edge site (ids below EDGE_ID_BASE already are)"""
+    if edge_id is None or edge_id < EDGE_ID_BASE:
+        return edge_id
+    return db.session.scalar(
+        select(EdgeIdMap.central_id).where(
+            EdgeIdMap.hospital_id == hospital_id, EdgeIdMap.entity == entity, EdgeIdMap.edge_id == edge_id
+        )
+    )
+
+
+def _local_id(hospital_id, entity, central_id):
+    """Edge id for a central id: the local id of a row created here, else the central id"""
+    edge_id = db.session.scalar(
+        select(EdgeIdMap.edge_id).where(
+            EdgeIdMap.hospital_id == hospital_id, EdgeIdMap.entity == entity, EdgeIdMap.central_id == central_id
+        )
+    )
+    return central_id if edge_id is None else edge_id
+
+
+def _scoped_patients(hospital_id, patient_ids):
+    """The patients among `patient_ids` registered at or linked to the hospital"""
+    if not patient_ids:
+        return set()
+    registered = select(Patient.id).where(Patient.id.in_(patient_ids), Patient.created_by_hospital == hospital_id)
+    linked = select(PatientHospital.patient_id).where(
+        PatientHospital.patient_id.in_(patient_ids), PatientHospital.hospital_id == hospital_id
+    )
+    return set(db.session.scalars(registered.union(linked)))
+
+
+def _in_scope(hospital_id, obj):
+    if isinstance(obj, (Doctor, MedicalEncounter)):
+        return obj.hospital_id == hospital_id
+    if isinstance(obj, Patient):
+        return obj.created_by_hospital == hospital_id or obj.id in _scoped_patients(hospital_id, [obj.id])
+    if isinstance(obj, PatientHospital) and obj.hospital_id == hospital_id:
+        return True
+    return obj.patient_id in _scoped_patients(hospital_id, [obj.patient_id])
+
+
+# ---- snapshot (central) --------------------------------------------------
+
+def export_snapshot(hospital_id, path, encounter_days=ENCOUNTER_DAYS, progress=None):
+    """Write a SQLite snapshot of one hospital to `path`; returns rows copied per table"""
+    if db.session.get(Hospital, hospital_id) is None:
+        raise ValueError(f"No hospital {hospital_id}")
+    # Read the offset first: changes racing the copy are pulled again, harmlessly
+    offset = db.session.scalar(select(func.max(OutboxEvent.id))) or 0
+
+    since = date.today() - timedelta(days=encounter_days)
+    patient_ids = select(Patient.id).where(or_(
+        Patient.created_by_hospital == hospital_id,
+        Patient.id.in_(select(PatientHospital.patient_id).where(PatientHospital.hospital_id == hospital_id)),
+    ))
+    encounter_ids = select(MedicalEncounter.id).where(
+        MedicalEncounter.hospital_id == hospital_id, MedicalEncounter.treatment_date >= since
+    )
+    doctor_ids = select(MedicalEncounter.doctor_id).where(MedicalEncounter.id.in_(encounter_ids))
+
+    def without_password(row):
+        return {**row, "password_hash": ""}
+
+    def other_doctors_without_password(row):
+        return row if row["hospital_id"] == hospital_id else without_password(row)
+
+    copies = [
+        (Ministry, None, without_password),
+        (Hospital, None, None),
+        (HospitalAdmin, HospitalAdmin.hospital_id == hospital_id, None),
+        (UserCredential, UserCredential.hospital_id == hospital_id, None),  # logins of the copied accounts
+        (Doctor, or_(Doctor.hospital_id == hospital_id, Doctor.id.in_(doctor_ids)), other_doctors_without_password),
+        (Patient, Patient.id.in_(patient_ids), None),
+        (PatientIdentifier, PatientIdentifier.patient_id.in_(patient_ids), None),
+        (PatientHospital, PatientHospital.patient_id.in_(patient_ids), None),
+        (MedicalEncounter, MedicalEncounter.id.in_(encounter_ids), None),
+        (EncounterMedicine, EncounterMedicine.encounter_id.in_(encounter_ids), None),
+        (PatientNameKey, PatientNameKey.patient_id.in_(patient_ids), None),
+        (PatientBlockingKey, PatientBlockingKey.patient_id.in_(patient_ids), None),
+    ]
+
+    if os.path.exists(path):
+        os.remove(path)
+    engine = create_engine(f"sqlite:///{path}")
+    db.metadata.create_all(engine)
+    counts = {}
+    try:
+        for model, where, transform in copies:
+            table = model.__table__
+            statement = select(table) if where is None else select(table).where(where)
+            result = db.session.execute(statement.execution_options(yield_per=COPY_BATCH_SIZE)).mappings()
+            copied = 0
+            for rows in result.partitions():
+                rows = [transform(dict(r)) if transform else dict(r) for r in rows]
+                with engine.begin() as conn:
+                    conn.execute(table.insert(), rows)
+                copied += len(rows)
+            counts[table.name] = copied
+            if progress:
+                progress(table.name, copied)
+        with engine.begin() as conn:
+            conn.execute(EdgeSyncState.__table__.insert(), [{
+                "hospital_id": hospital_id, "central_offset": offset, "snapshot_at": datetime.utcnow(),
+            }])
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql("VACUUM")
+    finally:
+        engine.dispose()
+    return counts
+
+
+# ---- central side of sync ------------------------------------------------
+
+def changes_since(hospital_id, after, limit=BATCH_SIZE):
+    """Current values of the hospital's rows changed after a central outbox offset: (changes, offset)"""
+    events, offset = read_after(after, limit)
+    latest = {}
+    for e in events:  # one change per row, at the position of its last event
+        latest.pop((e.entity, e.entity_id), None)
+        latest[(e.entity, e.entity_id)] = e
+
+    rows = {}
+    for entity in {entity for entity, _ in latest}:
+        model = MODELS[entity]
+        ids = [entity_id for e, entity_id in latest if e == entity]
+        rows.update({(entity, obj.id): obj for obj in model.query.filter(model.id.in_(ids))})
+    scoped = _scoped_patients(hospital_id, {
+        obj.id if isinstance(obj, Patient) else obj.patient_id
+        for obj in rows.values() if not isinstance(obj, Doctor)
+    })
+
+    changes = []
+    for (entity, entity_id), e in latest.items():
+        obj = rows.get((entity, entity_id))
+        if obj is None:
+            if e.op == "delete":  # the edge ignores rows it never had
+                changes.append({"entity": entity, "id": entity_id, "op": "delete"})
+            continue
+        if isinstance(obj, (Doctor, MedicalEncounter)):
+            if obj.hospital_id != hospital_id:
+                continue
+        elif (obj.id if isinstance(obj, Patient) else obj.patient_id) not in scoped:
+            continue
+        if isinstance(obj, PatientHospital) and obj.hospital_id == hospital_id and e.op == "insert":
+            # Newly linked here: the patient's record was never sent before
+            patient = db.session.get(Patient, obj.patient_id)
+            changes.append({"entity": "patients", "id": patient.id, "op": "upsert", "row": row_data(patient)})
+            for identifier in PatientIdentifier.query.filter_by(patient_id=patient.id):
+                changes.append({"entity": "patient_identifiers", "id": identifier.id, "op": "upsert",
+                                "row": row_data(identifier)})
+        changes.append({"entity": entity, "id": entity_id, "op": "upsert", "row": row_data(obj)})
+    return changes, offset
+
+
+def _apply_push(hospital_id, change):
+    entity, op = change["entity"], change["op"]
+    model = MODELS.get(entity)
+    if model is None or op not in ("insert", "update", "delete"):
+        raise ValueError(f"Unsupported change {entity} {op}")
+    data = dict(change.get("row") or {})
+    _translate(data, entity, lambda target, edge_id: _central_id(hospital_id, target, edge_id))
+    central_id = _central_id(hospital_id, entity, change["id"])
+    obj = db.session.get(model, central_id) if central_id is not None else None
+
+    if obj is None:
+        if op == "delete":
+            return {"status": "applied"}
+        if op == "update":
+            raise ValueError("Row not found")
+        obj = model()
+        _assign(obj, data)
+        if not _in_scope(hospital_id, obj):
+            raise ValueError("Row belongs to another hospital")
+        db.session.add(obj)
+        _after_write(obj, data)
+        if change["id"] >= EDGE_ID_BASE:
+            db.session.add(EdgeIdMap(hospital_id=hospital_id, entity=entity, edge_id=change["id"], central_id=obj.id))
+        return {"status": "applied", "central_id": obj.id}
+
+    if not _in_scope(hospital_id, obj):
+        raise ValueError("Row belongs to another hospital")
+    if op == "insert":  # a retried push
+        return {"status": "applied", "central_id": obj.id}
+    if "updated_at" in inspect(model).column_attrs:
+        current = _version(obj.updated_at)
+        if current not in (_version(change.get("base_updated_at")), _version(data.get("updated_at"))):
+            return {"status": "conflict", "central_id": obj.id, "row": row_data(obj)}
+    if op == "delete":
+        db.session.delete(obj)
+        return {"status": "applied", "central_id": obj.id}
+    _assign(obj, data)
+    if not _in_scope(hospital_id, obj):
+        raise ValueError("Row cannot move to another hospital")
+    _after_write(obj, data)
+    return {"status": "applied", "central_id": obj.id}
+
+
+def apply_push(hospital_id, changes):
+    """Apply an edge site's changes in order, each in its own savepoint; returns one result per change"""
+    results = []
+    for change in changes:
+        try:
+            with db.session.begin_nested():
+                result = _apply_push(hospital_id, change)
+        except (IntegrityError, ValueError, KeyError, TypeError) as e:
+            result = {"status": "rejected", "error": str(getattr(e, "orig", e))}
+        results.append(result)
+    db.session.commit()
+    return results
+
+
+# ---- edge side of sync ---------------------------------------------------
+
+class CentralClient:
+    """JSON over HTTP to the central app's /api/edge endpoints"""
+
+    def __init__(self, base_url, token, timeout=60):
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.timeout = timeout
+
+    def request(self, method, path, body=None):
+        request = urllib.request.Request(
+            self.base_url + path,
+            method=method,
+            data=json.dumps(body).encode() if body is not None else None,
+            headers={"Authorization": f"Bearer {self.token}", "Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def changes(self, after, limit):
+        return self.request("GET", f"/api/edge/changes?after={after}&limit={limit}")
+
+    def push(self, changes):
+        return self.request("POST", "/api/edge/push", {"changes": changes})["results"]
+
+
+def _state():
+    state = db.session.get(EdgeSyncState, current_app.config.get("EDGE_HOSPITAL_ID"))
+    if state is None:
+        raise RuntimeError("This database is not an edge snapshot for EDGE_HOSPITAL_ID")
+    return state
+
+
+def _pending_rows():
+    position = register_consumer(PUSH_CONSUMER).position
+    return {
+        tuple(row) for row in db.session.execute(
+            select(OutboxEvent.entity, OutboxEvent.entity_id).where(OutboxEvent.id > position).distinct()
+        )
+    }
+
+
+def _apply_central(hospital_id, change, pending):
+    """Apply one central change locally (inside suppressed()); returns 1 if applied"""
+    entity = change["entity"]
+    model = MODELS[entity]
+    local_id = _local_id(hospital_id, entity, change["id"])
+    if (entity, local_id) in pending:
+        return 0
+    obj = db.session.get(model, local_id)
+    if change["op"] == "delete":
+        if obj is None:
+            return 0
+        db.session.delete(obj)
+        return 1
+    data = dict(change["row"])
+    _translate(data, entity, lambda target, central_id: _local_id(hospital_id, target, central_id))
+    if obj is None:
+        obj = model(id=local_id)
+        db.session.add(obj)
+    _assign(obj, data)
+    _after_write(obj, data)
+    return 1
+
+
+def pull(client, batch_size=BATCH_SIZE):
+    """Apply central changes until caught up; returns rows applied"""
+    applied = 0
+    while True:
+        state = _state()
+        response = client.changes(state.central_offset, batch_size)
+        if response["offset"] == state.central_offset:
+            return applied
+        pending = _pending_rows()
+        with suppressed(db.session):
+            for change in response["changes"]:
+                applied += _apply_central(state.hospital_id, change, pending)
+            state.central_offset = response["offset"]
+            state.last_pull_at = datetime.utcnow()
+            db.session.flush()
+        db.session.commit()
+
+
+def _outgoing(events):
+    """Fold local outbox events into one change per row, in order of first change"""
+    changes = {}
+    for e in events:
+        change = changes.get((e.entity, e.entity_id))
+        if change is None:
+            changes[(e.entity, e.entity_id)] = {
+                "entity": e.entity, "id": e.entity_id, "op": e.op,
+                "base_updated_at": _jsonable(e.base_updated_at),
+            }
+        elif e.op == "delete":
+            change["op"] = None if change["op"] == "insert" else "delete"
+
+    outgoing = []
+    for change in changes.values():
+        if change["op"] in ("insert", "update"):
+            obj = db.session.get(MODELS[change["entity"]], change["id"])
+            if obj is None:  # deleted by a later event beyond this batch
+                change["op"] = "delete" if change["op"] == "update" else None
+            else:
+                change["row"] = row_data(obj)
+        if change["op"]:
+            outgoing.append(change)
+    return outgoing
+
+
+def push(client, batch_size=BATCH_SIZE):
+    """Send local changes until none are left; returns (applied, not applied)"""
+    applied = refused = 0
+    while True:
+        hospital_id = _state().hospital_id
+        position = register_consumer(PUSH_CONSUMER).position
+        events, offset = read_after(position, batch_size)
+        if offset == position:
+            return applied, refused
+        changes = _outgoing(events)
+        results = client.push(changes) if changes else []
+        for change, result in zip(changes, results):
+            if result["status"] == "applied":
+                applied += 1
+                if change["op"] == "insert" and change["id"] >= EDGE_ID_BASE:
+                    db.session.merge(EdgeIdMap(hospital_id=hospital_id, entity=change["entity"],
+                                               edge_id=change["id"], central_id=result["central_id"]))
+                continue
+            refused += 1
+            db.session.add(EdgeConflict(
+                entity=change["entity"], entity_id=change["id"], op=change["op"], reason=result["status"],
+                local_row=change.get("row"), central_row=result.get("row"),
+            ))
+            if result.get("row"):  # central keeps its version; so does the edge
+                with suppressed(db.session):
+                    _apply_central(hospital_id, {"entity": change["entity"], "id": result["central_id"],
+                                                 "op": "upsert", "row": result["row"]}, set())
+                    db.session.flush()
+            logger.warning(f"Edge change to {change['entity']} {change['id']} {result['status']}: "
+                           f"{result.get('error', 'central row changed')}")
+        _state().last_push_at = datetime.utcnow()
+        ack(PUSH_CONSUMER, offset)
+
+
+def sync(client, batch_size=BATCH_SIZE):
+    """One round: pull central changes, then push local ones"""
+    pulled = pull(client, batch_size)
+    pushed, refused = push(client, batch_size)
+    return {"pulled": pulled, "pushed": pushed, "refused": refused}
+
+
+def run_sync(app, every=None, batch_size=BATCH_SIZE):
+    """Sync now, or every `every` seconds until interrupted, logging failed rounds"""
+    client = CentralClient(app.config["EDGE_CENTRAL_URL"], app.config["EDGE_SYNC_TOKEN"])
+    while True:
+        try:
+            yield sync(client, batch_size)
+        except OSError as e:  # offline: try again next round
+            db.session.rollback()
+            if every is None:
+                raise
+            logger.warning(f"Edge sync failed: {e}")
+        if every is None:
+            return
+        time.sleep(every)
+
+
+# ---- edge id allocation --------------------------------------------------
+
+@event.listens_for(Session, "before_flush")
+def _assign_edge_ids(session, flush_context, instances):
+    if not has_app_context() or not current_app.config.get("EDGE_HOSPITAL_ID"):
+        return
+    new = {}
+    for obj in session.new:
+        if type(obj) in TRACKED and obj.id is None:
+            new.setdefault(type(obj), []).append(obj)
+    for model, objects in new.items():
+        last = session.scalar(select(func.max(model.id)).where(model.id >= EDGE_ID_BASE)) or EDGE_ID_BASE - 1
+        for obj in objects:
+            last += 1
+            obj.id = last
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")  # readers don't block the sync writer
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
+
+def init_edge(app):
+    """Configure edge mode when EDGE_HOSPITAL_ID is set"""
+    hospital_id = app.config.get("EDGE_HOSPITAL_ID")
+    app.extensions["edge"] = {"hospital_id": hospital_id}
+    if hospital_id and app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+        with app.app_context():
+            event.listen(db.engine, "connect", _sqlite_pragmas)
+    return app.extensions["edge"]
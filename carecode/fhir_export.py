@@ -0,0 +1,261 @@
+"""FHIR R4 bulk-data ($export) of a hospital's patients, practitioners and encounters.
+
+Each resource type is streamed from a server-side cursor in fixed-size
+partitions straight into an NDJSON file, so memory use does not grow with
+the size of the hospital. Exports run as "fhir_export" background jobs.
+"""
+import json
+import os
+from datetime import datetime, timezone
+
+from sqlalchemy import or_, select
+from flask import current_app
+from sqlalchemy.orm import Session
+
+from jobs import task
+from models import db, ExportJob, Patient, PatientIdentifier, PatientHospital, Doctor, MedicalEncounter
+
+RESOURCE_TYPES = ("Patient", "Practitioner", "Encounter")
+STREAM_BATCH_SIZE = 1000
+
+ICD10_SYSTEM = "http://hl7.org/fhir/sid/icd-10"
+ACT_CODE_SYSTEM = "http://terminology.hl7.org/CodeSystem/v3-ActCode"
+LICENSE_SYSTEM = "urn:carecode:medical-license"
+BLOOD_TYPE_EXTENSION = "urn:carecode:fhir:blood-type"
+
+_GENDERS = {"male": "male", "female": "female", "other": "other"}
+
+
+def _instant(value):
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.isoformat()
+
+
+def _telecom(contact_info, email=None):
+    contact_info = contact_info if isinstance(contact_info, dict) else {}
+    telecom = []
+    for key, use in (("phone_primary", "mobile"), ("phone_secondary", "home")):
+        if contact_info.get(key):
+            telecom.append({"system": "phone", "value": contact_info[key], "use": use})
+    email = email or contact_info.get("email")
+    if email:
+        telecom.append({"system": "email", "value": email})
+    return telecom
+
+
+def _address(address):
+    if not isinstance(address, dict) or not address:
+        return []
+    entry = {
+        "line": [address[k] for k in ("line1", "line2") if address.get(k)],
+        "city": address.get("city"),
+        "state": address.get("province"),
+        "postalCode": address.get("postal_code"),
+        "country": address.get("country"),
+    }
+    return [{k: v for k, v in entry.items() if v}]
+
+
+def _prune(resource):
+    """Drop empty elements, which FHIR does not allow"""
+    return {k: v for k, v in resource.items() if v not in (None, [], {}, "")}
+
+
+def patient_to_fhir(patient, identifiers):
+    resource = {
+        "resourceType": "Patient",
+        "id": str(patient.id),
+        "meta": {"lastUpdated": _instant(patient.updated_at)},
+        "active": bool(patient.is_active),
+        "identifier": [
+            {
+                "system": f"urn:carecode:identifier:{identifier.id_type}",
+                "value": identifier.id_value,
+            }
+            for identifier in identifiers
+        ],
+        "name": [{"text": patient.full_name}],
+        "telecom": _telecom(patient.contact_info, patient.email),
+        "gender": _GENDERS.get(patient.gender, "unknown") if patient.gender else None,
+        "birthDate": patient.date_of_birth.isoformat() if patient.date_of_birth else None,
+        "address": _address(patient.address),
+        "contact": (
+            [{"telecom": [{"system": "phone", "value": patient.guardian_number}]}]
+            if patient.guardian_number else None
+        ),
+        "managingOrganization": {"reference": f"Organization/{patient.created_by_hospital}"},
+        "extension": (
+            [{"url": BLOOD_TYPE_EXTENSION, "valueString": patient.blood_type}]
+            if patient.blood_type else None
+        ),
+    }
+    return _prune(resource)
+
+
+def practitioner_to_fhir(doctor):
+    resource = {
+        "resourceType": "Practitioner",
+        "id": str(doctor.id),
+        "meta": {"lastUpdated": _instant(doctor.updated_at)},
+        "active": bool(doctor.is_active),
+        "identifier": [{"system": LICENSE_SYSTEM, "value": doctor.license_no}],
+        "name": [{"text": doctor.full_name}],
+        "telecom": _telecom(doctor.contact_info, doctor.email),
+        "qualification": [{"code": {"text": s}} for s in (doctor.specialties or [])],
+    }
+    return _prune(resource)
+
+
+def encounter_to_fhir(encounter):
+    reason = _prune({
+        "coding": (
+            [{"system": ICD10_SYSTEM, "code": encounter.diagnosis_code}]
+            if encounter.diagnosis_code else None
+        ),
+        "text": encounter.diagnosis_text,
+    })
+    resource = {
+        "resourceType": "Encounter",
+        "id": str(encounter.id),
+        "meta": {"lastUpdated": _instant(encounter.updated_at)},
+        "identifier": (
+            [{"system": "urn:carecode:receipt-number", "value": encounter.receipt_number}]
+            if encounter.receipt_number else None
+        ),
+        "status": "finished",
+        "class": {"system": ACT_CODE_SYSTEM, "code": "AMB", "display": "ambulatory"},
+        "subject": {"reference": f"Patient/{encounter.patient_id}"},
+        "participant": [{"individual": {"reference": f"Practitioner/{encounter.doctor_id}"}}],
+        "period": {"start": encounter.treatment_date.isoformat()},
+        "reasonCode": [reason] if reason else None,
+        "serviceProvider": {"reference": f"Organization/{encounter.hospital_id}"},
+    }
+    return _prune(resource)
+
+
+def _stream(statement):
+    """Yield ORM partitions from a server-side cursor, detaching each after use"""
+    result = db.session.execute(statement.execution_options(yield_per=STREAM_BATCH_SIZE))
+    for partition in result.scalars().partitions():
+        yield partition
+        for obj in partition:
+            db.session.expunge(obj)
+
+
+def _patient_resources(hospital_id, since):
+    linked = select(PatientHospital.patient_id).where(PatientHospital.hospital_id == hospital_id)
+    statement = select(Patient).where(
+        or_(Patient.created_by_hospital == hospital_id, Patient.id.in_(linked))
+    )
+    if since:
+        changed_identifiers = select(PatientIdentifier.patient_id).where(PatientIdentifier.created_at >= since)
+        statement = statement.where(or_(Patient.updated_at >= since, Patient.id.in_(changed_identifiers)))
+
+    # The streaming cursor holds its connection until exhausted (MySQL cannot
+    # interleave queries on it), so identifiers are fetched on a second one.
+    with Session(db.engine) as lookup:
+        for partition in _stream(statement.order_by(Patient.id)):
+            identifiers = {}
+            rows = lookup.scalars(
+                select(PatientIdentifier)
+                .where(PatientIdentifier.patient_id.in_([p.id for p in partition]))
+                .order_by(PatientIdentifier.id)
+            )
+            for identifier in rows:
+                identifiers.setdefault(identifier.patient_id, []).append(identifier)
+            for patient in partition:
+                yield patient_to_fhir(patient, identifiers.get(patient.id, []))
+            lookup.expunge_all()
+
+
+def _practitioner_resources(hospital_id, since):
+    statement = select(Doctor).where(Doctor.hospital_id == hospital_id)
+    if since:
+        statement = statement.where(Doctor.updated_at >= since)
+    for partition in _stream(statement.order_by(Doctor.id)):
+        for doctor in partition:
+            yield practitioner_to_fhir(doctor)
+
+
+def _encounter_resources(hospital_id, since):
+    statement = select(MedicalEncounter).where(MedicalEncounter.hospital_id == hospital_id)
+    if since:
+        statement = statement.where(MedicalEncounter.updated_at >= since)
+    for partition in _stream(statement.order_by(MedicalEncounter.id)):
+        for encounter in partition:
+            yield encounter_to_fhir(encounter)
+
+
+_GENERATORS = {
+    "Patient": _patient_resources,
+    "Practitioner": _practitioner_resources,
+    "Encounter": _encounter_resources,
+}
+
+
+def export_directory(instance_path, job_id):
+    return os.path.join(instance_path, "exports", job_id)
+
+
+def write_ndjson(path, resources):
+    """Write resources one JSON document per line; returns the count"""
+    count = 0
+    tmp_path = f"{path}.part"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for resource in resources:
+            f.write(json.dumps(resource, ensure_ascii=False, separators=(",", ":")))
+            f.write("\n")
+            count += 1
+    os.replace(tmp_path, path)
+    return count
+
+
+def run_export(job_id, instance_path):
+    """Produce the NDJSON files for an export job and record the manifest"""
+    job = db.session.get(ExportJob, job_id)
+    job.status = "in_progress"
+    job.started_at = datetime.utcnow()
+    db.session.commit()
+
+    hospital_id, since, resource_types = job.hospital_id, job.since, list(job.resource_types)
+    directory = export_directory(instance_path, job_id)
+    os.makedirs(directory, exist_ok=True)
+
+    try:
+        output = []
+        for resource_type in resource_types:
+            path = os.path.join(directory, f"{resource_type}.ndjson")
+            count = write_ndjson(path, _GENERATORS[resource_type](hospital_id, since))
+            output.append({"type": resource_type, "count": count})
+
+        job = db.session.get(ExportJob, job_id)
+        job.output = output
+        job.status = "completed"
+        job.error = None
+        job.completed_at = datetime.utcnow()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        # Back to accepted while the job runner retries; mark_export_failed ends it
+        job = db.session.get(ExportJob, job_id)
+        job.status = "accepted"
+        job.error = str(e)
+        db.session.commit()
+        raise
+
+
+def mark_export_failed(payload, error):
+    job = db.session.get(ExportJob, payload["job_id"])
+    job.status = "failed"
+    job.error = job.error or error
+    job.completed_at = datetime.utcnow()
+    db.session.commit()
+
+
+@task("fhir_export", max_attempts=3, on_failure=mark_export_failed)
+def export_task(job_id):
+    run_export(job_id, current_app.instance_path)
+    return {"export_job_id": job_id}
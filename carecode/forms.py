@@ -1,6 +1,7 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import (
-    StringField, PasswordField, TextAreaField, SelectField,
+    Form, StringField, PasswordField, TextAreaField, SelectField,
     DateField, BooleanField, FieldList, FormField, HiddenField,
     EmailField, TelField, SubmitField
 )
@@ -140,6 +141,13 @@ class PatientForm(FlaskForm):
 
     guardian_number = StringField('Guardian/Emergency Contact', validators=[Optional(), Length(max=100)])
 
+    # National identifiers, optional; used for duplicate matching at registration
+    nic = StringField('NIC Number', validators=[Optional(), Length(max=100)])
+    passport_no = StringField('Passport Number', validators=[Optional(), Length(max=100)])
+
+    # Set once the user has seen the possible duplicates and still wants a new record
+    confirm_new = HiddenField()
+
     submit = SubmitField('Save Patient')
 
     def __init__(self, patient_id=None, *args, **kwargs):
@@ -194,6 +202,11 @@ class PatientForm(FlaskForm):
             if existing and (not self.patient_id or existing.id != self.patient_id):
                 raise ValidationError('This email is already registered to another patient')
 
+    def identifiers(self):
+        """(id_type, id_value) pairs of the identifiers filled in"""
+        values = (('nic', self.nic.data), ('passport', self.passport_no.data))
+        return [(id_type, value.strip()) for id_type, value in values if value and value.strip()]
+
     def clean_data(self):
         """Clean and normalize form data"""
         cleaned_data = {}
@@ -312,6 +325,23 @@ class DoctorForm(FlaskForm):
             raise ValidationError('Email already registered')
 
 
+class DoctorImportForm(FlaskForm):
+    registry_file = FileField('Doctor Registry File', validators=[
+        FileRequired(),
+        FileAllowed(['csv', 'json'], 'Only CSV or JSON files are allowed')
+    ])
+    submit = SubmitField('Import Doctors')
+
+
+class MedicineEntryForm(Form):
+    """One prescription row inside MedicalEncounterForm.medicines"""
+    name = StringField('Medicine', validators=[Optional(), Length(max=200)])
+    code = StringField('Drug Code', validators=[Optional(), Length(max=50)])
+    dosage = StringField('Dosage', validators=[Optional(), Length(max=100)])
+    frequency = StringField('Frequency', validators=[Optional(), Length(max=100)])
+    duration = StringField('Duration', validators=[Optional(), Length(max=100)])
+
+
 class MedicalEncounterForm(FlaskForm):
     receipt_number = StringField('Receipt Number', validators=[Optional(), Length(max=255)])
     patient_id = HiddenField('Patient ID', validators=[DataRequired()])
@@ -320,21 +350,8 @@ class MedicalEncounterForm(FlaskForm):
                                    render_kw={"rows": 4, "placeholder": "Enter detailed diagnosis..."})
     diagnosis_code = StringField('Diagnosis Code (ICD-10)', validators=[Optional(), Length(max=100)])
 
-    # Medicine fields - we'll handle this as a JSON field but provide individual inputs
-    medicine_1_name = StringField('Medicine 1 - Name', validators=[Optional(), Length(max=200)])
-    medicine_1_dosage = StringField('Medicine 1 - Dosage', validators=[Optional(), Length(max=100)])
-    medicine_1_frequency = StringField('Medicine 1 - Frequency', validators=[Optional(), Length(max=100)])
-    medicine_1_duration = StringField('Medicine 1 - Duration', validators=[Optional(), Length(max=100)])
-
-    medicine_2_name = StringField('Medicine 2 - Name', validators=[Optional(), Length(max=200)])
-    medicine_2_dosage = StringField('Medicine 2 - Dosage', validators=[Optional(), Length(max=100)])
-    medicine_2_frequency = StringField('Medicine 2 - Frequency', validators=[Optional(), Length(max=100)])
-    medicine_2_duration = StringField('Medicine 2 - Duration', validators=[Optional(), Length(max=100)])
-
-    medicine_3_name = StringField('Medicine 3 - Name', validators=[Optional(), Length(max=200)])
-    medicine_3_dosage = StringField('Medicine 3 - Dosage', validators=[Optional(), Length(max=100)])
-    medicine_3_frequency = StringField('Medicine 3 - Frequency', validators=[Optional(), Length(max=100)])
-    medicine_3_duration = StringField('Medicine 3 - Duration', validators=[Optional(), Length(max=100)])
+    # Any number of medicines; the template adds rows client-side
+    medicines = FieldList(FormField(MedicineEntryForm), min_entries=1, max_entries=50)
 
     suggestions = TextAreaField('Treatment Suggestions', validators=[Optional()],
                                 render_kw={"rows": 3, "placeholder": "Additional treatment suggestions..."})
@@ -342,34 +359,66 @@ class MedicalEncounterForm(FlaskForm):
 
     submit = SubmitField('Save Encounter')
 
+    diagnosis_code_warning = None
+
     def validate_treatment_date(self, field):
         if field.data and field.data > date.today():
             raise ValidationError('Treatment date cannot be in the future')
 
+    def validate_diagnosis_code(self, field):
+        """Store codes in canonical form. The catalog only holds common codes, so a
+        well-formed code missing from it is kept, with a warning for the view to show."""
+        self.diagnosis_code_warning = None
+        if field.data and field.data.strip():
+            from icd10 import display_code, get_catalog, normalize_code, well_formed
+            entry = get_catalog().lookup(field.data)
+            if entry:
+                field.data = entry['code']
+            elif well_formed(field.data):
+                field.data = display_code(normalize_code(field.data))
+                self.diagnosis_code_warning = f'{field.data} is not in the ICD-10 catalog; please check the code.'
+            else:
+                raise ValidationError('Not a valid ICD-10 code')
+
     def get_medicines_json(self):
-        """Convert medicine fields to JSON format for storage"""
+        """Collect the non-empty medicine rows as a list of dicts"""
         medicines = []
-        for i in range(1, 4):  # medicine_1, medicine_2, medicine_3
-            name = getattr(self, f'medicine_{i}_name').data
+        for entry in self.medicines.entries:
+            name = entry.form.name.data
             if name and name.strip():
-                medicine = {
+                medicines.append({
                     'name': name.strip(),
-                    'dosage': getattr(self, f'medicine_{i}_dosage').data or '',
-                    'frequency': getattr(self, f'medicine_{i}_frequency').data or '',
-                    'duration': getattr(self, f'medicine_{i}_duration').data or ''
-                }
-                medicines.append(medicine)
+                    'code': (entry.form.code.data or '').strip(),
+                    'dosage': entry.form.dosage.data or '',
+                    'frequency': entry.form.frequency.data or '',
+                    'duration': entry.form.duration.data or ''
+                })
         return medicines
 
-    def populate_medicine_fields(self, medicines_json):
-        """Populate medicine fields from JSON data"""
-        if medicines_json:
-            medicines = medicines_json if isinstance(medicines_json, list) else []
-            for i, medicine in enumerate(medicines[:3], 1):  # Only handle first 3 medicines
-                getattr(self, f'medicine_{i}_name').data = medicine.get('name', '')
-                getattr(self, f'medicine_{i}_dosage').data = medicine.get('dosage', '')
-                getattr(self, f'medicine_{i}_frequency').data = medicine.get('frequency', '')
-                getattr(self, f'medicine_{i}_duration').data = medicine.get('duration', '')
+    def populate_medicine_fields(self, medicines):
+        """Populate medicine rows from EncounterMedicine rows or legacy JSON dicts"""
+        while self.medicines.entries:
+            self.medicines.pop_entry()
+        for medicine in medicines or []:
+            if isinstance(medicine, dict):
+                data = {
+                    'name': medicine.get('name', ''),
+                    'code': medicine.get('code', ''),
+                    'dosage': medicine.get('dosage', ''),
+                    'frequency': medicine.get('frequency', ''),
+                    'duration': medicine.get('duration', '')
+                }
+            else:
+                data = {
+                    'name': medicine.drug_name,
+                    'code': medicine.drug_code or '',
+                    'dosage': medicine.dosage or '',
+                    'frequency': medicine.frequency or '',
+                    'duration': medicine.duration or ''
+                }
+            self.medicines.append_entry(data)
+        if not self.medicines.entries:
+            self.medicines.append_entry()
 
 
 class PatientSearchForm(FlaskForm):
@@ -0,0 +1,202 @@
+"""Local ICD-10 code catalog backed by a memory-mapped sorted index.
+
+The bundled ``data/icd10_codes.tsv`` is compiled once into a compact binary
+index (fixed-width records sorted by code, plus a sorted description-word
+table) which is memory-mapped and searched with binary search. Lookups never
+touch the database and every worker process shares the same page cache.
+"""
+import bisect
+import mmap
+import os
+import re
+import struct
+import threading
+
+from flask import current_app
+
+_MAGIC = b"ICD10IX1"
+_HEADER = struct.Struct("<8sIIIII")  # magic, codes, words, codes_at, words_at, blob_at
+_CODE_RECORD = struct.Struct("<8sIH")  # normalized code, description offset, description length
+_WORD_RECORD = struct.Struct("<16sI")  # description word, code record index
+_CODE_KEY_LEN = 8
+_WORD_KEY_LEN = 16
+
+_CODE_RE = re.compile(r"^[A-Z][0-9][0-9A-Z]{0,5}$")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {"and", "or", "of", "the", "in", "to", "by", "due", "not", "other", "with", "without"}
+
+
+def normalize_code(code):
+    """Upper-case a code and drop dots/spaces, e.g. ' j45.9 ' -> 'J459'"""
+    return re.sub(r"[\s.]", "", code or "").upper()
+
+
+def well_formed(code):
+    """Whether a code has ICD-10 shape (letter, digit, up to 5 more), catalogued or not"""
+    return bool(_CODE_RE.match(normalize_code(code)))
+
+
+def display_code(key):
+    """Insert the conventional dot after the category, e.g. 'J459' -> 'J45.9'"""
+    return key if len(key) <= 3 else f"{key[:3]}.{key[3:]}"
+
+
+def _words(text):
+    return [w for w in _WORD_RE.findall(text.lower()) if (len(w) > 1 or w.isdigit()) and w not in _STOPWORDS]
+
+
+def build_index(tsv_path, index_path):
+    """Compile the TSV catalog into the binary index file"""
+    entries = {}
+    with open(tsv_path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if not line or line.startswith("#") or "\t" not in line:
+                continue
+            code, description = line.split("\t", 1)
+            key = normalize_code(code)
+            if _CODE_RE.match(key):
+                entries[key] = description.strip()
+
+    codes = sorted(entries)
+    blob = bytearray()
+    code_records = bytearray()
+    words = []
+    for index, key in enumerate(codes):
+        encoded = entries[key].encode("utf-8")[:0xFFFF]
+        code_records += _CODE_RECORD.pack(key.encode("ascii"), len(blob), len(encoded))
+        blob += encoded
+        for word in set(_words(entries[key])):
+            words.append((word.encode("ascii", "ignore")[:_WORD_KEY_LEN], index))
+    words.sort()
+    word_records = b"".join(_WORD_RECORD.pack(word, index) for word, index in words)
+
+    codes_at = _HEADER.size
+    words_at = codes_at + len(code_records)
+    blob_at = words_at + len(word_records)
+
+    os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, len(codes), len(words), codes_at, words_at, blob_at))
+        f.write(code_records)
+        f.write(word_records)
+        f.write(blob)
+    os.replace(tmp_path, index_path)
+
+
+class _KeyView:
+    """Read-only sequence of fixed-width keys inside the mmap, for bisect"""
+
+    def __init__(self, buf, offset, record_size, key_len, count):
+        self.buf = buf
+        self.offset = offset
+        self.record_size = record_size
+        self.key_len = key_len
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        start = self.offset + i * self.record_size
+        return self.buf[start:start + self.key_len]
+
+
+class ICD10Catalog:
+    def __init__(self, index_path):
+        with open(index_path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n_codes, n_words, codes_at, words_at, blob_at = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"{index_path} is not an ICD-10 index")
+        self._codes_at = codes_at
+        self._words_at = words_at
+        self._blob_at = blob_at
+        self._codes = _KeyView(self._mm, codes_at, _CODE_RECORD.size, _CODE_KEY_LEN, n_codes)
+        self._words = _KeyView(self._mm, words_at, _WORD_RECORD.size, _WORD_KEY_LEN, n_words)
+
+    def __len__(self):
+        return len(self._codes)
+
+    def _entry(self, index):
+        key, offset, length = _CODE_RECORD.unpack_from(self._mm, self._codes_at + index * _CODE_RECORD.size)
+        start = self._blob_at + offset
+        return {
+            "code": display_code(key.rstrip(b"\0").decode("ascii")),
+            "description": self._mm[start:start + length].decode("utf-8"),
+        }
+
+    def _code_range(self, prefix):
+        lo = bisect.bisect_left(self._codes, prefix)
+        hi = bisect.bisect_left(self._codes, prefix + b"\xff", lo)
+        return lo, hi
+
+    def _word_range(self, prefix):
+        prefix = prefix[:_WORD_KEY_LEN]
+        lo = bisect.bisect_left(self._words, prefix)
+        hi = bisect.bisect_left(self._words, prefix + b"\xff", lo)
+        return lo, hi
+
+    def _word_code_indexes(self, lo, hi):
+        return {
+            _WORD_RECORD.unpack_from(self._mm, self._words_at + i * _WORD_RECORD.size)[1]
+            for i in range(lo, hi)
+        }
+
+    def lookup(self, code):
+        """Return the entry for an exact code, or None"""
+        key = normalize_code(code)
+        if not _CODE_RE.match(key):
+            return None
+        key = key.encode("ascii")
+        index = bisect.bisect_left(self._codes, key)
+        if index < len(self._codes) and self._codes[index].rstrip(b"\0") == key:
+            return self._entry(index)
+        return None
+
+    def search(self, query, limit=10):
+        """Autocomplete by code prefix and/or description word prefixes"""
+        indexes = []
+
+        key = normalize_code(query)
+        if _CODE_RE.match(key):
+            lo, hi = self._code_range(key.encode("ascii"))
+            indexes.extend(range(lo, min(hi, lo + limit)))
+
+        words = [w.encode("ascii", "ignore") for w in _words(query)]
+        if words and len(indexes) < limit:
+            # Intersect starting from the narrowest word range
+            ranges = sorted((self._word_range(w) for w in words), key=lambda r: r[1] - r[0])
+            matches = self._word_code_indexes(*ranges[0])
+            for lo, hi in ranges[1:]:
+                if not matches:
+                    break
+                matches &= self._word_code_indexes(lo, hi)
+            seen = set(indexes)
+            indexes.extend(i for i in sorted(matches) if i not in seen)
+
+        return [self._entry(i) for i in indexes[:limit]]
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def load_catalog(tsv_path, index_path):
+    """Open the catalog, rebuilding the index when the TSV is newer"""
+    with _catalogs_lock:
+        catalog = _catalogs.get(index_path)
+        if catalog is None:
+            if not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(tsv_path):
+                build_index(tsv_path, index_path)
+            catalog = _catalogs[index_path] = ICD10Catalog(index_path)
+        return catalog
+
+
+def get_catalog():
+    """Catalog for the current app, opened once per process"""
+    return load_catalog(
+        current_app.config["ICD10_CATALOG_PATH"],
+        os.path.join(current_app.instance_path, "icd10_codes.idx"),
+    )
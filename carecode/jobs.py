@@ -0,0 +1,297 @@
+"""Database-backed background jobs, with no broker.
+
+Slow work is registered as a task and enqueued as a row in ``jobs`` inside
+the caller's transaction, so a job exists exactly when the write that
+asked for it commits. Workers (a thread pool started with the web app, or
+``flask jobs-worker``) poll for due jobs by priority. A job is claimed with
+a guarded ``UPDATE ... WHERE status = 'queued'``, so any number of workers,
+in any number of processes, can share the table.
+
+Failed attempts are retried with exponential backoff until ``max_attempts``.
+While a job runs, a heartbeat thread refreshes its ``locked_at`` every
+HEARTBEAT_INTERVAL. A job whose worker died stops getting heartbeats and is
+requeued once its lock is older than LOCK_TIMEOUT. The lost run counts as
+an attempt, so a job that keeps killing its worker fails after
+``max_attempts``. An idempotency key makes repeated enqueues return the
+existing job.
+"""
+import logging
+import os
+import random
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+
+from models import db, Job
+
+POLL_INTERVAL = 2.0
+BACKOFF_BASE = 10  # seconds before the first retry, doubled each attempt
+BACKOFF_MAX = 3600
+LOCK_TIMEOUT = timedelta(minutes=30)
+HEARTBEAT_INTERVAL = LOCK_TIMEOUT / 6
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+
+
+class Task:
+    def __init__(self, name, func, max_attempts, priority, on_failure):
+        self.name = name
+        self.func = func
+        self.max_attempts = max_attempts
+        self.priority = priority
+        self.on_failure = on_failure
+
+
+def task(name, max_attempts=3, priority=0, on_failure=None):
+    """Register a function as a job task.
+
+    The function is called with the job payload as keyword arguments,
+    inside an app context, and its return value (JSON-serializable) is
+    stored as the job result. `on_failure(payload, error)` runs once the
+    last attempt has failed.
+    """
+    def register(func):
+        TASKS[name] = Task(name, func, max_attempts, priority, on_failure)
+        return func
+    return register
+
+
+def enqueue(name, payload=None, priority=None, idempotency_key=None, delay=0, hospital_id=None,
+            requested_by_type=None, requested_by_id=None):
+    """Add a job to the session (the caller commits); returns the Job.
+
+    With an idempotency key, an already enqueued job with the same key is
+    returned instead of a new one; a concurrent enqueue of the same key
+    fails the caller's commit on the unique constraint.
+    """
+    registered = TASKS[name]
+    if idempotency_key:
+        existing = Job.query.filter_by(idempotency_key=idempotency_key).first()
+        if existing:
+            return existing
+    job = Job(
+        name=name,
+        payload=payload or {},
+        priority=registered.priority if priority is None else priority,
+        idempotency_key=idempotency_key,
+        max_attempts=registered.max_attempts,
+        run_after=datetime.utcnow() + timedelta(seconds=delay),
+        hospital_id=hospital_id,
+        requested_by_type=requested_by_type,
+        requested_by_id=requested_by_id,
+    )
+    db.session.add(job)
+    return job
+
+
+def backoff(attempts):
+    """Seconds to wait after the given number of failed attempts, with jitter"""
+    delay = min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def requeue_stale(timeout=LOCK_TIMEOUT):
+    """Requeue running jobs whose worker stopped sending heartbeats, or fail
+    those that have used up their attempts; returns how many jobs were released"""
+    now = datetime.utcnow()
+    stale = (Job.status == "running", Job.locked_at < now - timeout)
+
+    error = "Worker lost on the last attempt"
+    failed = []
+    exhausted = db.session.execute(
+        select(Job.id, Job.name, Job.payload).where(*stale, Job.attempts >= Job.max_attempts)
+    ).all()
+    for job_id, name, payload in exhausted:
+        # Guarded, in case a heartbeat arrived since the select
+        if db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, *stale)
+            .values(status="failed", locked_by=None, locked_at=None, finished_at=now, error=error)
+        ).rowcount:
+            failed.append((name, dict(payload or {})))
+    requeued = db.session.execute(
+        update(Job)
+        .where(*stale, Job.attempts < Job.max_attempts)
+        .values(status="queued", locked_by=None, locked_at=None, error="Worker lost; requeued")
+    ).rowcount
+    db.session.commit()
+
+    for name, payload in failed:
+        registered = TASKS.get(name)
+        if registered is not None and registered.on_failure:
+            registered.on_failure(payload, error)
+    return requeued + len(failed)
+
+
+def claim(worker_id, names=None):
+    """Atomically take the next due job, or None"""
+    now = datetime.utcnow()
+    statement = (
+        select(Job.id)
+        .where(Job.status == "queued", Job.run_after <= now)
+        .order_by(Job.priority.desc(), Job.run_after, Job.id)
+        .limit(10)
+    )
+    if names:
+        statement = statement.where(Job.name.in_(names))
+    for job_id in db.session.scalars(statement).all():
+        # Another worker may have taken it since the select
+        claimed = db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == "queued")
+            .values(status="running", locked_by=worker_id, locked_at=now, started_at=now, attempts=Job.attempts + 1)
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return db.session.get(Job, job_id)
+    return None
+
+
+class Heartbeat:
+    """Thread refreshing a running job's locked_at, so it is not taken for lost"""
+
+    def __init__(self, job_id, worker_id, interval=HEARTBEAT_INTERVAL):
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.interval = interval
+        self.engine = db.engine
+        self.stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, name=f"job-heartbeat-{job_id}", daemon=True)
+
+    def _beat(self):
+        while not self.stop.wait(self.interval.total_seconds()):
+            try:
+                # Own connection: the task may hold the session in a long transaction
+                with self.engine.begin() as connection:
+                    connection.execute(
+                        update(Job)
+                        .where(Job.id == self.job_id, Job.status == "running", Job.locked_by == self.worker_id)
+                        .values(locked_at=datetime.utcnow())
+                    )
+            except Exception:
+                logger.exception(f"Heartbeat for job {self.job_id} failed")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop.set()
+        self._thread.join()
+
+
+def run_job(job, heartbeat_interval=HEARTBEAT_INTERVAL):
+    """Run a claimed job and record its outcome"""
+    job_id, name, payload, attempts = job.id, job.name, dict(job.payload or {}), job.attempts
+    registered = TASKS.get(name)
+    try:
+        if registered is None:
+            raise LookupError(f"No task registered as {name!r}")
+        with Heartbeat(job_id, job.locked_by, heartbeat_interval):
+            result = registered.func(**payload)
+    except Exception as e:
+        db.session.rollback()
+        logger.exception(f"Job {job_id} ({name}) attempt {attempts} failed")
+        job = db.session.get(Job, job_id)
+        job.error = f"{type(e).__name__}: {e}"
+        job.locked_by = job.locked_at = None
+        final = registered is None or attempts >= job.max_attempts
+        if final:
+            job.status = "failed"
+            job.finished_at = datetime.utcnow()
+        else:
+            job.status = "queued"
+            job.run_after = datetime.utcnow() + timedelta(seconds=backoff(attempts))
+        db.session.commit()
+        if final and registered is not None and registered.on_failure:
+            registered.on_failure(payload, job.error)
+        return False
+
+    job = db.session.get(Job, job_id)
+    job.status = "succeeded"
+    job.result = result
+    job.error = None
+    job.locked_by = job.locked_at = None
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    return True
+
+
+def work(app, stop, worker_id, names=None, poll_interval=POLL_INTERVAL):
+    """Worker loop: run due jobs until `stop` (a threading.Event) is set"""
+    while not stop.is_set():
+        with app.app_context():
+            try:
+                job = claim(worker_id, names)
+                if job is not None:
+                    run_job(job)
+                    continue
+            except Exception:
+                logger.exception(f"Job worker {worker_id} failed to claim or record a job")
+            finally:
+                db.session.remove()
+        stop.wait(poll_interval)
+
+
+class WorkerPool:
+    """Worker threads plus a sweeper that requeues jobs of dead workers"""
+
+    def __init__(self, app, threads=2, names=None, poll_interval=POLL_INTERVAL):
+        self.app = app
+        self.threads = threads
+        self.names = names
+        self.poll_interval = poll_interval
+        self.stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+        for i in range(self.threads):
+            thread = threading.Thread(
+                target=work, args=(self.app, self.stop, f"{prefix}:{i}", self.names, self.poll_interval),
+                name=f"job-worker-{i}", daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+        sweeper = threading.Thread(target=self._sweep, name="job-sweeper", daemon=True)
+        sweeper.start()
+        self._threads.append(sweeper)
+        return self
+
+    def _sweep(self):
+        while not self.stop.wait(LOCK_TIMEOUT.total_seconds() / 4):
+            with self.app.app_context():
+                try:
+                    released = requeue_stale()
+                    if released:
+                        logger.warning(f"Requeued or failed {released} jobs from lost workers")
+                except Exception:
+                    logger.exception("Requeueing stale jobs failed")
+                finally:
+                    db.session.remove()
+
+    def shutdown(self, timeout=None):
+        self.stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+
+def init_jobs(app):
+    """Start JOB_WORKERS worker threads with the first request (0 disables)"""
+    state = {"pool": None}
+    lock = threading.Lock()
+
+    @app.before_request
+    def _start_job_workers():
+        if state["pool"] is None and app.config.get("JOB_WORKERS", 2) > 0:
+            with lock:
+                if state["pool"] is None:
+                    state["pool"] = WorkerPool(app, app.config.get("JOB_WORKERS", 2)).start()
+
+    app.extensions["jobs"] = state
+    return state
+
@@ -0,0 +1,220 @@
+"""Server-sent events for live dashboards.
+
+Committed encounters, patients and doctors are turned into events by a
+model_events subscriber. Events go to an in-process broker on per-hospital
+(``hospital:<id>``) and per-doctor (``doctor:<id>``) channels:
+
+* ``encounter``: a new encounter for the recent encounters list
+* ``counters``: deltas for the dashboard counters, e.g. {"total_patients": 1}
+
+Each connected client has a bounded buffer. A client too slow to keep up
+loses its oldest events and is sent ``resync``, telling the page to reload.
+An idle client costs one small subscriber object. Under the ASGI server
+(asgi.py) it also costs one suspended coroutine. Under a WSGI server it
+would hold a worker thread for as long as the tab stays open, so the Flask
+route only streams when LIVE_EVENTS is set. asgi.py sets it. Otherwise
+the dashboard shows the counters as rendered. Events exist only in the
+process that committed the write, so live dashboards need the full app
+mounted in asgi.py (or LIVE_EVENTS=1 on a single threaded Flask process,
+for development).
+"""
+import asyncio
+import itertools
+import json
+import logging
+import threading
+from collections import Counter, defaultdict, deque
+from datetime import date
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from model_events import subscribe
+from models import db, Doctor, MedicalEncounter, Patient
+
+BUFFER_SIZE = 100
+KEEPALIVE_SECONDS = 15
+
+logger = logging.getLogger(__name__)
+
+
+class Subscriber:
+    __slots__ = ("channels", "buffer", "overflowed", "notify")
+
+    def __init__(self, channels, notify):
+        self.channels = channels
+        self.buffer = deque(maxlen=BUFFER_SIZE)
+        self.overflowed = False
+        self.notify = notify
+
+
+class Broker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._channels = defaultdict(set)
+        self._ids = itertools.count(1)
+
+    def subscribe(self, channels, notify):
+        """Register a client; notify() is called (from any thread) when events arrive"""
+        subscriber = Subscriber(tuple(channels), notify)
+        with self._lock:
+            for channel in subscriber.channels:
+                self._channels[channel].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            for channel in subscriber.channels:
+                members = self._channels.get(channel)
+                if members is not None:
+                    members.discard(subscriber)
+                    if not members:
+                        del self._channels[channel]
+
+    def publish(self, channel, kind, data):
+        with self._lock:
+            members = list(self._channels.get(channel, ()))
+            event = (next(self._ids), kind, data)
+            for subscriber in members:
+                if len(subscriber.buffer) == BUFFER_SIZE:
+                    subscriber.overflowed = True
+                subscriber.buffer.append(event)
+        for subscriber in members:
+            try:
+                subscriber.notify()
+            except RuntimeError:
+                pass  # the client's event loop has already closed
+
+    def drain(self, subscriber):
+        """Buffered events of a client and whether any were dropped"""
+        with self._lock:
+            events = list(subscriber.buffer)
+            subscriber.buffer.clear()
+            overflowed, subscriber.overflowed = subscriber.overflowed, False
+        return events, overflowed
+
+    def connections(self):
+        with self._lock:
+            return len({s for members in self._channels.values() for s in members})
+
+
+def format_event(event_id, kind, data):
+    return f"id: {event_id}\nevent: {kind}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+def _messages(broker, subscriber):
+    events, overflowed = broker.drain(subscriber)
+    if overflowed:
+        yield "event: resync\ndata: {}\n\n"
+    for event in events:
+        yield format_event(*event)
+    if not events and not overflowed:
+        yield ": keepalive\n\n"
+
+
+def stream(broker, channels, keepalive=KEEPALIVE_SECONDS):
+    """Event stream for a WSGI response; holds its thread while connected"""
+    wake = threading.Event()
+    subscriber = broker.subscribe(channels, wake.set)
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            wake.wait(keepalive)
+            wake.clear()
+            yield from _messages(broker, subscriber)
+    finally:
+        broker.unsubscribe(subscriber)
+
+
+async def async_stream(broker, channels, keepalive=KEEPALIVE_SECONDS):
+    """Event stream for an ASGI response; idle clients only hold a coroutine"""
+    loop = asyncio.get_running_loop()
+    wake = asyncio.Event()
+    subscriber = broker.subscribe(channels, lambda: loop.call_soon_threadsafe(wake.set))
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                await asyncio.wait_for(wake.wait(), keepalive)
+            except asyncio.TimeoutError:
+                pass
+            wake.clear()
+            for message in _messages(broker, subscriber):
+                yield message
+    finally:
+        broker.unsubscribe(subscriber)
+
+
+def dashboard_channels(session):
+    """Channels the signed-in user's dashboard listens to"""
+    if session.get("user_type") == "hospital_admin" and session.get("hospital_id"):
+        return [f"hospital:{session['hospital_id']}"]
+    if session.get("user_type") == "doctor":
+        return [f"doctor:{session['user_id']}"]
+    return []
+
+
+def _publish_encounters(broker, encounter_ids):
+    today = date.today()
+    with Session(db.engine) as session:
+        rows = session.execute(
+            select(MedicalEncounter, Patient.full_name, Doctor.full_name)
+            .join(Patient, Patient.id == MedicalEncounter.patient_id)
+            .outerjoin(Doctor, Doctor.id == MedicalEncounter.doctor_id)
+            .where(MedicalEncounter.id.in_(encounter_ids))
+            .order_by(MedicalEncounter.id)
+        ).all()
+        for encounter, patient_name, doctor_name in rows:
+            data = {
+                "id": encounter.id,
+                "patient_id": encounter.patient_id,
+                "patient": patient_name,
+                "doctor": doctor_name or "Unknown",
+                "date": encounter.treatment_date.isoformat(),
+                "diagnosis": encounter.diagnosis_text,
+            }
+            broker.publish(f"hospital:{encounter.hospital_id}", "encounter", data)
+            broker.publish(f"doctor:{encounter.doctor_id}", "encounter", data)
+
+            deltas = {}
+            if encounter.treatment_date == today:
+                deltas["today_encounters"] = 1
+            earlier = session.scalar(
+                select(func.count()).select_from(MedicalEncounter).where(
+                    MedicalEncounter.doctor_id == encounter.doctor_id,
+                    MedicalEncounter.patient_id == encounter.patient_id,
+                    MedicalEncounter.id < encounter.id,
+                )
+            )
+            if not earlier:
+                deltas["total_patients_treated"] = 1
+            if deltas:
+                broker.publish(f"doctor:{encounter.doctor_id}", "counters", deltas)
+
+
+def init_live_events(app):
+    """Create the app's broker and publish dashboard events after commits"""
+    broker = Broker()
+    app.extensions["live_events"] = broker
+
+    def on_encounters(events):
+        inserted = [values["id"] for kind, values in events if kind == "insert"]
+        if inserted:
+            _publish_encounters(broker, inserted)
+
+    def publish_counts(events, counter):
+        # One delta per hospital, however many rows a commit (or bulk import) added
+        added = Counter(values["hospital_id"] for kind, values in events if kind == "insert")
+        for hospital_id, count in added.items():
+            broker.publish(f"hospital:{hospital_id}", "counters", {counter: count})
+
+    def on_patients(events):
+        publish_counts(events, "total_patients")
+
+    def on_doctors(events):
+        publish_counts(events, "total_doctors")
+
+    subscribe(MedicalEncounter, on_encounters, capture=lambda e: {"id": e.id})
+    subscribe(Patient, on_patients, capture=lambda p: {"hospital_id": p.created_by_hospital})
+    subscribe(Doctor, on_doctors, capture=lambda d: {"hospital_id": d.hospital_id})
+    return broker
@@ -0,0 +1,78 @@
+"""Post-commit change notifications for in-process read models.
+
+Subscribers register interest in model classes and receive the rows that were
+inserted, updated or deleted once the transaction that wrote them commits.
+Values are captured at flush time (while SQL may still be issued) and
+discarded on rollback, so handlers never see uncommitted data. Bulk
+``db.insert()``/``update()`` statements bypass the ORM, so code using them
+reports the rows it wrote with ``record_bulk()``.
+"""
+import logging
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+_PENDING_KEY = "carecode.model_events"
+_subscribers = []
+
+
+def column_values(obj):
+    """Default capture: a dict of the object's mapped column attributes"""
+    return {attr.key: getattr(obj, attr.key) for attr in inspect(obj).mapper.column_attrs}
+
+
+def subscribe(models, handler, capture=column_values):
+    """Call handler([(kind, values), ...]) after each commit touching models.
+
+    kind is "insert", "update" or "delete"; values is capture(obj).
+    """
+    if not isinstance(models, tuple):
+        models = tuple(models) if isinstance(models, list) else (models,)
+    _subscribers.append((models, handler, capture))
+
+
+def _add(pending, kind, obj):
+    for models, handler, capture in _subscribers:
+        if isinstance(obj, models):
+            pending.setdefault(handler, []).append((kind, capture(obj)))
+
+
+def record_bulk(session, kind, objects):
+    """Report rows written by a bulk statement in this session's transaction.
+
+    objects are the written rows loaded as model instances; subscribers get
+    them with the next commit, exactly as if the ORM had flushed them.
+    """
+    pending = session.info.setdefault(_PENDING_KEY, {})
+    for obj in objects:
+        _add(pending, kind, obj)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect(session, flush_context):
+    if not _subscribers:
+        return
+    pending = session.info.setdefault(_PENDING_KEY, {})
+    for kind, objects in (("insert", session.new), ("update", session.dirty), ("delete", session.deleted)):
+        for obj in objects:
+            if kind == "update" and not session.is_modified(obj, include_collections=False):
+                continue
+            _add(pending, kind, obj)
+
+
+@event.listens_for(Session, "after_commit")
+def _dispatch(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    for handler, events in (pending or {}).items():
+        try:
+            handler(events)
+        except Exception:
+            # A broken read model must never fail the write that fed it
+            logger.exception(f"Model event handler {handler!r} failed")
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session):
+    session.info.pop(_PENDING_KEY, None)
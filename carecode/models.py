@@ -72,12 +72,16 @@ class Patient(db.Model):
     created_by_hospital = db.Column(db.Integer, db.ForeignKey('hospitals.id'), nullable=False)
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     # QR Code fields (stored directly in Patient table)
     qr_token = db.Column(db.String(36), unique=True, nullable=True)
     qr_code_image = db.Column(db.Text, nullable=True)  # Store base64 QR image
 
+    __table_args__ = (
+        db.Index('ft_patients_full_name', 'full_name', mysql_prefix='FULLTEXT'),
+    )
+
     # Relationships
     hospital = db.relationship(
         'Hospital',
@@ -150,7 +154,7 @@ class PatientIdentifier(db.Model):
     id_type = db.Column(db.String(50), nullable=False)  # matches database column name
     id_value = db.Column(db.String(100), nullable=False)  # matches database column name
     issued_country = db.Column(db.String(100), default='Sri Lanka')
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
     # No explicit relationship definition needed here since it's defined in Patient model
 
@@ -172,12 +176,39 @@ class Doctor(db.Model):
     specialties = db.Column(db.JSON)  # matches database (plural)
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+
+    __table_args__ = (
+        db.Index('ft_doctors_full_name', 'full_name', mysql_prefix='FULLTEXT'),
+    )
 
     # Relationships
     encounters = db.relationship('MedicalEncounter', backref='doctor', lazy=True)
 
 
+# ========================
+# Login Credentials
+# ========================
+class UserCredential(db.Model):
+    __tablename__ = 'user_credentials'
+
+    # One row per hospital admin, doctor and ministry, maintained by credentials.py
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    login_name = db.Column(db.String(100), nullable=False)  # username, license number or ministry admin username
+    user_type = db.Column(db.String(20), nullable=False)  # hospital_admin, doctor, ministry
+    user_id = db.Column(db.Integer, nullable=False)
+    password_hash = db.Column(db.String(255), nullable=False)
+    is_active = db.Column(db.Boolean, nullable=False, default=True)
+    hospital_id = db.Column(db.Integer, nullable=True)
+    display_name = db.Column(db.String(255), nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('login_name', 'user_type', name='uq_user_credentials_login'),
+        db.UniqueConstraint('user_type', 'user_id', name='uq_user_credentials_user'),
+    )
+
+
 # ========================
 # Medical Encounters
 # ========================
@@ -191,13 +222,97 @@ class MedicalEncounter(db.Model):
     hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'), nullable=False)
     diagnosis_text = db.Column(db.Text)  # matches database column name
     diagnosis_code = db.Column(db.String(20), nullable=True)
-    medicines = db.Column(db.JSON)
+    medicines = db.Column(db.JSON)  # legacy 3-slot list, superseded by encounter_medicines
     suggestions = db.Column(db.Text)
     treatment_date = db.Column(db.Date, nullable=False)  # matches database column name
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+
+    __table_args__ = (
+        # Keyset paging for medical_records() within each access scope
+        db.Index('ix_medical_encounters_hospital_date', 'hospital_id', 'treatment_date', 'id'),
+        db.Index('ix_medical_encounters_doctor_date', 'doctor_id', 'treatment_date', 'id'),
+        db.Index('ix_medical_encounters_patient_date', 'patient_id', 'treatment_date', 'id'),
+        db.Index('ft_medical_encounters_text', 'diagnosis_text', 'suggestions', 'diagnosis_code',
+                 mysql_prefix='FULLTEXT'),
+    )
+
+    prescriptions = db.relationship(
+        'EncounterMedicine',
+        backref='encounter',
+        lazy=True,
+        cascade='all, delete-orphan',
+        order_by='EncounterMedicine.position'
+    )
+
+    def set_prescriptions(self, medicines):
+        """Replace this encounter's prescriptions from a list of medicine dicts.
+
+        The legacy medicines JSON is cleared (SQL NULL), so neither
+        medicine_list() nor the backfill bring back medicines removed here.
+        """
+        if self.medicines is not None:
+            self.medicines = db.null()
+        self.prescriptions = [
+            EncounterMedicine(
+                position=position,
+                patient_id=self.patient_id,
+                hospital_id=self.hospital_id,
+                drug_name=medicine['name'],
+                drug_code=medicine.get('code') or None,
+                dosage=medicine.get('dosage') or None,
+                frequency=medicine.get('frequency') or None,
+                duration=medicine.get('duration') or None,
+                prescribed_on=self.treatment_date,
+            )
+            for position, medicine in enumerate(medicines)
+        ]
+
+    def medicine_list(self):
+        """Prescribed medicines as dicts, from encounter_medicines or, for
+        encounters not yet backfilled, the legacy medicines JSON"""
+        if self.prescriptions:
+            return [
+                {
+                    'name': m.drug_name,
+                    'code': m.drug_code,
+                    'dosage': m.dosage,
+                    'frequency': m.frequency,
+                    'duration': m.duration,
+                }
+                for m in self.prescriptions
+            ]
+        return [
+            {k: m.get(k) for k in ('name', 'code', 'dosage', 'frequency', 'duration')}
+            for m in (self.medicines or []) if isinstance(m, dict) and m.get('name')
+        ]
+
+
+# ========================
+# Encounter Medicines (prescriptions)
+# ========================
+class EncounterMedicine(db.Model):
+    __tablename__ = 'encounter_medicines'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    encounter_id = db.Column(db.Integer, db.ForeignKey('medical_encounters.id'), nullable=False, index=True)
+    position = db.Column(db.SmallInteger, nullable=False, default=0)
+    # Denormalized from the encounter so utilization queries never touch medical_encounters
+    patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=False)
+    hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'), nullable=False)
+    prescribed_on = db.Column(db.Date, nullable=False)
+    drug_name = db.Column(db.String(200), nullable=False)
+    drug_code = db.Column(db.String(50), nullable=True)
+    dosage = db.Column(db.String(100), nullable=True)
+    frequency = db.Column(db.String(100), nullable=True)
+    duration = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-    # No explicit relationship definitions needed here since they're defined in the parent models
+    __table_args__ = (
+        db.Index('ix_encounter_medicines_drug_date', 'drug_name', 'prescribed_on'),
+        db.Index('ix_encounter_medicines_code_date', 'drug_code', 'prescribed_on'),
+        db.Index('ix_encounter_medicines_hospital_drug_date', 'hospital_id', 'drug_name', 'prescribed_on'),
+    )
 
 
 
@@ -223,6 +338,22 @@ class AuditLog(db.Model):
     hospital = db.relationship('Hospital', backref=db.backref('audit_logs', lazy=True))
 
 
+class QRScanReceipt(db.Model):
+    __tablename__ = 'qr_scan_receipts'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id'), nullable=False)
+    scan_id = db.Column(db.String(64), nullable=False)  # generated by the scanning device
+    patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=True)
+    status = db.Column(db.String(20), nullable=False)  # valid, invalid, malformed
+    scanned_at = db.Column(db.DateTime, nullable=True)  # device clock, when reported
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('doctor_id', 'scan_id', name='uq_qr_scan_receipts_doctor_scan'),
+    )
+
+
 # ========================
 # Patient ↔ Hospital Relationship
 # ========================
@@ -236,4 +367,228 @@ class PatientHospital(db.Model):
     last_seen = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     notes = db.Column(db.Text, nullable=True)
 
-    # No explicit relationship definitions needed here since they're defined in Patient model
\ No newline at end of file
+    # No explicit relationship definitions needed here since they're defined in Patient model
+
+
+# ========================
+# Patient Summary Cards
+# ========================
+class PatientSummary(db.Model):
+    __tablename__ = 'patient_summaries'
+
+    patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), primary_key=True)
+    qr_token = db.Column(db.String(36), unique=True, nullable=True)  # copy of Patient.qr_token for scans
+    is_active = db.Column(db.Boolean, nullable=False, default=True)
+    hospital_ids = db.Column(db.JSON, nullable=False)  # registering + linked hospitals, for access checks
+    document = db.Column(db.Text, nullable=False)  # serialized JSON, served as-is
+    etag = db.Column(db.String(40), nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+# ========================
+# Master Patient Index
+# ========================
+class PatientBlockingKey(db.Model):
+    __tablename__ = 'patient_blocking_keys'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=False, index=True)
+    key = db.Column(db.String(120), nullable=False)  # e.g. "nic:199012345678", "dob_name:1990-01-01:NML"
+
+    __table_args__ = (
+        db.UniqueConstraint('patient_id', 'key', name='uq_patient_blocking_keys_patient_key'),
+        db.Index('ix_patient_blocking_keys_key', 'key', 'patient_id'),
+    )
+
+
+class PatientNameKey(db.Model):
+    __tablename__ = 'patient_name_keys'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=False, index=True)
+    key = db.Column(db.String(12), nullable=False)  # phonetic skeleton of one name word, e.g. "PR" for "Perera"
+
+    __table_args__ = (
+        db.Index('ix_patient_name_keys_key', 'key', 'patient_id'),
+    )
+
+
+class PatientDuplicateCandidate(db.Model):
+    __tablename__ = 'patient_duplicate_candidates'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=False)  # lower id of the pair
+    duplicate_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=False)
+    cluster_id = db.Column(db.Integer, nullable=False, index=True)  # lowest patient id in the cluster
+    score = db.Column(db.Float, nullable=False)
+    reasons = db.Column(db.JSON)  # ["nic", "dob", "name"]
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, confirmed, rejected
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    reviewed_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('patient_id', 'duplicate_id', name='uq_patient_duplicate_candidates_pair'),
+    )
+
+
+# ========================
+# FHIR Bulk Export Jobs
+# ========================
+class ExportJob(db.Model):
+    __tablename__ = 'export_jobs'
+
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'), nullable=False)
+    requested_by_type = db.Column(db.String(50), nullable=True)
+    requested_by_id = db.Column(db.Integer, nullable=True)
+    request_url = db.Column(db.Text, nullable=True)
+    resource_types = db.Column(db.JSON, nullable=False)
+    since = db.Column(db.DateTime, nullable=True)  # FHIR _since, stored as naive UTC
+    status = db.Column(db.String(20), nullable=False, default='accepted')  # accepted, in_progress, completed, failed
+    output = db.Column(db.JSON)  # [{"type": "Patient", "count": 120}, ...]
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    completed_at = db.Column(db.DateTime, nullable=True)
+
+
+# ========================
+# Background Jobs
+# ========================
+class Job(db.Model):
+    __tablename__ = 'jobs'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    name = db.Column(db.String(100), nullable=False)  # registered task name, e.g. "fhir_export"
+    payload = db.Column(db.JSON)  # keyword arguments for the task
+    priority = db.Column(db.Integer, nullable=False, default=0)  # higher runs first
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded, failed
+    idempotency_key = db.Column(db.String(120), unique=True, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # backoff between retries
+    hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'), nullable=True)
+    requested_by_type = db.Column(db.String(50), nullable=True)
+    requested_by_id = db.Column(db.Integer, nullable=True)
+    result = db.Column(db.JSON)
+    error = db.Column(db.Text, nullable=True)
+    locked_by = db.Column(db.String(100), nullable=True)  # worker running the job
+    locked_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_jobs_claim', 'status', 'priority', 'run_after'),
+    )
+
+
+# ========================
+# Change Outbox
+# ========================
+class OutboxEvent(db.Model):
+    __tablename__ = 'outbox_events'
+
+    # The offset consumers track; BIGINT so the log never wraps
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    entity = db.Column(db.String(50), nullable=False)  # table name, e.g. "patients"
+    entity_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)  # insert, update, delete
+    hospital_id = db.Column(db.Integer, nullable=True)  # owning hospital, for filtering
+    tx_id = db.Column(db.String(32), nullable=False)  # events written by one transaction share it
+    changes = db.Column(db.JSON)  # all columns for inserts, changed columns for updates
+    base_updated_at = db.Column(db.DateTime, nullable=True)  # row version the update/delete was made against
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_outbox_events_entity', 'entity', 'entity_id', 'id'),
+        db.Index('ix_outbox_events_created_at', 'created_at'),
+    )
+
+
+class OutboxConsumer(db.Model):
+    __tablename__ = 'outbox_consumers'
+
+    name = db.Column(db.String(100), primary_key=True)
+    position = db.Column(db.BigInteger, nullable=False, default=0)  # last acknowledged event id
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+# ========================
+# Edge Sync
+# ========================
+class EdgeIdMap(db.Model):
+    __tablename__ = 'edge_id_map'
+
+    # Rows created at an edge site get local ids; kept on both sides
+    hospital_id = db.Column(db.Integer, primary_key=True)  # the edge site
+    entity = db.Column(db.String(50), primary_key=True)  # table name
+    edge_id = db.Column(db.Integer, primary_key=True)
+    central_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('hospital_id', 'entity', 'central_id', name='uq_edge_id_map_central'),
+    )
+
+
+class EdgeSyncState(db.Model):
+    __tablename__ = 'edge_sync_state'
+
+    # Edge database only: one row for the hospital this snapshot belongs to
+    hospital_id = db.Column(db.Integer, primary_key=True)
+    central_offset = db.Column(db.BigInteger, nullable=False, default=0)  # last central outbox event applied
+    snapshot_at = db.Column(db.DateTime, nullable=False)
+    last_pull_at = db.Column(db.DateTime, nullable=True)
+    last_push_at = db.Column(db.DateTime, nullable=True)
+
+
+class EdgeConflict(db.Model):
+    __tablename__ = 'edge_conflicts'
+
+    # Edge database only: local changes the central database rejected
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    entity = db.Column(db.String(50), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)  # local id
+    op = db.Column(db.String(10), nullable=False)
+    reason = db.Column(db.String(20), nullable=False)  # conflict, rejected
+    local_row = db.Column(db.JSON)  # what the edge tried to write
+    central_row = db.Column(db.JSON)  # central version, now applied locally
+    detected_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class EdgeSiteToken(db.Model):
+    __tablename__ = 'edge_site_tokens'
+
+    # Central database only: the version of the sync token an edge site holds
+    hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)  # bumped on every issue or revoke
+    issued_at = db.Column(db.DateTime, nullable=True)
+    revoked_at = db.Column(db.DateTime, nullable=True)
+
+
+# ========================
+# Reporting Rollups
+# ========================
+class HospitalRollup(db.Model):
+    __tablename__ = 'hospital_rollups'
+
+    hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'), primary_key=True)
+    period = db.Column(db.String(5), primary_key=True)  # day, week, month
+    period_start = db.Column(db.Date, primary_key=True)
+    patients = db.Column(db.Integer, nullable=False, default=0)  # newly registered
+    doctors = db.Column(db.Integer, nullable=False, default=0)  # newly added
+    encounters = db.Column(db.Integer, nullable=False, default=0)  # by treatment date
+    refreshed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_hospital_rollups_period_start', 'period', 'period_start'),
+    )
+
+
+class RollupWatermark(db.Model):
+    __tablename__ = 'rollup_watermarks'
+
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.DateTime, nullable=False)
@@ -0,0 +1,308 @@
+"""Master patient index: normalization, blocking keys and duplicate detection.
+
+Every patient gets a handful of blocking keys derived from normalized
+identifiers (NIC, passport, ...), phone numbers, email and date of birth
+combined with name tokens, stored in ``patient_blocking_keys``. Candidate
+duplicates for a new registration are the patients sharing at least one key,
+found with a single indexed IN query, and are then scored pairwise. The
+batch ``cluster_patients`` job walks the key index block by block to find
+duplicate groups across a whole ministry.
+"""
+import re
+from difflib import SequenceMatcher
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import selectinload
+
+from models import db, Hospital, Patient, PatientBlockingKey, PatientDuplicateCandidate
+from name_keys import name_words, phonetic_key
+
+CANDIDATE_THRESHOLD = 0.5
+MAX_CANDIDATES = 50
+# Keys shared by more patients than this (a clinic phone, a common name on a
+# common birthday) say little about identity and would make blocks quadratic.
+MAX_BLOCK_SIZE = 50
+BATCH_SIZE = 1000
+
+_NON_ALNUM = re.compile(r"[^0-9A-Z]")
+
+
+def normalize_nic(value):
+    """Sri Lankan NIC in the 12-digit format; old 9-digit+V/X numbers are converted"""
+    value = _NON_ALNUM.sub("", (value or "").upper())
+    if re.fullmatch(r"\d{9}[VX]", value):
+        return f"19{value[:2]}{value[2:5]}0{value[5:8]}{value[8]}"
+    if re.fullmatch(r"\d{12}", value):
+        return value
+    return value or None
+
+
+def normalize_identifier(id_type, value):
+    if id_type == "nic":
+        return normalize_nic(value)
+    return _NON_ALNUM.sub("", (value or "").upper()) or None
+
+
+def normalize_phone(value):
+    """E.164 form, assuming Sri Lanka for local numbers: '077 123-4567' -> '+94771234567'"""
+    digits = re.sub(r"\D", "", value or "")
+    if not digits:
+        return None
+    if digits.startswith("0") and len(digits) == 10:
+        return "+94" + digits[1:]
+    if digits.startswith("94") and len(digits) == 11:
+        return "+" + digits
+    return "+" + digits
+
+
+def patient_attributes(patient):
+    """Normalized matching attributes of a Patient (identifiers must be loadable)"""
+    contact_info = patient.contact_info if isinstance(patient.contact_info, dict) else {}
+    return attributes(
+        full_name=patient.full_name,
+        date_of_birth=patient.date_of_birth,
+        gender=patient.gender,
+        email=patient.email or contact_info.get("email"),
+        phones=[contact_info.get("phone_primary"), contact_info.get("phone_secondary"), patient.guardian_number],
+        identifiers=[(i.id_type, i.id_value) for i in patient.identifiers],
+    )
+
+
+def attributes(full_name, date_of_birth=None, gender=None, email=None, phones=(), identifiers=()):
+    return {
+        "name": name_words(full_name),
+        "dob": date_of_birth,
+        "gender": gender if gender in ("male", "female") else None,
+        "email": email.strip().lower() if email else None,
+        "phones": {p for p in (normalize_phone(v) for v in phones) if p},
+        "identifiers": {
+            (id_type, n) for id_type, n in ((t, normalize_identifier(t, v)) for t, v in identifiers) if n
+        },
+    }
+
+
+def blocking_keys(attrs):
+    keys = {f"id:{id_type}:{value}" for id_type, value in attrs["identifiers"]}
+    keys |= {f"phone:{phone}" for phone in attrs["phones"]}
+    if attrs["email"]:
+        keys.add(f"email:{attrs['email']}")
+    if attrs["dob"]:
+        # Phonetic, so "Pereira" born on the same day still blocks with "Perera"
+        keys |= {f"dob_name:{attrs['dob'].isoformat()}:{phonetic_key(t)}" for t in attrs["name"] if len(t) > 1}
+    elif attrs["name"]:
+        keys.add(f"name:{' '.join(sorted(attrs['name']))}")
+    return {key[:120] for key in keys}
+
+
+def refresh_blocking_keys(patient):
+    """Replace a patient's blocking keys; call after flush, inside the write transaction"""
+    db.session.execute(db.delete(PatientBlockingKey).where(PatientBlockingKey.patient_id == patient.id))
+    keys = blocking_keys(patient_attributes(patient))
+    if keys:
+        db.session.execute(db.insert(PatientBlockingKey), [{"patient_id": patient.id, "key": k} for k in keys])
+
+
+def score_pair(a, b):
+    """Match score in [0, 1] for two attribute dicts, with the evidence used"""
+    score, reasons = 0.0, []
+
+    shared_types = {t for t, _ in a["identifiers"]} & {t for t, _ in b["identifiers"]}
+    if a["identifiers"] & b["identifiers"]:
+        score += 0.6
+        reasons.append("identifier")
+    elif "nic" in shared_types:
+        score -= 0.5  # two different national ids are two different people
+
+    if a["dob"] and b["dob"]:
+        if a["dob"] == b["dob"]:
+            score += 0.2
+            reasons.append("dob")
+        else:
+            score -= 0.2
+
+    if a["name"] and b["name"]:
+        similarity = SequenceMatcher(None, " ".join(sorted(a["name"])), " ".join(sorted(b["name"]))).ratio()
+        if similarity >= 0.8:
+            score += 0.3 * similarity
+            reasons.append("name")
+
+    if a["phones"] & b["phones"]:
+        score += 0.15
+        reasons.append("phone")
+    if a["email"] and a["email"] == b["email"]:
+        score += 0.15
+        reasons.append("email")
+    if a["gender"] and b["gender"] and a["gender"] != b["gender"]:
+        score -= 0.2
+
+    return max(0.0, min(score, 1.0)), reasons
+
+
+def _load_attributes(patient_ids):
+    found = {}
+    patient_ids = list(patient_ids)
+    for start in range(0, len(patient_ids), BATCH_SIZE):
+        patients = (
+            Patient.query.options(selectinload(Patient.identifiers))
+            .filter(Patient.id.in_(patient_ids[start:start + BATCH_SIZE]), Patient.is_active.is_(True))
+        )
+        for patient in patients:
+            found[patient.id] = (patient, patient_attributes(patient))
+    return found
+
+
+def find_candidates(attrs, exclude_ids=(), threshold=CANDIDATE_THRESHOLD, limit=5):
+    """Existing patients that probably are the person described by attrs.
+
+    Returns [(patient, score, reasons)], best first.
+    """
+    keys = blocking_keys(attrs)
+    if not keys:
+        return []
+    hits = db.session.execute(
+        select(PatientBlockingKey.patient_id, func.count())
+        .where(PatientBlockingKey.key.in_(keys))
+        .group_by(PatientBlockingKey.patient_id)
+        .order_by(func.count().desc())
+        .limit(MAX_CANDIDATES)
+    ).all()
+    exclude_ids = set(exclude_ids)
+    candidate_ids = [patient_id for patient_id, _ in hits if patient_id not in exclude_ids]
+
+    scored = []
+    for patient, candidate in _load_attributes(candidate_ids).values():
+        score, reasons = score_pair(attrs, candidate)
+        if score >= threshold:
+            scored.append((patient, round(score, 3), reasons))
+    scored.sort(key=lambda c: -c[1])
+    return scored[:limit]
+
+
+def identifier_owner(id_type, id_value, exclude_id=None):
+    """Id of another patient already holding this identifier, in any spelling"""
+    value = normalize_identifier(id_type, id_value)
+    if not value:
+        return None
+    statement = select(PatientBlockingKey.patient_id).where(PatientBlockingKey.key == f"id:{id_type}:{value}")
+    if exclude_id is not None:
+        statement = statement.where(PatientBlockingKey.patient_id != exclude_id)
+    return db.session.scalars(statement.limit(1)).first()
+
+
+def rebuild_blocking_keys(progress=None):
+    """Recompute blocking keys for every patient, in id order; returns patients indexed"""
+    last_id, total = 0, 0
+    while True:
+        patients = (
+            Patient.query.options(selectinload(Patient.identifiers))
+            .filter(Patient.id > last_id)
+            .order_by(Patient.id)
+            .limit(BATCH_SIZE)
+            .all()
+        )
+        if not patients:
+            return total
+        ids = [p.id for p in patients]
+        db.session.execute(db.delete(PatientBlockingKey).where(PatientBlockingKey.patient_id.in_(ids)))
+        rows = [
+            {"patient_id": p.id, "key": key}
+            for p in patients
+            for key in blocking_keys(patient_attributes(p))
+        ]
+        if rows:
+            db.session.execute(db.insert(PatientBlockingKey), rows)
+        db.session.commit()
+        last_id, total = ids[-1], total + len(ids)
+        db.session.expunge_all()
+        if progress:
+            progress(last_id, total)
+
+
+def _candidate_pairs(ministry_id=None, max_block=MAX_BLOCK_SIZE):
+    """Patient id pairs sharing a blocking key, walking the key index in order"""
+    statement = (
+        select(PatientBlockingKey.key, PatientBlockingKey.patient_id)
+        .order_by(PatientBlockingKey.key, PatientBlockingKey.patient_id)
+        .execution_options(yield_per=10000)
+    )
+    if ministry_id is not None:
+        in_ministry = select(Hospital.id).where(Hospital.ministry_id == ministry_id)
+        statement = statement.join(Patient, Patient.id == PatientBlockingKey.patient_id).where(
+            Patient.created_by_hospital.in_(in_ministry), Patient.is_active.is_(True),
+        )
+
+    pairs = set()
+
+    def add_block(block):
+        if 1 < len(block) <= max_block:
+            for i, a in enumerate(block):
+                for b in block[i + 1:]:
+                    pairs.add((a, b))
+
+    current_key, block = None, []
+    for key, patient_id in db.session.execute(statement):
+        if key != current_key:
+            add_block(block)
+            current_key, block = key, []
+        block.append(patient_id)
+    add_block(block)
+    return pairs
+
+
+def cluster_patients(ministry_id=None, threshold=CANDIDATE_THRESHOLD, progress=None):
+    """Score every blocked pair and store duplicate clusters for review.
+
+    Pending candidates are replaced; confirmed or rejected pairs are kept as
+    reviewed. Returns (pairs compared, candidate pairs stored, clusters).
+    """
+    pairs = sorted(_candidate_pairs(ministry_id))
+    reviewed = {
+        (a, b) for a, b in db.session.query(
+            PatientDuplicateCandidate.patient_id, PatientDuplicateCandidate.duplicate_id,
+        ).filter(PatientDuplicateCandidate.status != "pending")
+    }
+
+    parent = {}
+
+    def find(x):
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    matches = []
+    for start in range(0, len(pairs), BATCH_SIZE):
+        chunk = pairs[start:start + BATCH_SIZE]
+        loaded = _load_attributes({i for pair in chunk for i in pair})
+        for a, b in chunk:
+            if a not in loaded or b not in loaded:
+                continue
+            score, reasons = score_pair(loaded[a][1], loaded[b][1])
+            if score >= threshold:
+                matches.append((a, b, round(score, 3), reasons))
+                root_a, root_b = find(a), find(b)
+                if root_a != root_b:
+                    parent[max(root_a, root_b)] = min(root_a, root_b)
+        db.session.expunge_all()
+        if progress:
+            progress(min(start + BATCH_SIZE, len(pairs)), len(pairs), len(matches))
+
+    pending = PatientDuplicateCandidate.query.filter_by(status="pending")
+    if ministry_id is not None:
+        in_ministry = select(Hospital.id).where(Hospital.ministry_id == ministry_id)
+        pending = pending.filter(PatientDuplicateCandidate.patient_id.in_(
+            select(Patient.id).where(Patient.created_by_hospital.in_(in_ministry))
+        ))
+    pending.delete(synchronize_session=False)
+
+    rows = [
+        {"patient_id": a, "duplicate_id": b, "cluster_id": find(a), "score": score, "reasons": reasons}
+        for a, b, score, reasons in matches
+        if (a, b) not in reviewed
+    ]
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(db.insert(PatientDuplicateCandidate), rows[start:start + BATCH_SIZE])
+    db.session.commit()
+
+    return len(pairs), len(rows), len({row["cluster_id"] for row in rows})
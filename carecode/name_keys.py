@@ -0,0 +1,132 @@
+"""Phonetic, transliteration-tolerant keys for patient name search.
+
+Sinhala and Tamil names are romanized inconsistently ("Perera"/"Pereira",
+"Jeyakumar"/"Jayakumar", "Thilini"/"Tilini", "Yogarajah"/"Yogaraja"), so a
+name is reduced per word to a consonant skeleton that most spellings share:
+aspirated pairs lose their "h", doubled letters collapse, vowels and
+semi-vowels drop, and sound-alike consonants fold together. Keys are stored
+in ``patient_name_keys`` and searched with indexed prefix lookups. A flush
+listener rewrites a patient's keys whenever its name is inserted or changed,
+whichever code path wrote it; ``flask backfill-name-keys`` fills them for
+patients created before. Until the backfill has run, the
+NAME_SEARCH_SUBSTRING_FALLBACK setting also matches the name with ILIKE,
+which scans the table and so is off by default.
+"""
+import re
+import unicodedata
+
+from sqlalchemy import delete, event, inspect, insert, select
+from sqlalchemy.orm import Session
+
+from models import db, Patient, PatientNameKey
+
+MAX_KEY_LENGTH = 12
+BATCH_SIZE = 1000
+
+_TITLES = {"mr", "mrs", "ms", "miss", "dr", "rev", "prof", "master", "baby", "ven"}
+
+# Applied in order to the lower-cased word
+_REWRITES = [
+    (re.compile(r"([bcdgkpst])h"), r"\1"),  # aspirates and digraphs: th, dh, kh, bh, sh, ch
+    (re.compile(r"h$"), ""),  # Yogarajah -> Yogaraja
+    (re.compile(r"ck|q|c"), "k"),
+    (re.compile(r"x"), "ks"),
+    (re.compile(r"z"), "s"),
+    (re.compile(r"w"), "v"),
+    (re.compile(r"(.)\1+"), r"\1"),
+]
+_VOWELS = re.compile(r"[aeiouy]")
+
+
+def name_words(name):
+    text = unicodedata.normalize("NFKD", name or "").encode("ascii", "ignore").decode().lower()
+    return [w for w in re.findall(r"[a-z]+", text) if w not in _TITLES]
+
+
+def phonetic_key(word):
+    """Consonant skeleton of one name word, e.g. 'Pereira' -> 'PR'"""
+    word = word.lower()
+    for pattern, replacement in _REWRITES:
+        word = pattern.sub(replacement, word)
+    if not word:
+        return ""
+    # Keep a leading vowel as a marker so "Anura" and "Nura" stay apart
+    head = "A" if word[0] in "aeiou" else ""
+    skeleton = re.sub(r"(.)\1+", r"\1", _VOWELS.sub("", word))
+    return (head + skeleton.upper())[:MAX_KEY_LENGTH]
+
+
+def name_keys(name):
+    """Distinct phonetic keys for every word of a name"""
+    keys = []
+    for word in name_words(name):
+        key = phonetic_key(word)
+        if key and key not in keys:
+            keys.append(key)
+    return keys
+
+
+@event.listens_for(Session, "after_flush")
+def _refresh_changed(session, flush_context):
+    """Rewrite the keys of patients whose name was inserted or changed, in the same transaction"""
+    changed = [obj for obj in session.new if isinstance(obj, Patient)]
+    changed += [
+        obj for obj in session.dirty
+        if isinstance(obj, Patient) and inspect(obj).attrs.full_name.history.has_changes()
+    ]
+    if not changed:
+        return
+    connection = session.connection()
+    ids = [patient.id for patient in changed]
+    connection.execute(delete(PatientNameKey).where(PatientNameKey.patient_id.in_(ids)))
+    keys = [{"patient_id": patient.id, "key": key} for patient in changed for key in name_keys(patient.full_name)]
+    if keys:
+        connection.execute(insert(PatientNameKey), keys)
+
+
+def name_search_clause(term, substring_fallback=False):
+    """Clause matching patients whose name has a word sounding like each query word.
+
+    The last word is matched as a key prefix so partially typed names still
+    find results. A term without usable words is matched with ILIKE, and so
+    is every term when `substring_fallback` is set.
+    """
+    contains = Patient.full_name.ilike(f"%{term}%")
+    words = name_words(term)
+    if not words:
+        return contains
+    clauses = []
+    for i, word in enumerate(words):
+        key = phonetic_key(word)
+        if not key:
+            continue
+        condition = PatientNameKey.key.startswith(key, autoescape=True) if i == len(words) - 1 \
+            else PatientNameKey.key == key
+        clauses.append(Patient.id.in_(select(PatientNameKey.patient_id).where(condition)))
+    if not clauses:
+        return contains
+    return db.or_(db.and_(*clauses), contains) if substring_fallback else db.and_(*clauses)
+
+
+def backfill_name_keys(progress=None):
+    """Compute name keys for every patient, in id order; returns patients processed"""
+    last_id, total = 0, 0
+    while True:
+        rows = db.session.execute(
+            select(Patient.id, Patient.full_name).where(Patient.id > last_id).order_by(Patient.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            return total
+        ids = [patient_id for patient_id, _ in rows]
+        db.session.execute(db.delete(PatientNameKey).where(PatientNameKey.patient_id.in_(ids)))
+        keys = [
+            {"patient_id": patient_id, "key": key}
+            for patient_id, full_name in rows
+            for key in name_keys(full_name)
+        ]
+        if keys:
+            db.session.execute(db.insert(PatientNameKey), keys)
+        db.session.commit()
+        last_id, total = ids[-1], total + len(ids)
+        if progress:
+            progress(last_id, total)
@@ -0,0 +1,351 @@
+"""Transactional outbox: an ordered log of changes to patient-facing tables.
+
+Every ORM flush that inserts, updates or deletes a Patient,
+PatientIdentifier, MedicalEncounter, Doctor or PatientHospital row also
+inserts one ``outbox_events`` row per change, on the same connection and in
+the same transaction. An event exists exactly when its change commits.
+Inserts carry every column, updates only the changed columns, deletes
+none. ``password_hash`` and ``qr_code_image`` are never copied. Updates
+and deletes also record the row's ``updated_at`` before the change, the
+version it was made against, for optimistic conflict checks. Bulk
+``db.insert()``/``update()`` statements bypass the ORM; their callers
+write events with ``record()``.
+
+Downstream processors (search indexes, caches, rollups, exports) are named
+consumers with a durable offset in ``outbox_consumers``. ``poll()`` returns
+the next events in id order and ``ack()`` moves the offset forward, so
+delivery is at least once and consumers should apply events as upserts.
+Ids are allocated at insert time but become visible at commit, so a
+transaction still in flight shows up as a gap. ``poll()`` stops before a
+gap until GAP_TIMEOUT has passed, after which the gap is taken to be a
+rolled back transaction.
+
+``compact()`` folds older events for the same row into its latest event.
+``purge()`` deletes events every consumer has acknowledged once they are
+older than the retention period. Writes that replay changes from elsewhere
+(see edge.py) run inside ``suppressed()`` so they are not logged again.
+"""
+import logging
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import event, func, inspect, select, update
+from sqlalchemy.orm import Session
+
+from models import (db, Doctor, MedicalEncounter, OutboxConsumer, OutboxEvent, Patient, PatientHospital,
+                    PatientIdentifier)
+
+BATCH_SIZE = 500
+GAP_TIMEOUT = timedelta(seconds=60)
+RETENTION = timedelta(days=7)
+COMPACT_AFTER = timedelta(days=1)
+EXCLUDED_COLUMNS = {"password_hash", "qr_code_image"}
+
+# Model -> attribute holding the owning hospital
+TRACKED = {
+    Patient: "created_by_hospital",
+    PatientIdentifier: None,
+    MedicalEncounter: "hospital_id",
+    Doctor: "hospital_id",
+    PatientHospital: "hospital_id",
+}
+
+_TX_KEY = "carecode.outbox_tx"
+_BASE_KEY = "carecode.outbox_base"
+_SUPPRESS_KEY = "carecode.outbox_suppressed"
+_enabled = False
+
+logger = logging.getLogger(__name__)
+
+
+def _jsonable(value):
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    return value
+
+
+def _columns(obj):
+    return [attr for attr in inspect(obj).mapper.column_attrs if attr.key not in EXCLUDED_COLUMNS]
+
+
+def _changes(obj, op):
+    if op == "delete":
+        return None
+    state = inspect(obj)
+    if op == "insert":
+        return {attr.key: _jsonable(getattr(obj, attr.key)) for attr in _columns(obj)}
+    return {
+        attr.key: _jsonable(getattr(obj, attr.key))
+        for attr in _columns(obj)
+        if state.attrs[attr.key].history.has_changes() or attr.columns[0].onupdate is not None
+    }
+
+
+def _tx_id(session):
+    return session.info.setdefault(_TX_KEY, uuid.uuid4().hex)
+
+
+def _event_row(session, obj, op, now, base=None):
+    hospital_attr = TRACKED[type(obj)]
+    return {
+        "entity": obj.__tablename__,
+        "entity_id": obj.id,
+        "op": op,
+        "hospital_id": getattr(obj, hospital_attr) if hospital_attr else None,
+        "tx_id": _tx_id(session),
+        "changes": _changes(obj, op),
+        "base_updated_at": base,
+        "created_at": now,
+    }
+
+
+def record(session, op, objects):
+    """Write events for rows changed outside the ORM unit of work (bulk statements)"""
+    if not _enabled or session.info.get(_SUPPRESS_KEY):
+        return
+    now = datetime.utcnow()
+    rows = [_event_row(session, obj, op, now) for obj in objects]
+    if rows:
+        session.execute(db.insert(OutboxEvent), rows)
+
+
+@contextmanager
+def suppressed(session):
+    """Don't log changes flushed inside the block; flush before leaving it"""
+    session.info[_SUPPRESS_KEY] = True
+    try:
+        yield
+    finally:
+        session.info.pop(_SUPPRESS_KEY, None)
+
+
+@event.listens_for(Session, "before_flush")
+def _capture_versions(session, flush_context, instances):
+    # updated_at is overwritten during the flush, so read the prior version now
+    if not _enabled or session.info.get(_SUPPRESS_KEY):
+        return
+    session.info[_BASE_KEY] = {
+        id(obj): inspect(obj).attrs.updated_at.loaded_value
+        for obj in (*session.dirty, *session.deleted)
+        if type(obj) in TRACKED and "updated_at" in inspect(obj).mapper.column_attrs
+    }
+
+
+@event.listens_for(Session, "after_flush")
+def _write_events(session, flush_context):
+    bases = session.info.pop(_BASE_KEY, {})
+    if not _enabled or session.info.get(_SUPPRESS_KEY):
+        return
+    now = datetime.utcnow()
+    rows = []
+    for op, objects in (("insert", session.new), ("update", session.dirty), ("delete", session.deleted)):
+        for obj in objects:
+            if type(obj) not in TRACKED:
+                continue
+            if op == "update" and not session.is_modified(obj, include_collections=False):
+                continue
+            base = bases.get(id(obj))
+            rows.append(_event_row(session, obj, op, now, base if isinstance(base, datetime) else None))
+    if rows:
+        rows.sort(key=lambda r: (r["entity"], r["entity_id"]))
+        session.connection().execute(OutboxEvent.__table__.insert(), rows)
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _end_transaction(session):
+    session.info.pop(_TX_KEY, None)
+
+
+def _as_dict(e):
+    return {
+        "offset": e.id,
+        "entity": e.entity,
+        "entity_id": e.entity_id,
+        "op": e.op,
+        "hospital_id": e.hospital_id,
+        "tx_id": e.tx_id,
+        "changes": e.changes,
+        "base_updated_at": e.base_updated_at.isoformat() if e.base_updated_at else None,
+        "created_at": e.created_at.isoformat(),
+    }
+
+
+def register(name, from_start=True):
+    """Create a consumer if missing; a new one starts at the oldest retained event or the current end"""
+    consumer = db.session.get(OutboxConsumer, name)
+    if consumer is None:
+        position = 0 if from_start else db.session.scalar(select(func.max(OutboxEvent.id))) or 0
+        consumer = OutboxConsumer(name=name, position=position)
+        db.session.add(consumer)
+        db.session.commit()
+    return consumer
+
+
+def poll(name, limit=BATCH_SIZE, entities=None, gap_timeout=None):
+    """Next events for a consumer: ([event dict, ...], offset to ack).
+
+    The offset also covers events filtered out by `entities`, so acking it
+    skips them. Call in a fresh transaction so recent commits are visible.
+    """
+    rows, offset = read_after(register(name).position, limit, gap_timeout)
+    return [_as_dict(e) for e in rows if entities is None or e.entity in entities], offset
+
+
+def read_after(position, limit=BATCH_SIZE, gap_timeout=None):
+    """OutboxEvent rows after an offset, up to the first unsettled gap, and the offset they reach"""
+    gap_timeout = gap_timeout if gap_timeout is not None else GAP_TIMEOUT
+    rows = db.session.scalars(
+        select(OutboxEvent).where(OutboxEvent.id > position).order_by(OutboxEvent.id).limit(limit)
+    ).all()
+
+    settled = datetime.utcnow() - gap_timeout
+    events = []
+    for e in rows:
+        if e.id != position + 1 and e.created_at > settled:
+            break  # an earlier id may still be committing
+        position = e.id
+        events.append(e)
+    return events, position
+
+
+def ack(name, offset):
+    """Store a consumer's offset; never moves it backwards"""
+    db.session.execute(
+        update(OutboxConsumer)
+        .where(OutboxConsumer.name == name, OutboxConsumer.position < offset)
+        .values(position=offset, updated_at=datetime.utcnow())
+    )
+    db.session.commit()
+
+
+def consume(name, handler, limit=BATCH_SIZE, entities=None, max_batches=None):
+    """Feed batches to handler(events) and ack each one after it returns; returns events handled"""
+    handled = batches = 0
+    while max_batches is None or batches < max_batches:
+        db.session.commit()  # start a new snapshot
+        position = register(name).position
+        events, offset = poll(name, limit, entities)
+        if offset == position:
+            break
+        if events:
+            handler(events)
+        ack(name, offset)
+        handled += len(events)
+        batches += 1
+    return handled
+
+
+def _merge(events):
+    """Fold a row's events, oldest first, into the values for its latest event"""
+    last = events[-1]
+    if last.op == "delete":
+        return "delete", None
+    changes = {}
+    for e in events:
+        if e.op == "delete":
+            changes = {}
+        else:
+            changes.update(e.changes or {})
+    return ("insert" if events[0].op == "insert" else "update"), changes
+
+
+def compact(older_than=None, batch_size=BATCH_SIZE):
+    """Keep only the latest event per row among events older than `older_than`; returns events removed"""
+    cutoff = datetime.utcnow() - (older_than if older_than is not None else COMPACT_AFTER)
+    horizon = db.session.scalar(select(func.max(OutboxEvent.id)).where(OutboxEvent.created_at < cutoff))
+    if horizon is None:
+        return 0
+
+    removed = 0
+    while True:
+        keys = db.session.execute(
+            select(OutboxEvent.entity, OutboxEvent.entity_id)
+            .where(OutboxEvent.id <= horizon)
+            .group_by(OutboxEvent.entity, OutboxEvent.entity_id)
+            .having(func.count() > 1)
+            .limit(batch_size)
+        ).all()
+        if not keys:
+            break
+        by_entity = defaultdict(list)
+        for entity, entity_id in keys:
+            by_entity[entity].append(entity_id)
+        runs = defaultdict(list)
+        for entity, ids in by_entity.items():
+            for e in db.session.scalars(
+                select(OutboxEvent)
+                .where(OutboxEvent.entity == entity, OutboxEvent.entity_id.in_(ids), OutboxEvent.id <= horizon)
+                .order_by(OutboxEvent.id)
+            ):
+                runs[(e.entity, e.entity_id)].append(e)
+        for events in runs.values():
+            survivor = events[-1]
+            survivor.op, survivor.changes = _merge(events)
+            survivor.base_updated_at = events[0].base_updated_at
+            for e in events[:-1]:
+                db.session.delete(e)
+            removed += len(events) - 1
+        db.session.commit()
+    return removed
+
+
+def purge(retention=None, max_age=None, batch_size=10000):
+    """Delete acknowledged events older than `retention`, and any event older than `max_age`"""
+    now = datetime.utcnow()
+    cutoff = now - (retention if retention is not None else RETENTION)
+    acknowledged = db.session.scalar(select(func.min(OutboxConsumer.position)))
+    horizon = db.session.scalar(select(func.max(OutboxEvent.id)).where(OutboxEvent.created_at < cutoff))
+    if horizon is not None and acknowledged is not None:
+        horizon = min(horizon, acknowledged)
+    if max_age is not None:
+        forced = db.session.scalar(select(func.max(OutboxEvent.id)).where(OutboxEvent.created_at < now - max_age))
+        if forced is not None and (horizon is None or forced > horizon):
+            behind = db.session.scalars(select(OutboxConsumer.name).where(OutboxConsumer.position < forced)).all()
+            logger.warning(f"Outbox events up to {forced} deleted before consumers {behind} read them")
+            horizon = forced
+    if horizon is None:
+        return 0
+
+    removed = 0
+    start = db.session.scalar(select(func.min(OutboxEvent.id))) or 0
+    while start <= horizon:
+        end = min(start + batch_size - 1, horizon)
+        result = db.session.execute(
+            db.delete(OutboxEvent).where(OutboxEvent.id >= start, OutboxEvent.id <= end)
+        )
+        db.session.commit()
+        removed += result.rowcount
+        start = end + 1
+    return removed
+
+
+def status():
+    """Log bounds and each consumer's offset and lag"""
+    first, last, total = db.session.execute(
+        select(func.min(OutboxEvent.id), func.max(OutboxEvent.id), func.count())
+    ).one()
+    return {
+        "first_offset": first,
+        "last_offset": last,
+        "events": total,
+        "consumers": [
+            {
+                "name": c.name,
+                "position": c.position,
+                "lag": max(0, (last or 0) - c.position),
+                "updated_at": c.updated_at.isoformat() if c.updated_at else None,
+            }
+            for c in OutboxConsumer.query.order_by(OutboxConsumer.name)
+        ],
+    }
+
+
+def init_outbox(app):
+    """Write outbox events on every flush unless OUTBOX_ENABLED is false"""
+    global _enabled, GAP_TIMEOUT
+    _enabled = app.config.get("OUTBOX_ENABLED", True)
+    GAP_TIMEOUT = timedelta(seconds=app.config.get("OUTBOX_GAP_TIMEOUT", GAP_TIMEOUT.total_seconds()))
+    app.extensions["outbox"] = {"enabled": _enabled}
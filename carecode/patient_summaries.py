@@ -0,0 +1,208 @@
+"""Denormalized per-patient summary cards for the QR and summary fast paths.
+
+The card (demographics, blood type, recent encounters and diagnoses, current
+medicines, encounter count, last visit) is rebuilt after every committed
+write to the patient, their encounters, prescriptions or hospital links, and
+when a doctor or hospital named on it is renamed. It is stored
+pre-serialized in ``patient_summaries`` together with its ETag. Reads are a
+single primary-key (or QR token) lookup.
+"""
+import hashlib
+import json
+import logging
+from datetime import datetime
+
+from sqlalchemy import func, inspect, select
+from sqlalchemy.orm import Session, joinedload, selectinload
+
+from model_events import subscribe
+from models import (db, Doctor, Hospital, Patient, PatientHospital, PatientSummary, MedicalEncounter,
+                    EncounterMedicine)
+
+RECENT_ENCOUNTERS = 5
+BATCH_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+
+def build_document(session, patient):
+    """The summary card for one patient, as a JSON-serializable dict"""
+    recent = session.scalars(
+        select(MedicalEncounter)
+        .options(
+            joinedload(MedicalEncounter.doctor),
+            joinedload(MedicalEncounter.hospital),
+            selectinload(MedicalEncounter.prescriptions),
+        )
+        .where(MedicalEncounter.patient_id == patient.id)
+        .order_by(MedicalEncounter.treatment_date.desc(), MedicalEncounter.id.desc())
+        .limit(RECENT_ENCOUNTERS)
+    ).all()
+    total = session.scalar(
+        select(func.count()).select_from(MedicalEncounter).where(MedicalEncounter.patient_id == patient.id)
+    )
+
+    latest_diagnoses, seen_codes = [], set()
+    for encounter in recent:
+        key = encounter.diagnosis_code or encounter.diagnosis_text
+        if key and key not in seen_codes:
+            seen_codes.add(key)
+            latest_diagnoses.append({
+                "code": encounter.diagnosis_code,
+                "text": encounter.diagnosis_text,
+                "date": encounter.treatment_date.isoformat(),
+            })
+
+    current_medicines = []
+    for encounter in recent:
+        medicines = encounter.medicine_list()
+        if medicines:
+            current_medicines = [{**m, "prescribed_on": encounter.treatment_date.isoformat()} for m in medicines]
+            break
+
+    contact_info = patient.contact_info if isinstance(patient.contact_info, dict) else {}
+    return {
+        "patient": {
+            "id": patient.id,
+            "name": patient.full_name,
+            "dob": patient.date_of_birth.isoformat() if patient.date_of_birth else None,
+            "blood_type": patient.blood_type,
+            "gender": patient.gender,
+            "phone": contact_info.get("phone_primary"),
+            "guardian_number": patient.guardian_number,
+            "address": patient.address if isinstance(patient.address, dict) else None,
+        },
+        "recent_encounters": [
+            {
+                "id": e.id,
+                "date": e.treatment_date.strftime("%Y-%m-%d"),
+                "doctor": e.doctor.full_name if e.doctor else "Unknown",
+                "diagnosis": e.diagnosis_text,
+                "diagnosis_code": e.diagnosis_code,
+                "hospital": e.hospital.name if e.hospital else None,
+            }
+            for e in recent
+        ],
+        "total_encounters": total,
+        "latest_diagnoses": latest_diagnoses,
+        "current_medicines": current_medicines,
+        "last_visit": (
+            {"date": recent[0].treatment_date.isoformat(), "hospital": recent[0].hospital.name if recent[0].hospital else None}
+            if recent else None
+        ),
+        "generated_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+    }
+
+
+def refresh_summaries(session, patient_ids):
+    """Rebuild and store the cards of the given patients in `session` (not committed)"""
+    patient_ids = sorted(set(patient_ids))
+    patients = session.scalars(select(Patient).where(Patient.id.in_(patient_ids))).all()
+    links = {}
+    for patient_id, hospital_id in session.execute(
+        select(PatientHospital.patient_id, PatientHospital.hospital_id)
+        .where(PatientHospital.patient_id.in_(patient_ids))
+    ):
+        links.setdefault(patient_id, set()).add(hospital_id)
+
+    existing = {
+        s.patient_id: s
+        for s in session.scalars(select(PatientSummary).where(PatientSummary.patient_id.in_(patient_ids)))
+    }
+    for patient in patients:
+        document = build_document(session, patient)
+        # generated_at is excluded so an unchanged card keeps its ETag
+        fingerprint = json.dumps({k: v for k, v in document.items() if k != "generated_at"}, sort_keys=True)
+        summary = existing.get(patient.id) or PatientSummary(patient_id=patient.id)
+        summary.qr_token = patient.qr_token
+        summary.is_active = bool(patient.is_active)
+        summary.hospital_ids = sorted(links.get(patient.id, set()) | {patient.created_by_hospital})
+        new_etag = hashlib.sha1(fingerprint.encode()).hexdigest()
+        if summary.etag != new_etag:
+            summary.etag = new_etag
+            summary.document = json.dumps(document, separators=(",", ":"))
+            summary.updated_at = datetime.utcnow()
+        session.add(summary)
+
+
+def get_summary(patient_id=None, qr_token=None):
+    """Stored card by patient id or QR token, building it on first use"""
+    if qr_token is not None:
+        summary = PatientSummary.query.filter_by(qr_token=qr_token).first()
+        if summary is None:
+            patient_id = db.session.scalar(select(Patient.id).where(Patient.qr_token == qr_token))
+    else:
+        summary = db.session.get(PatientSummary, patient_id)
+    if summary is None and patient_id is not None:
+        refresh_summaries(db.session, [patient_id])
+        db.session.commit()
+        summary = db.session.get(PatientSummary, patient_id)
+    return summary
+
+
+def rebuild_all_summaries(progress=None):
+    """Rebuild every card in id order; returns patients processed"""
+    last_id, total = 0, 0
+    while True:
+        ids = db.session.scalars(
+            select(Patient.id).where(Patient.id > last_id).order_by(Patient.id).limit(BATCH_SIZE)
+        ).all()
+        if not ids:
+            return total
+        refresh_summaries(db.session, ids)
+        db.session.commit()
+        db.session.expunge_all()
+        last_id, total = ids[-1], total + len(ids)
+        if progress:
+            progress(last_id, total)
+
+
+def _refresh(patient_ids):
+    with Session(db.engine) as session:
+        try:
+            refresh_summaries(session, patient_ids)
+            session.commit()
+        except Exception:
+            session.rollback()
+            # Drop the stale cards; get_summary() rebuilds them on the next read
+            logger.exception(f"Refreshing patient summaries {sorted(patient_ids)} failed")
+            session.execute(db.delete(PatientSummary).where(PatientSummary.patient_id.in_(patient_ids)))
+            session.commit()
+
+
+def _refresh_after_commit(events):
+    _refresh({values["patient_id"] for _, values in events})
+
+
+def _renamed(name_attr):
+    """Capture the id of a Doctor/Hospital and whether this flush changed its name"""
+    return lambda obj: {"id": obj.id, "renamed": inspect(obj).attrs[name_attr].history.has_changes()}
+
+
+def _refresh_cards_naming(encounter_column):
+    """Handler refreshing the stored cards whose encounters reference a renamed row"""
+    def handler(events):
+        renamed = {values["id"] for kind, values in events if kind == "update" and values["renamed"]}
+        if not renamed:
+            return
+        with Session(db.engine) as session:
+            patient_ids = session.scalars(
+                select(MedicalEncounter.patient_id).distinct()
+                .join(PatientSummary, PatientSummary.patient_id == MedicalEncounter.patient_id)
+                .where(encounter_column.in_(renamed))
+            ).all()
+        for start in range(0, len(patient_ids), BATCH_SIZE):
+            _refresh(patient_ids[start:start + BATCH_SIZE])
+    return handler
+
+
+def init_patient_summaries():
+    subscribe(Patient, _refresh_after_commit, capture=lambda p: {"patient_id": p.id})
+    subscribe(
+        (MedicalEncounter, EncounterMedicine, PatientHospital),
+        _refresh_after_commit,
+        capture=lambda obj: {"patient_id": obj.patient_id},
+    )
+    # Cards carry doctor and hospital names, which would otherwise go stale under an unchanged ETag
+    subscribe(Doctor, _refresh_cards_naming(MedicalEncounter.doctor_id), capture=_renamed("full_name"))
+    subscribe(Hospital, _refresh_cards_naming(MedicalEncounter.hospital_id), capture=_renamed("name"))
@@ -0,0 +1,128 @@
+"""Prescription backfill and drug-utilization queries over encounter_medicines."""
+from sqlalchemy import func
+
+from models import db, MedicalEncounter, EncounterMedicine, Patient
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+def backfill_encounter_medicines(batch_size=BACKFILL_BATCH_SIZE, progress=None):
+    """Copy legacy MedicalEncounter.medicines JSON into encounter_medicines.
+
+    Walks medical_encounters in primary-key order one batch at a time, so
+    memory stays flat however large the table is. Encounters that already
+    have prescription rows are skipped, which makes the backfill safe to
+    re-run after an interruption. Returns (encounters_migrated, rows_inserted).
+    """
+    last_id = 0
+    encounters_migrated = 0
+    rows_inserted = 0
+
+    while True:
+        batch = (
+            db.session.query(
+                MedicalEncounter.id,
+                MedicalEncounter.patient_id,
+                MedicalEncounter.hospital_id,
+                MedicalEncounter.treatment_date,
+                MedicalEncounter.medicines,
+            )
+            .filter(MedicalEncounter.id > last_id)
+            .filter(MedicalEncounter.medicines.isnot(None))
+            .filter(
+                ~db.session.query(EncounterMedicine.id)
+                .filter(EncounterMedicine.encounter_id == MedicalEncounter.id)
+                .exists()
+            )
+            .order_by(MedicalEncounter.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+
+        rows = []
+        for encounter_id, patient_id, hospital_id, treatment_date, medicines in batch:
+            if not isinstance(medicines, list):
+                continue
+            position = 0
+            for medicine in medicines:
+                if not isinstance(medicine, dict) or not (medicine.get('name') or '').strip():
+                    continue
+                rows.append({
+                    'encounter_id': encounter_id,
+                    'position': position,
+                    'patient_id': patient_id,
+                    'hospital_id': hospital_id,
+                    'prescribed_on': treatment_date,
+                    'drug_name': medicine['name'].strip()[:200],
+                    'drug_code': (medicine.get('code') or None),
+                    'dosage': (medicine.get('dosage') or None),
+                    'frequency': (medicine.get('frequency') or None),
+                    'duration': (medicine.get('duration') or None),
+                })
+                position += 1
+            if position:
+                encounters_migrated += 1
+
+        if rows:
+            db.session.execute(db.insert(EncounterMedicine), rows)
+        db.session.commit()
+        rows_inserted += len(rows)
+        last_id = batch[-1][0]
+
+        if progress:
+            progress(last_id, encounters_migrated, rows_inserted)
+
+    return encounters_migrated, rows_inserted
+
+
+def _apply_filters(query, hospital_id=None, date_from=None, date_to=None):
+    if hospital_id is not None:
+        query = query.filter(EncounterMedicine.hospital_id == hospital_id)
+    if date_from:
+        query = query.filter(EncounterMedicine.prescribed_on >= date_from)
+    if date_to:
+        query = query.filter(EncounterMedicine.prescribed_on <= date_to)
+    return query
+
+
+def drug_utilization(hospital_id=None, date_from=None, date_to=None, limit=50):
+    """Most prescribed drugs, with prescription and distinct patient counts"""
+    query = db.session.query(
+        EncounterMedicine.drug_name,
+        func.count(EncounterMedicine.id).label('prescriptions'),
+        func.count(func.distinct(EncounterMedicine.patient_id)).label('patients'),
+    )
+    query = _apply_filters(query, hospital_id, date_from, date_to)
+    rows = (
+        query.group_by(EncounterMedicine.drug_name)
+        .order_by(func.count(EncounterMedicine.id).desc())
+        .limit(limit)
+        .all()
+    )
+    return [
+        {'drug_name': name, 'prescriptions': prescriptions, 'patients': patients}
+        for name, prescriptions, patients in rows
+    ]
+
+
+def patients_prescribed(drug_name, hospital_id=None, date_from=None, date_to=None, limit=100):
+    """Patients prescribed a drug, most recent prescription first"""
+    last_prescribed = func.max(EncounterMedicine.prescribed_on).label('last_prescribed')
+    query = (
+        db.session.query(Patient.id, Patient.full_name, last_prescribed)
+        .join(Patient, Patient.id == EncounterMedicine.patient_id)
+        .filter(EncounterMedicine.drug_name == drug_name)
+    )
+    query = _apply_filters(query, hospital_id, date_from, date_to)
+    rows = (
+        query.group_by(Patient.id, Patient.full_name)
+        .order_by(last_prescribed.desc())
+        .limit(limit)
+        .all()
+    )
+    return [
+        {'patient_id': pid, 'name': name, 'last_prescribed': last.strftime('%Y-%m-%d')}
+        for pid, name, last in rows
+    ]
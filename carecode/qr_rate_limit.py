@@ -0,0 +1,178 @@
+"""Token-bucket rate limiting for the public /patient/qr/<token> route.
+
+Buckets are kept per client IP and per token prefix (guessing scrapers walk
+the token space), and a negative cache remembers recently seen invalid
+tokens, so abusive requests are answered before any SQL runs. State lives
+in a small memory-mapped file under the instance folder, shared by every
+worker process on the host:
+
+* header: magic, layout version and the monitoring counters
+* bucket table: open-addressed slots of (key hash, tokens, updated at);
+  when a probe run is full the least recently used slot is evicted
+* negative cache: direct-mapped slots of (token hash, expires at)
+
+Every read-modify-write holds a POSIX record lock on the file plus a
+thread lock, since record locks only exclude other processes.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows development servers run a single process
+    fcntl = None
+
+MAGIC = b"CCRL"
+VERSION = 1
+HEADER_SIZE = 128
+BUCKET_SLOTS = 8192
+NEGATIVE_SLOTS = 16384
+PROBE_LIMIT = 8
+
+COUNTERS = (
+    "checked", "allowed", "limited_ip", "limited_prefix",
+    "negative_hits", "invalid_recorded", "evictions",
+)
+
+_HEADER = struct.Struct("<4sI" + "Q" * len(COUNTERS))
+_BUCKET = struct.Struct("<Qdd")  # key hash, tokens, updated at
+_NEGATIVE = struct.Struct("<Qd")  # token hash, expires at
+_BUCKETS_AT = HEADER_SIZE
+_NEGATIVE_AT = _BUCKETS_AT + BUCKET_SLOTS * _BUCKET.size
+FILE_SIZE = _NEGATIVE_AT + NEGATIVE_SLOTS * _NEGATIVE.size
+
+
+def _hash(key):
+    # 0 marks an empty slot
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") or 1
+
+
+class QRRateLimiter:
+    def __init__(self, path, ip_rate=0.5, ip_burst=30, prefix_rate=0.2, prefix_burst=10, prefix_length=4,
+                 negative_ttl=600):
+        """Rates are tokens per second, bursts the bucket capacity"""
+        self.limits = {"ip": (ip_rate, ip_burst), "prefix": (prefix_rate, prefix_burst)}
+        self.prefix_length = prefix_length
+        self.negative_ttl = negative_ttl
+        self._thread_lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < FILE_SIZE:
+            os.ftruncate(self._fd, FILE_SIZE)
+        self._map = mmap.mmap(self._fd, FILE_SIZE)
+        with self._locked():
+            magic, version = _HEADER.unpack_from(self._map, 0)[:2]
+            if magic != MAGIC or version != VERSION:
+                self._map[:FILE_SIZE] = bytes(FILE_SIZE)
+                _HEADER.pack_into(self._map, 0, MAGIC, VERSION, *([0] * len(COUNTERS)))
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            if fcntl is not None:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def _count(self, *names):
+        values = list(_HEADER.unpack_from(self._map, 0))
+        for name in names:
+            values[2 + COUNTERS.index(name)] += 1
+        _HEADER.pack_into(self._map, 0, *values)
+
+    def _take(self, kind, key, now):
+        """Take one token from a bucket; returns seconds until one is available, 0 if taken"""
+        rate, burst = self.limits[kind]
+        key_hash = _hash(f"{kind}:{key}")
+        start = key_hash % BUCKET_SLOTS
+        slot = victim = None
+        for probe in range(PROBE_LIMIT):
+            offset = _BUCKETS_AT + ((start + probe) % BUCKET_SLOTS) * _BUCKET.size
+            stored_hash, tokens, updated = _BUCKET.unpack_from(self._map, offset)
+            if stored_hash == key_hash:
+                slot = offset
+                break
+            if stored_hash == 0 or now - updated > burst / rate:
+                # Empty, or idle long enough to have refilled completely
+                slot, tokens = offset, float(burst)
+                break
+            if victim is None or updated < victim[1]:
+                victim = (offset, updated)
+        if slot is None:
+            slot, tokens = victim[0], float(burst)
+            self._count("evictions")
+        elif stored_hash == key_hash:
+            tokens = min(float(burst), tokens + (now - updated) * rate)
+
+        if tokens < 1:
+            _BUCKET.pack_into(self._map, slot, key_hash, tokens, now)
+            return (1 - tokens) / rate
+        _BUCKET.pack_into(self._map, slot, key_hash, tokens - 1, now)
+        return 0
+
+    def _negative_slot(self, token):
+        token_hash = _hash(token)
+        return _NEGATIVE_AT + (token_hash % NEGATIVE_SLOTS) * _NEGATIVE.size, token_hash
+
+    def check(self, ip, token):
+        """Decide a lookup before touching the database.
+
+        Returns (verdict, retry_after): verdict is "allow", "rate_limited"
+        or "invalid" (a token recently found not to exist).
+        """
+        now = time.time()
+        with self._locked():
+            self._count("checked")
+            retry_after = self._take("ip", ip or "unknown", now)
+            if retry_after:
+                self._count("limited_ip")
+                return "rate_limited", retry_after
+
+            offset, token_hash = self._negative_slot(token)
+            stored_hash, expires = _NEGATIVE.unpack_from(self._map, offset)
+            if stored_hash == token_hash and expires > now:
+                self._count("negative_hits")
+                return "invalid", 0
+
+            retry_after = self._take("prefix", token[:self.prefix_length].lower(), now)
+            if retry_after:
+                self._count("limited_prefix")
+                return "rate_limited", retry_after
+
+            self._count("allowed")
+            return "allow", 0
+
+    def remember_invalid(self, token):
+        offset, token_hash = self._negative_slot(token)
+        with self._locked():
+            _NEGATIVE.pack_into(self._map, offset, token_hash, time.time() + self.negative_ttl)
+            self._count("invalid_recorded")
+
+    def counters(self):
+        with self._locked():
+            values = _HEADER.unpack_from(self._map, 0)[2:]
+        return dict(zip(COUNTERS, values))
+
+
+def init_qr_rate_limiter(app):
+    """Create the app's limiter from QR_RATE_LIMIT_* config"""
+    config = app.config
+    limiter = QRRateLimiter(
+        config.get("QR_RATE_LIMIT_FILE") or os.path.join(app.instance_path, "qr_rate_limit.bin"),
+        ip_rate=config.get("QR_RATE_LIMIT_IP_PER_MINUTE", 30) / 60,
+        ip_burst=config.get("QR_RATE_LIMIT_IP_BURST", 30),
+        prefix_rate=config.get("QR_RATE_LIMIT_PREFIX_PER_MINUTE", 12) / 60,
+        prefix_burst=config.get("QR_RATE_LIMIT_PREFIX_BURST", 10),
+        negative_ttl=config.get("QR_NEGATIVE_CACHE_SECONDS", 600),
+    )
+    app.extensions["qr_rate_limiter"] = limiter
+    return limiter
@@ -0,0 +1,152 @@
+"""Batch validation of queued QR scans from offline clinic scanners.
+
+A scanner that lost connectivity queues its scans, each with a device
+generated ``scan_id``, and replays them in one request. The whole batch is
+resolved with a single ``IN`` query on ``Patient.qr_token``; audit rows and
+``qr_scan_receipts`` are written with one bulk insert each. A receipt is
+keyed by (doctor, scan_id), so a replayed scan returns its original result
+and is not audited twice.
+"""
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from models import db, AuditLog, Patient, QRScanReceipt
+
+MAX_BATCH_SIZE = 500
+MAX_SCAN_ID_LENGTH = 64
+
+ERRORS = {
+    "invalid": "Invalid QR code",
+    "malformed": "Invalid QR code format",
+}
+
+
+def qr_token_from_url(qr_url):
+    """Token part of a scanned patient QR URL, or None if it is not one"""
+    qr_url = (qr_url or "").strip()
+    if "/patient/qr/" not in qr_url:
+        return None
+    return qr_url.split("/patient/qr/")[-1].split("?")[0].strip("/") or None
+
+
+def _scanned_at(value):
+    try:
+        scanned_at = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if scanned_at.tzinfo is not None:
+        scanned_at = scanned_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return scanned_at
+
+
+def _result(scan_id, status, patient, replayed):
+    if status == "valid" and patient is not None:
+        return {
+            "scan_id": scan_id,
+            "success": True,
+            "patient_id": patient.id,
+            "patient_name": patient.full_name,
+            "replayed": replayed,
+        }
+    return {"scan_id": scan_id, "success": False, "error": ERRORS.get(status, ERRORS["invalid"]), "replayed": replayed}
+
+
+def _validate(scans, doctor_id, hospital_id, audit):
+    results = [None] * len(scans)
+    pending = {}  # scan_id -> (index, token, scanned_at), first occurrence wins
+    duplicates = []
+    for index, scan in enumerate(scans):
+        scan_id = str(scan.get("scan_id") or "").strip() if isinstance(scan, dict) else ""
+        if not scan_id or len(scan_id) > MAX_SCAN_ID_LENGTH:
+            results[index] = {"scan_id": scan_id or None, "success": False, "error": "A scan_id of up to 64 characters is required"}
+        elif scan_id in pending:
+            duplicates.append((index, scan_id))
+        else:
+            pending[scan_id] = (index, qr_token_from_url(scan.get("qr_url")), _scanned_at(scan.get("scanned_at")))
+
+    receipts = {
+        r.scan_id: r
+        for r in db.session.scalars(
+            select(QRScanReceipt).where(
+                QRScanReceipt.doctor_id == doctor_id, QRScanReceipt.scan_id.in_(list(pending)),
+            )
+        )
+    } if pending else {}
+
+    new_scans = {scan_id: entry for scan_id, entry in pending.items() if scan_id not in receipts}
+    tokens = {token for _, token, _ in new_scans.values() if token}
+    replayed_ids = {r.patient_id for r in receipts.values() if r.patient_id}
+    patients_by_token, patients_by_id = {}, {}
+    if tokens or replayed_ids:
+        for patient in db.session.scalars(
+            select(Patient).where(db.or_(
+                db.and_(Patient.qr_token.in_(tokens), Patient.is_active.is_(True)),
+                Patient.id.in_(replayed_ids),
+            ))
+        ):
+            patients_by_id[patient.id] = patient
+            if patient.is_active:
+                patients_by_token[patient.qr_token] = patient
+
+    now = datetime.utcnow()
+    receipt_rows, audit_rows = [], []
+    for scan_id, (index, token, scanned_at) in pending.items():
+        if scan_id in receipts:
+            receipt = receipts[scan_id]
+            results[index] = _result(scan_id, receipt.status, patients_by_id.get(receipt.patient_id), True)
+            continue
+        patient = patients_by_token.get(token) if token else None
+        status = "valid" if patient else ("invalid" if token else "malformed")
+        receipt_rows.append({
+            "doctor_id": doctor_id,
+            "scan_id": scan_id,
+            "patient_id": patient.id if patient else None,
+            "status": status,
+            "scanned_at": scanned_at,
+            "created_at": now,
+        })
+        if patient:
+            audit_rows.append({
+                **audit,
+                "patient_id": patient.id,
+                "hospital_id": hospital_id,
+                "action": "qr_scanned_by_doctor",
+                "details": {
+                    "doctor_id": doctor_id,
+                    "hospital_id": hospital_id,
+                    "scan_id": scan_id,
+                    "scanned_at": scanned_at.isoformat() if scanned_at else None,
+                    "batch": True,
+                },
+                "created_at": now,
+            })
+        results[index] = _result(scan_id, status, patient, False)
+
+    for index, scan_id in duplicates:
+        results[index] = {**results[pending[scan_id][0]], "replayed": True}
+
+    if receipt_rows:
+        db.session.execute(db.insert(QRScanReceipt), receipt_rows)
+    if audit_rows:
+        db.session.execute(db.insert(AuditLog), audit_rows)
+    return results
+
+
+def validate_scans(scans, doctor_id, hospital_id, audit):
+    """Validate a batch of queued scans and record receipts and audit rows.
+
+    `scans` is a list of {"scan_id", "qr_url", "scanned_at"} dicts and
+    `audit` the request-level audit columns (user, ip, user agent). Returns
+    one result per scan, in order. Commits.
+    """
+    try:
+        results = _validate(scans, doctor_id, hospital_id, audit)
+        db.session.commit()
+    except IntegrityError:
+        # The same batch was replayed concurrently; its receipts are now stored
+        db.session.rollback()
+        results = _validate(scans, doctor_id, hospital_id, audit)
+        db.session.commit()
+    return results
@@ -0,0 +1,216 @@
+"""Printable QR card sheets for bulk patient onboarding.
+
+Cards (QR code, patient name and primary identifier) are laid out ten to an
+A4 page at 300 dpi, sized like a credit card so they can be cut out or
+printed on card stock. Each sheet is rendered as one task on a process
+pool; the pool is spawned rather than forked because the web process is
+multi-threaded. Finished sheets are written into a zip archive in order
+and the archive is yielded chunk by chunk as it grows, so a download for a
+whole hospital starts with the first sheet. QR images already stored on
+the patient (``qr_code_image``) are reused instead of being re-encoded.
+qrcode and Pillow are imported by the rendering functions, so only the
+pool workers load them, not every web worker that imports this module.
+"""
+import base64
+import io
+import multiprocessing
+import os
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from sqlalchemy.orm import selectinload
+
+from models import Patient
+
+DPI = 300
+PAGE_SIZE = (2480, 3508)  # A4
+CARD_SIZE = (1011, 638)  # 85.6 x 54 mm, ID-1
+COLUMNS, ROWS = 2, 5
+CARDS_PER_SHEET = COLUMNS * ROWS
+MAX_PATIENTS = 5000
+FORMATS = ("png", "pdf")
+
+# Preferred identifier to print under the name
+IDENTIFIER_ORDER = ("nic", "passport", "birth_certificate", "driving_license")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def card_data(patient, base_url):
+    """What a card needs, as plain data that can be sent to a worker"""
+    identifiers = {i.id_type: i.id_value for i in patient.identifiers}
+    for id_type in IDENTIFIER_ORDER:
+        if identifiers.get(id_type):
+            identifier = f"{id_type.replace('_', ' ').upper()}: {identifiers[id_type]}"
+            break
+    else:
+        identifier = f"Patient ID: {patient.id}"
+
+    cached = patient.qr_code_image or ""
+    return {
+        "name": patient.full_name,
+        "identifier": identifier,
+        "url": patient.get_qr_url(base_url),
+        "qr_png": base64.b64decode(cached.split(",", 1)[-1]) if cached else None,
+    }
+
+
+def load_cards(hospital_id, base_url, patient_ids=None):
+    """Card data for a hospital's active patients (optionally only `patient_ids`), in id order"""
+    query = (
+        Patient.query.options(selectinload(Patient.identifiers))
+        .filter(Patient.created_by_hospital == hospital_id, Patient.is_active.is_(True))
+    )
+    if patient_ids is not None:
+        query = query.filter(Patient.id.in_(patient_ids))
+    return [card_data(p, base_url) for p in query.order_by(Patient.id).limit(MAX_PATIENTS)]
+
+
+@lru_cache(maxsize=None)
+def _font(size):
+    from PIL import ImageFont
+
+    try:
+        return ImageFont.truetype("DejaVuSans.ttf", size)
+    except OSError:
+        return ImageFont.load_default(size=size)
+
+
+def _fit(draw, text, font, width):
+    if draw.textlength(text, font=font) <= width:
+        return text
+    while text and draw.textlength(text + "...", font=font) > width:
+        text = text[:-1]
+    return text + "..."
+
+
+def _wrap(draw, text, font, width, lines=2):
+    """Greedy word wrap to at most `lines` lines, the last one truncated"""
+    wrapped, words = [], text.split()
+    while words and len(wrapped) < lines - 1:
+        line = words.pop(0)
+        while words and draw.textlength(f"{line} {words[0]}", font=font) <= width:
+            line = f"{line} {words.pop(0)}"
+        wrapped.append(line)
+    if words:
+        wrapped.append(" ".join(words))
+    return [_fit(draw, line, font, width) for line in wrapped]
+
+
+def _qr_image(card, size):
+    import qrcode
+    from PIL import Image
+
+    if card["qr_png"]:
+        image = Image.open(io.BytesIO(card["qr_png"]))
+    else:
+        qr = qrcode.QRCode(box_size=10, border=2)
+        qr.add_data(card["url"])
+        qr.make(fit=True)
+        image = qr.make_image(fill_color="black", back_color="white").get_image()
+    return image.convert("L").resize((size, size), Image.NEAREST)
+
+
+def render_card(card):
+    from PIL import Image, ImageDraw
+
+    width, height = CARD_SIZE
+    image = Image.new("RGB", CARD_SIZE, "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, width - 1, height - 1), outline=(180, 180, 180), width=3)
+
+    qr_size = 440
+    image.paste(_qr_image(card, qr_size), (30, (height - qr_size) // 2))
+
+    text_left = qr_size + 60
+    text_width = width - text_left - 30
+    draw.text((text_left, 60), "CareCode", font=_font(40), fill=(25, 135, 84))
+    y = 170
+    for line in _wrap(draw, card["name"], _font(44), text_width):
+        draw.text((text_left, y), line, font=_font(44), fill="black")
+        y += 56
+    draw.text((text_left, y + 20), _fit(draw, card["identifier"], _font(32), text_width), font=_font(32),
+              fill=(80, 80, 80))
+    draw.text((text_left, height - 90), _fit(draw, "Scan for emergency details", _font(26), text_width),
+              font=_font(26), fill=(120, 120, 120))
+    return image
+
+
+def render_sheet(cards, fmt="png"):
+    """One page of up to CARDS_PER_SHEET cards, encoded as PNG or PDF bytes"""
+    from PIL import Image
+
+    page = Image.new("RGB", PAGE_SIZE, "white")
+    margin_x = (PAGE_SIZE[0] - COLUMNS * CARD_SIZE[0]) // (COLUMNS + 1)
+    margin_y = (PAGE_SIZE[1] - ROWS * CARD_SIZE[1]) // (ROWS + 1)
+    for i, card in enumerate(cards):
+        row, column = divmod(i, COLUMNS)
+        page.paste(render_card(card), (
+            margin_x + column * (CARD_SIZE[0] + margin_x),
+            margin_y + row * (CARD_SIZE[1] + margin_y),
+        ))
+    buffer = io.BytesIO()
+    if fmt == "pdf":
+        page.save(buffer, format="PDF", resolution=DPI)
+    else:
+        page.save(buffer, format="PNG", dpi=(DPI, DPI))
+    return buffer.getvalue()
+
+
+def get_pool(max_workers=None):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=max_workers or os.cpu_count(),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+class _ZipBuffer(io.RawIOBase):
+    """Write-only, non-seekable sink; zipfile then writes data descriptors"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+def iter_sheet_archive(cards, fmt="png", pool=None, window=None):
+    """Yield a zip archive of card sheets as it is built.
+
+    At most `window` sheets are rendering or waiting to be written at a
+    time, so memory stays flat however many patients are printed.
+    """
+    pool = pool or get_pool()
+    window = window or 2 * (os.cpu_count() or 1)
+    sheets = iter([cards[i:i + CARDS_PER_SHEET] for i in range(0, len(cards), CARDS_PER_SHEET)])
+    pending = deque()
+    sink = _ZipBuffer()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as archive:  # PNG/PDF are compressed already
+        number = 0
+        while True:
+            for sheet in sheets:
+                pending.append(pool.submit(render_sheet, sheet, fmt))
+                if len(pending) >= window:
+                    break
+            if not pending:
+                break
+            number += 1
+            archive.writestr(f"qr_cards_{number:04d}.{fmt}", pending.popleft().result())
+            yield sink.drain()
+    yield sink.drain()
@@ -0,0 +1,122 @@
+"""Indexed full-text search over medical encounters with keyset cursors.
+
+On MySQL, keyword and name filters use the FULLTEXT indexes declared on
+``medical_encounters``, ``patients`` and ``doctors`` (MATCH ... AGAINST in
+boolean mode). Other databases fall back to per-word ILIKE, which is only
+meant for development and edge installs.
+"""
+import base64
+import json
+import re
+from datetime import date
+
+from sqlalchemy import and_, or_, literal, select
+from sqlalchemy.dialects.mysql import match
+
+from models import db, MedicalEncounter, Patient, Doctor
+
+PAGE_SIZE = 50
+# InnoDB ignores shorter tokens (innodb_ft_min_token_size)
+MIN_FULLTEXT_TOKEN = 3
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _tokens(text):
+    return _TOKEN_RE.findall(text or "")
+
+
+def _use_fulltext(tokens):
+    return (
+        db.engine.dialect.name == "mysql"
+        and tokens
+        and all(len(t) >= MIN_FULLTEXT_TOKEN for t in tokens)
+    )
+
+
+def _boolean_query(tokens):
+    """Require every word, matching word prefixes: 'chest pa' -> '+chest* +pa*'"""
+    return " ".join(f"+{t}*" for t in tokens)
+
+
+def text_filter(columns, text):
+    """Filter clause and relevance score for words across columns"""
+    tokens = _tokens(text)
+    if _use_fulltext(tokens):
+        expr = match(*columns, against=_boolean_query(tokens)).in_boolean_mode()
+        return expr, expr
+    clause = and_(*[or_(*[c.ilike(f"%{t}%") for c in columns]) for t in tokens])
+    return clause, literal(0.0)
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Decode a cursor, returning None for anything malformed"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        score, treatment_date, encounter_id = json.loads(base64.urlsafe_b64decode(padded))
+        return float(score), date.fromisoformat(treatment_date), int(encounter_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def search_encounters(query, patient_name=None, doctor_name=None, keyword=None,
+                      date_from=None, date_to=None, cursor=None, limit=PAGE_SIZE):
+    """Apply search filters to an already access-scoped encounter query.
+
+    Results are ranked by relevance (when a keyword is given), then newest
+    treatment date, then id, and paged with a keyset cursor over exactly that
+    ordering so pages stay stable while new encounters arrive. Returns
+    (encounters, next_cursor).
+    """
+    # Name filters resolve to id sets through the indexed name columns
+    if patient_name:
+        clause, _ = text_filter([Patient.full_name], patient_name)
+        query = query.filter(MedicalEncounter.patient_id.in_(select(Patient.id).where(clause)))
+    if doctor_name:
+        clause, _ = text_filter([Doctor.full_name], doctor_name)
+        query = query.filter(MedicalEncounter.doctor_id.in_(select(Doctor.id).where(clause)))
+
+    if date_from:
+        query = query.filter(MedicalEncounter.treatment_date >= date_from)
+    if date_to:
+        query = query.filter(MedicalEncounter.treatment_date <= date_to)
+
+    score = literal(0.0)
+    if keyword and _tokens(keyword):
+        clause, score = text_filter(
+            [MedicalEncounter.diagnosis_text, MedicalEncounter.suggestions, MedicalEncounter.diagnosis_code],
+            keyword,
+        )
+        query = query.filter(clause)
+
+    position = decode_cursor(cursor)
+    if position:
+        last_score, last_date, last_id = position
+        query = query.filter(or_(
+            score < last_score,
+            and_(score == last_score, MedicalEncounter.treatment_date < last_date),
+            and_(score == last_score, MedicalEncounter.treatment_date == last_date,
+                 MedicalEncounter.id < last_id),
+        ))
+
+    rows = (
+        query.add_columns(score.label("score"))
+        .order_by(score.desc(), MedicalEncounter.treatment_date.desc(), MedicalEncounter.id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last, last_score = rows[-1]
+        next_cursor = encode_cursor([last_score, last.treatment_date.isoformat(), last.id])
+
+    return [encounter for encounter, _ in rows], next_cursor
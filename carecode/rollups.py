@@ -0,0 +1,237 @@
+"""Per-hospital reporting rollups for ministry dashboards.
+
+Daily counts of newly registered patients, newly added doctors and
+encounters (by treatment date) are computed with a single UNION ALL /
+GROUP BY pass over the three source tables and stored in
+``hospital_rollups``; weekly and monthly rows are derived from the daily
+ones. Refreshes are incremental: only the hospitals and days touched by rows
+whose ``updated_at`` moved past the stored watermark are recomputed.
+"""
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import and_, func, literal, or_, select, union_all
+
+from models import db, Hospital, HospitalRollup, RollupWatermark, Patient, Doctor, MedicalEncounter
+
+WATERMARK_NAME = "hospital_rollups"
+# Re-read a little before the watermark to catch transactions that were in
+# flight during the previous refresh; recomputing a day is idempotent.
+WATERMARK_OVERLAP = timedelta(minutes=5)
+INSERT_BATCH_SIZE = 1000
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value
+
+
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def _dirty_cells(since):
+    """Hospitals and day range touched by rows updated since the watermark"""
+    statement = union_all(
+        select(Patient.created_by_hospital.label("hospital_id"), func.date(Patient.created_at).label("day"))
+        .where(Patient.updated_at >= since),
+        select(Doctor.hospital_id, func.date(Doctor.created_at))
+        .where(Doctor.updated_at >= since),
+        select(MedicalEncounter.hospital_id, MedicalEncounter.treatment_date)
+        .where(MedicalEncounter.updated_at >= since),
+    )
+    hospital_ids, days = set(), set()
+    for hospital_id, day in db.session.execute(statement):
+        if day is not None:
+            hospital_ids.add(hospital_id)
+            days.add(_as_date(day))
+    if not days:
+        return set(), None, None
+    return hospital_ids, min(days), max(days)
+
+
+def _day_counts(hospital_ids=None, start=None, end=None):
+    """One grouped pass: {(hospital_id, day): (patients, doctors, encounters)}"""
+    patients = select(
+        Patient.created_by_hospital.label("hospital_id"),
+        func.date(Patient.created_at).label("day"),
+        literal(1).label("patients"), literal(0).label("doctors"), literal(0).label("encounters"),
+    )
+    doctors = select(
+        Doctor.hospital_id, func.date(Doctor.created_at),
+        literal(0), literal(1), literal(0),
+    )
+    encounters = select(
+        MedicalEncounter.hospital_id, MedicalEncounter.treatment_date,
+        literal(0), literal(0), literal(1),
+    )
+
+    if hospital_ids is not None:
+        patients = patients.where(Patient.created_by_hospital.in_(hospital_ids))
+        doctors = doctors.where(Doctor.hospital_id.in_(hospital_ids))
+        encounters = encounters.where(MedicalEncounter.hospital_id.in_(hospital_ids))
+    if start is not None:
+        start_at, end_at = datetime.combine(start, datetime.min.time()), datetime.combine(end + timedelta(days=1), datetime.min.time())
+        patients = patients.where(Patient.created_at >= start_at, Patient.created_at < end_at)
+        doctors = doctors.where(Doctor.created_at >= start_at, Doctor.created_at < end_at)
+        encounters = encounters.where(MedicalEncounter.treatment_date.between(start, end))
+
+    rows = union_all(patients, doctors, encounters).subquery()
+    statement = (
+        select(
+            rows.c.hospital_id, rows.c.day,
+            func.sum(rows.c.patients), func.sum(rows.c.doctors), func.sum(rows.c.encounters),
+        )
+        .group_by(rows.c.hospital_id, rows.c.day)
+    )
+    return {
+        (hospital_id, _as_date(day)): (int(p or 0), int(d or 0), int(e or 0))
+        for hospital_id, day, p, d, e in db.session.execute(statement)
+        if day is not None
+    }
+
+
+def _insert_rows(rows):
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        db.session.execute(db.insert(HospitalRollup), rows[start:start + INSERT_BATCH_SIZE])
+
+
+def _rebuild_periods(hospital_ids, start, end, refreshed_at):
+    """Re-derive week and month rows covering [start, end] from the day rows"""
+    # A month can begin mid-week, so each period type has its own first start;
+    # earlier periods are left alone, as only part of their days are read.
+    first = {"week": week_start(start), "month": month_start(start)}
+    query = HospitalRollup.query.filter(
+        or_(*(
+            and_(HospitalRollup.period == period, HospitalRollup.period_start >= period_start)
+            for period, period_start in first.items()
+        )),
+        HospitalRollup.period_start <= end,
+    )
+    if hospital_ids is not None:
+        query = query.filter(HospitalRollup.hospital_id.in_(hospital_ids))
+    query.delete(synchronize_session=False)
+
+    day_rows = db.session.query(
+        HospitalRollup.hospital_id, HospitalRollup.period_start,
+        HospitalRollup.patients, HospitalRollup.doctors, HospitalRollup.encounters,
+    ).filter(
+        HospitalRollup.period == "day",
+        HospitalRollup.period_start >= min(first.values()),
+    )
+    if hospital_ids is not None:
+        day_rows = day_rows.filter(HospitalRollup.hospital_id.in_(hospital_ids))
+
+    totals = {}
+    for hospital_id, day, p, d, e in day_rows:
+        for period, period_start in (("week", week_start(day)), ("month", month_start(day))):
+            if not first[period] <= period_start <= end:
+                continue
+            cell = totals.setdefault((hospital_id, period, period_start), [0, 0, 0])
+            cell[0] += p
+            cell[1] += d
+            cell[2] += e
+
+    _insert_rows([
+        {
+            "hospital_id": hospital_id, "period": period, "period_start": period_start,
+            "patients": p, "doctors": d, "encounters": e, "refreshed_at": refreshed_at,
+        }
+        for (hospital_id, period, period_start), (p, d, e) in totals.items()
+    ])
+
+
+def refresh_rollups(full=False):
+    """Bring hospital_rollups up to date; returns the number of day cells written"""
+    started_at = datetime.utcnow()
+    watermark = db.session.get(RollupWatermark, WATERMARK_NAME)
+
+    if full or watermark is None:
+        hospital_ids = start = end = None
+        HospitalRollup.query.delete(synchronize_session=False)
+    else:
+        hospital_ids, start, end = _dirty_cells(watermark.value - WATERMARK_OVERLAP)
+        if start is None:
+            watermark.value = started_at
+            db.session.commit()
+            return 0
+        HospitalRollup.query.filter(
+            HospitalRollup.period == "day",
+            HospitalRollup.hospital_id.in_(hospital_ids),
+            HospitalRollup.period_start.between(start, end),
+        ).delete(synchronize_session=False)
+
+    counts = _day_counts(hospital_ids, start, end)
+    _insert_rows([
+        {
+            "hospital_id": hospital_id, "period": "day", "period_start": day,
+            "patients": p, "doctors": d, "encounters": e, "refreshed_at": started_at,
+        }
+        for (hospital_id, day), (p, d, e) in counts.items()
+    ])
+
+    if counts or start is not None:
+        days = [day for _, day in counts]
+        _rebuild_periods(
+            hospital_ids,
+            start or min(days),
+            end or max(days),
+            started_at,
+        )
+
+    if watermark is None:
+        watermark = RollupWatermark(name=WATERMARK_NAME)
+        db.session.add(watermark)
+    watermark.value = started_at
+    db.session.commit()
+    return len(counts)
+
+
+def ministry_summary(ministry_id, months=12):
+    """Totals, per-hospital totals and monthly encounter series from the rollups"""
+    in_ministry = select(Hospital.id).where(Hospital.ministry_id == ministry_id)
+
+    per_hospital = {
+        hospital_id: {"patients": int(p or 0), "doctors": int(d or 0), "encounters": int(e or 0)}
+        for hospital_id, p, d, e in db.session.query(
+            HospitalRollup.hospital_id,
+            func.sum(HospitalRollup.patients),
+            func.sum(HospitalRollup.doctors),
+            func.sum(HospitalRollup.encounters),
+        )
+        .filter(HospitalRollup.period == "month", HospitalRollup.hospital_id.in_(in_ministry))
+        .group_by(HospitalRollup.hospital_id)
+    }
+
+    first_month = month_start(date.today())
+    for _ in range(months - 1):
+        first_month = month_start(first_month - timedelta(days=1))
+    monthly_stats = [
+        {"year": _as_date(month).year, "month": _as_date(month).month, "count": int(count or 0)}
+        for month, count in db.session.query(
+            HospitalRollup.period_start, func.sum(HospitalRollup.encounters)
+        )
+        .filter(
+            HospitalRollup.period == "month",
+            HospitalRollup.period_start >= first_month,
+            HospitalRollup.hospital_id.in_(in_ministry),
+        )
+        .group_by(HospitalRollup.period_start)
+        .order_by(HospitalRollup.period_start)
+    ]
+
+    watermark = db.session.get(RollupWatermark, WATERMARK_NAME)
+    return {
+        "hospital_stats": per_hospital,
+        "total_patients": sum(h["patients"] for h in per_hospital.values()),
+        "total_doctors": sum(h["doctors"] for h in per_hospital.values()),
+        "total_encounters": sum(h["encounters"] for h in per_hospital.values()),
+        "monthly_stats": monthly_stats,
+        "rollups_refreshed_at": watermark.value if watermark else None,
+    }
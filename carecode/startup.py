@@ -0,0 +1,96 @@
+"""Worker startup: fork safety and warmup before the first request.
+
+Servers import ``app`` once per worker, or once in a master process that
+then forks its workers (gunicorn ``--preload``). Importing stays cheap:
+qrcode and Pillow are only loaded when a QR code is drawn, and building the
+app does not connect to the database.
+
+A forked child must not reuse connections its parent opened, or two
+processes end up reading from one socket. ``init_startup()`` registers an
+after-fork hook that drops the child's inherited pool without closing the
+parent's sockets (``Engine.dispose(close=False)``).
+
+WARMUP (CARECODE_WARMUP, comma separated) does some of the first requests'
+work ahead of time:
+
+``templates``  compile every template into the Jinja cache
+``pool``       open the pool's connections
+``reference``  open the ICD-10 catalog, load the analytics snapshot and
+               resolve the password hash method
+``indexes``    build the cohort and surveillance indexes (reads every patient)
+
+Warmup runs when create_app() finishes. Under ``--preload`` it runs once in
+the master. The templates, catalogs and indexes it loads are then shared
+with the workers copy-on-write, and each worker reopens its pool in the
+background after the fork.
+"""
+import os
+import threading
+import time
+
+from analytics import load_snapshot, snapshot_directory
+from credentials import hash_method
+from icd10 import get_catalog
+from models import db
+
+STEPS = ("templates", "pool", "reference", "indexes")
+
+
+def _templates(app):
+    for name in app.jinja_env.list_templates(filter_func=lambda n: n.endswith(".html")):
+        app.jinja_env.get_template(name)
+
+
+def _pool(app):
+    for engine in db.engines.values():
+        size = engine.pool.size() if hasattr(engine.pool, "size") else 1
+        connections = [engine.connect() for _ in range(size)]
+        for connection in connections:
+            connection.close()
+
+
+def _reference(app):
+    get_catalog()
+    load_snapshot(snapshot_directory(app.instance_path))
+    hash_method()
+
+
+def _indexes(app):
+    app.extensions["cohorts"].ensure_current()
+    app.extensions["surveillance"].ensure_current()
+
+
+_STEP_FUNCTIONS = {"templates": _templates, "pool": _pool, "reference": _reference, "indexes": _indexes}
+
+
+def warmup(app, steps=None):
+    """Run warmup steps in order; returns seconds taken per step"""
+    timings = {}
+    with app.app_context():
+        for step in steps if steps is not None else app.config["WARMUP"]:
+            started = time.perf_counter()
+            _STEP_FUNCTIONS[step](app)
+            timings[step] = time.perf_counter() - started
+            app.logger.info("Warmup %s took %.0f ms", step, timings[step] * 1000)
+    return timings
+
+
+def init_startup(app):
+    """Make the app safe to fork and run WARMUP; call last in create_app()"""
+    unknown = [step for step in app.config["WARMUP"] if step not in STEPS]
+    if unknown:
+        raise ValueError(f"Unknown WARMUP steps {unknown}; expected some of {STEPS}")
+
+    with app.app_context():
+        engines = list(db.engines.values())
+
+    def after_fork():
+        for engine in engines:
+            engine.dispose(close=False)
+        if "pool" in app.config["WARMUP"]:
+            threading.Thread(target=warmup, args=(app, ("pool",)), name="pool-warmup", daemon=True).start()
+
+    os.register_at_fork(after_in_child=after_fork)
+    state = {"warmup": warmup(app) if app.config["WARMUP"] else {}}
+    app.extensions["startup"] = state
+    return state
@@ -0,0 +1,99 @@
+// Refresh logs function
+function refreshLogs() {
+    window.location.reload();
+}
+
+// Auto-refresh every 5 minutes
+setInterval(function() {
+    if (document.visibilityState === 'visible') {
+        refreshLogs();
+    }
+}, 300000);
+
+// Date validation
+const dateFrom = document.querySelector('input[name="date_from"]');
+const dateTo = document.querySelector('input[name="date_to"]');
+
+if (dateFrom && dateTo) {
+    dateFrom.addEventListener('change', function() {
+        dateTo.min = this.value;
+    });
+
+    dateTo.addEventListener('change', function() {
+        dateFrom.max = this.value;
+    });
+}
+
+// Collapse/expand all details
+document.addEventListener('DOMContentLoaded', function() {
+    // Add expand/collapse all buttons
+    const cardHeader = document.querySelector('.audit-card .card-header');
+    if (cardHeader && document.querySelectorAll('.details-section').length > 0) {
+        const buttonGroup = document.createElement('div');
+        buttonGroup.className = 'btn-group btn-group-sm ms-2';
+        buttonGroup.innerHTML = `
+            <button type="button" class="btn btn-outline-secondary" onclick="expandAllDetails()">
+                <i class="fas fa-expand-arrows-alt"></i> Expand All
+            </button>
+            <button type="button" class="btn btn-outline-secondary" onclick="collapseAllDetails()">
+                <i class="fas fa-compress-arrows-alt"></i> Collapse All
+            </button>
+        `;
+        cardHeader.appendChild(buttonGroup);
+    }
+});
+
+function expandAllDetails() {
+    document.querySelectorAll('.collapse').forEach(function(element) {
+        if (!element.classList.contains('show')) {
+            new bootstrap.Collapse(element, {show: true});
+        }
+    });
+}
+
+function collapseAllDetails() {
+    document.querySelectorAll('.collapse.show').forEach(function(element) {
+        new bootstrap.Collapse(element, {hide: true});
+    });
+}
+
+// Highlight recent logs (within last hour)
+document.addEventListener('DOMContentLoaded', function() {
+    const now = new Date();
+    const oneHourAgo = new Date(now.getTime() - 60 * 60 * 1000);
+
+    document.querySelectorAll('.log-entry').forEach(function(logEntry) {
+        const timestampText = logEntry.querySelector('.timestamp').textContent.trim();
+
+        // Extracting date and time from the string
+        const [datePart, timePart] = timestampText.split(' ').slice(1);
+
+        // Creating a valid Date object
+        const logTime = new Date(`${datePart}T${timePart}`);
+
+        if (logTime > oneHourAgo) {
+            logEntry.style.border = '2px solid #28a745';
+            logEntry.classList.add('border-success');
+        }
+    });
+});
+
+// Filter form enhancement
+document.getElementById('filterForm').addEventListener('submit', function(e) {
+    // Remove empty parameters
+    const formData = new FormData(this);
+    const params = new URLSearchParams();
+
+    for (let [key, value] of formData.entries()) {
+        if (value.trim()) {
+            params.append(key, value);
+        }
+    }
+
+    if (params.toString()) {
+        window.location.href = this.action + '?' + params.toString();
+    } else {
+        window.location.href = this.action;
+    }
+    e.preventDefault();
+});
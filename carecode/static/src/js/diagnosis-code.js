@@ -0,0 +1,29 @@
+// ICD-10 suggestions for the encounter form's diagnosis code
+(function () {
+  const options = document.getElementById('icd10-options');
+  if (!options) return;
+  const input = document.querySelector('input[list="icd10-options"]');
+  let timer = null;
+  let lastTerm = '';
+
+  input.addEventListener('input', function () {
+    clearTimeout(timer);
+    const term = input.value.trim();
+    if (term.length < 2 || term === lastTerm) return;
+    timer = setTimeout(function () {
+      lastTerm = term;
+      fetch(options.dataset.url + '?q=' + encodeURIComponent(term))
+        .then(function (response) { return response.json(); })
+        .then(function (results) {
+          options.innerHTML = '';
+          results.forEach(function (entry) {
+            const option = document.createElement('option');
+            option.value = entry.code;
+            option.label = entry.code + ' - ' + entry.description;
+            option.textContent = entry.description;
+            options.appendChild(option);
+          });
+        });
+    }, 150);
+  });
+})();
@@ -0,0 +1,36 @@
+// Dashboard counters and recent encounters, kept current over server-sent events
+(function () {
+    const panel = document.getElementById('live-activity');
+    if (!panel || !panel.dataset.eventsUrl || !window.EventSource) return;
+    const list = document.getElementById('recent-encounters');
+    const status = document.getElementById('live-status');
+    const source = new EventSource(panel.dataset.eventsUrl);
+
+    source.addEventListener('counters', (e) => {
+        Object.entries(JSON.parse(e.data)).forEach(([key, delta]) => {
+            const el = panel.querySelector(`[data-counter="${key}"]`);
+            if (el) el.textContent = parseInt(el.textContent, 10) + delta;
+        });
+    });
+    source.addEventListener('encounter', (e) => {
+        const enc = JSON.parse(e.data);
+        const item = document.createElement('li');
+        item.className = 'list-group-item d-flex justify-content-between';
+        const link = document.createElement('a');
+        link.href = `/patients/${enc.patient_id}`;
+        link.textContent = enc.patient;
+        const diagnosis = document.createElement('span');
+        diagnosis.className = 'text-muted';
+        diagnosis.textContent = (enc.diagnosis || '').slice(0, 50);
+        const when = document.createElement('small');
+        when.textContent = enc.date;
+        item.append(link, diagnosis, when);
+        list.querySelector('[data-empty]')?.remove();
+        list.prepend(item);
+        while (list.children.length > 5) list.lastElementChild.remove();
+    });
+    // Events were dropped while this tab was too slow; start again from the server
+    source.addEventListener('resync', () => window.location.reload());
+    source.onopen = () => { status.textContent = 'Live'; };
+    source.onerror = () => { status.textContent = 'Reconnecting...'; };
+})();
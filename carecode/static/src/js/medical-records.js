@@ -0,0 +1,38 @@
+// Auto-focus on first search field
+document.addEventListener('DOMContentLoaded', function() {
+    const firstInput = document.querySelector('#patient_name');
+    if (firstInput && !firstInput.value) {
+        firstInput.focus();
+    }
+});
+
+// Date validation
+const dateFrom = document.querySelector('#date_from');
+const dateTo = document.querySelector('#date_to');
+
+if (dateFrom && dateTo) {
+    dateFrom.addEventListener('change', function() {
+        dateTo.min = this.value;
+    });
+
+    dateTo.addEventListener('change', function() {
+        dateFrom.max = this.value;
+    });
+}
+
+// Search form enhancement
+const searchForm = document.querySelector('form');
+searchForm.addEventListener('submit', function(e) {
+    // Check if at least one search field is filled
+    const fields = ['patient_name', 'doctor_name', 'diagnosis_keyword', 'date_from', 'date_to'];
+    const hasValue = fields.some(field => {
+        const input = document.querySelector(`#${field}`);
+        return input && input.value.trim();
+    });
+
+    if (!hasValue) {
+        e.preventDefault();
+        alert('Please enter at least one search criteria.');
+        return false;
+    }
+});
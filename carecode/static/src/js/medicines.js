@@ -0,0 +1,39 @@
+// Add and remove prescribed medicine rows on the encounter forms
+(function () {
+  const container = document.getElementById('medicine-rows');
+  if (!container) return;
+
+  // Keep medicines-N-field names contiguous so WTForms FieldList reads every row
+  function renumber() {
+    container.querySelectorAll('.medicine-row').forEach(function (row, index) {
+      row.querySelectorAll('input, label').forEach(function (el) {
+        ['name', 'id', 'for'].forEach(function (attr) {
+          const value = el.getAttribute(attr);
+          if (value) {
+            el.setAttribute(attr, value.replace(/medicines-\d+-/, 'medicines-' + index + '-'));
+          }
+        });
+      });
+    });
+  }
+
+  document.getElementById('add-medicine').addEventListener('click', function () {
+    const rows = container.querySelectorAll('.medicine-row');
+    const clone = rows[rows.length - 1].cloneNode(true);
+    clone.querySelectorAll('input').forEach(function (input) { input.value = ''; });
+    container.appendChild(clone);
+    renumber();
+  });
+
+  container.addEventListener('click', function (e) {
+    if (!e.target.classList.contains('remove-medicine')) return;
+    const rows = container.querySelectorAll('.medicine-row');
+    const row = e.target.closest('.medicine-row');
+    if (rows.length > 1) {
+      row.remove();
+      renumber();
+    } else {
+      row.querySelectorAll('input').forEach(function (input) { input.value = ''; });
+    }
+  });
+})();
@@ -0,0 +1,124 @@
+// Show toast notifications
+function showToast(message, type = 'success') {
+    const toast = document.getElementById('notification-toast');
+    const toastMessage = document.getElementById('toast-message');
+
+    if (toast && toastMessage) {
+        toastMessage.textContent = message;
+
+        // Set toast color based on type
+        toast.className = `toast align-items-center text-white border-0 ${type === 'error' ? 'bg-danger' : 'bg-success'}`;
+
+        // Check if Bootstrap is available
+        if (typeof bootstrap !== 'undefined') {
+            const bsToast = new bootstrap.Toast(toast);
+            bsToast.show();
+        } else {
+            // Fallback: show alert if Bootstrap toast is not available
+            alert(message);
+        }
+    }
+}
+
+// Older encounters are fetched a page at a time from the timeline API
+const timelineMore = document.getElementById('timeline-more');
+if (timelineMore) {
+    timelineMore.addEventListener('click', () => {
+        timelineMore.disabled = true;
+        const url = `${timelineMore.dataset.url}?cursor=${encodeURIComponent(timelineMore.dataset.cursor)}`;
+        fetch(url, { credentials: 'same-origin' })
+            .then(response => response.json())
+            .then(page => {
+                const rows = document.getElementById('timeline-rows');
+                page.encounters.forEach(enc => {
+                    const row = rows.insertRow();
+                    const diagnosis = enc.diagnosis || '';
+                    row.insertCell().textContent = enc.date;
+                    row.insertCell().textContent = enc.doctor;
+                    row.insertCell().textContent = diagnosis.length > 50 ? diagnosis.slice(0, 50) + '...' : diagnosis;
+                    const actions = row.insertCell();
+                    if (enc.edit_url) {
+                        const link = document.createElement('a');
+                        link.href = enc.edit_url;
+                        link.className = 'btn btn-sm btn-outline-primary';
+                        link.textContent = 'Edit';
+                        actions.appendChild(link);
+                    }
+                });
+                if (page.next_cursor) {
+                    timelineMore.dataset.cursor = page.next_cursor;
+                    timelineMore.disabled = false;
+                } else {
+                    timelineMore.remove();
+                }
+            })
+            .catch(() => {
+                timelineMore.disabled = false;
+                showToast('Could not load older encounters. Please try again.', 'error');
+            });
+    });
+}
+
+// Copy patient's QR token to clipboard
+function copyPatientQRToken(qrToken) {
+    try {
+        if (navigator.clipboard) {
+            navigator.clipboard.writeText(qrToken).then(() => {
+                showToast('Patient QR token copied to clipboard!');
+            }).catch(() => {
+                fallbackCopyTextToClipboard(qrToken);
+            });
+        } else {
+            fallbackCopyTextToClipboard(qrToken);
+        }
+    } catch (error) {
+        console.error('Copy error:', error);
+        showToast('Failed to copy QR token. Please try again.', 'error');
+    }
+}
+
+// Copy patient's QR URL to clipboard
+function copyPatientQRUrl(qrToken) {
+    try {
+        const baseUrl = window.location.origin;
+        const qrUrl = `${baseUrl}/patient/qr/${qrToken}`;
+
+        if (navigator.clipboard) {
+            navigator.clipboard.writeText(qrUrl).then(() => {
+                showToast('Patient QR link copied to clipboard!');
+            }).catch(() => {
+                fallbackCopyTextToClipboard(qrUrl);
+            });
+        } else {
+            fallbackCopyTextToClipboard(qrUrl);
+        }
+    } catch (error) {
+        console.error('Copy error:', error);
+        showToast('Failed to copy QR link. Please try again.', 'error');
+    }
+}
+
+// Fallback copy function for older browsers
+function fallbackCopyTextToClipboard(text) {
+    const textArea = document.createElement('textarea');
+    textArea.value = text;
+    textArea.style.position = 'fixed';
+    textArea.style.left = '-999999px';
+    textArea.style.top = '-999999px';
+    document.body.appendChild(textArea);
+    textArea.focus();
+    textArea.select();
+
+    try {
+        const result = document.execCommand('copy');
+        document.body.removeChild(textArea);
+        if (result) {
+            showToast('Copied to clipboard!');
+        } else {
+            showToast('Failed to copy. Please copy manually.', 'error');
+        }
+    } catch (error) {
+        document.body.removeChild(textArea);
+        showToast('Failed to copy. Please copy manually.', 'error');
+    }
+}
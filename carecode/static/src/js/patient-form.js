@@ -0,0 +1,252 @@
+document.addEventListener('DOMContentLoaded', function() {
+  const form = document.querySelector('#patient-form');
+  const submitBtn = form.querySelector('input[type="submit"]');
+  const phoneFields = ['phone_primary', 'phone_secondary', 'guardian_number'];
+
+  // Phone number formatting and validation
+  phoneFields.forEach(fieldName => {
+    const field = document.getElementById(fieldName) || document.querySelector(`input[name="${fieldName}"]`);
+    if (field) {
+      field.addEventListener('input', function(e) {
+        let value = e.target.value.replace(/\D/g, '');
+
+        // Format Sri Lankan phone numbers
+        if (value.startsWith('94')) {
+          value = '+' + value;
+        } else if (value.length === 9 && !value.startsWith('0')) {
+          value = '0' + value;
+        }
+
+        e.target.value = value;
+        validatePhoneField(e.target);
+      });
+
+      field.addEventListener('blur', function(e) {
+        validatePhoneField(e.target);
+      });
+    }
+  });
+
+  // Email validation
+  const emailField = document.getElementById('email') || document.querySelector('input[name="email"]');
+  if (emailField) {
+    emailField.addEventListener('blur', function(e) {
+      validateEmailField(e.target);
+    });
+  }
+
+  // Date of birth validation
+  const dobField = document.getElementById('date_of_birth') || document.querySelector('input[name="date_of_birth"]');
+  if (dobField) {
+    // Set max date to today
+    const today = new Date().toISOString().split('T')[0];
+    dobField.setAttribute('max', today);
+
+    dobField.addEventListener('change', function(e) {
+      validateDateField(e.target);
+    });
+  }
+
+  // Form validation feedback
+  form.addEventListener('submit', function(e) {
+    const requiredFields = document.querySelectorAll('input[required], select[required]');
+    let hasErrors = false;
+
+    // Clear previous validation states
+    document.querySelectorAll('.is-invalid, .is-valid').forEach(field => {
+      field.classList.remove('is-invalid', 'is-valid');
+    });
+
+    // Validate required fields
+    requiredFields.forEach(field => {
+      if (!field.value.trim()) {
+        field.classList.add('is-invalid');
+        hasErrors = true;
+      } else {
+        field.classList.add('is-valid');
+      }
+    });
+
+    // Additional field-specific validation
+    if (emailField && emailField.value && !validateEmail(emailField.value)) {
+      emailField.classList.add('is-invalid');
+      hasErrors = true;
+    }
+
+    phoneFields.forEach(fieldName => {
+      const field = document.getElementById(fieldName) || document.querySelector(`input[name="${fieldName}"]`);
+      if (field && field.value && !validatePhoneNumber(field.value)) {
+        field.classList.add('is-invalid');
+        hasErrors = true;
+      }
+    });
+
+    if (hasErrors) {
+      e.preventDefault();
+      showToast('Please correct the highlighted errors before submitting.', 'error');
+      return false;
+    }
+
+    // Show loading state
+    submitBtn.classList.add('btn-loading');
+    submitBtn.disabled = true;
+  });
+
+  // Real-time validation functions
+  function validatePhoneField(field) {
+    if (field.value && !validatePhoneNumber(field.value)) {
+      field.classList.add('is-invalid');
+      field.classList.remove('is-valid');
+    } else if (field.value) {
+      field.classList.add('is-valid');
+      field.classList.remove('is-invalid');
+    } else {
+      field.classList.remove('is-invalid', 'is-valid');
+    }
+  }
+
+  function validateEmailField(field) {
+    if (field.value && !validateEmail(field.value)) {
+      field.classList.add('is-invalid');
+      field.classList.remove('is-valid');
+    } else if (field.value) {
+      field.classList.add('is-valid');
+      field.classList.remove('is-invalid');
+    } else {
+      field.classList.remove('is-invalid', 'is-valid');
+    }
+  }
+
+  function validateDateField(field) {
+    const selectedDate = new Date(field.value);
+    const today = new Date();
+
+    if (selectedDate > today) {
+      field.classList.add('is-invalid');
+      field.classList.remove('is-valid');
+    } else if (field.value) {
+      field.classList.add('is-valid');
+      field.classList.remove('is-invalid');
+    }
+  }
+
+  function validatePhoneNumber(phone) {
+    // Sri Lankan phone number patterns
+    const patterns = [
+      /^0[0-9]{9}$/,           // Local format: 0771234567
+      /^\+94[0-9]{9}$/,        // International format: +94771234567
+      /^94[0-9]{9}$/           // International without +: 94771234567
+    ];
+
+    return patterns.some(pattern => pattern.test(phone));
+  }
+
+  function validateEmail(email) {
+    const emailPattern = /^[^\s@]+@[^\s@]+\.[^\s@]+$/;
+    return emailPattern.test(email);
+  }
+
+  function showToast(message, type = 'success') {
+    const toast = document.getElementById('notification-toast');
+    const toastMessage = document.getElementById('toast-message');
+
+    toastMessage.textContent = message;
+
+    // Set toast color based on type
+    toast.className = `toast align-items-center text-white border-0 ${type === 'error' ? 'bg-danger' : 'bg-success'}`;
+
+    const bsToast = new bootstrap.Toast(toast);
+    bsToast.show();
+  }
+});
+
+// QR Code related functions
+function downloadPatientQR(qrImageUrl, qrToken) {
+  try {
+    const link = document.createElement('a');
+    link.href = qrImageUrl;
+    link.download = `patient_qr_${qrToken}.png`;
+    document.body.appendChild(link);
+    link.click();
+    document.body.removeChild(link);
+
+    showToast('QR Code downloaded successfully!');
+  } catch (error) {
+    console.error('Download error:', error);
+    showToast('Failed to download QR code. Please try again.', 'error');
+  }
+}
+
+function copyPatientQRUrl(qrToken) {
+  try {
+    const baseUrl = window.location.origin;
+    const qrUrl = `${baseUrl}/patient/qr/${qrToken}`;
+
+    if (navigator.clipboard) {
+      navigator.clipboard.writeText(qrUrl).then(() => {
+        showToast('QR link copied to clipboard!');
+      }).catch(() => {
+        fallbackCopyTextToClipboard(qrUrl);
+      });
+    } else {
+      fallbackCopyTextToClipboard(qrUrl);
+    }
+  } catch (error) {
+    console.error('Copy error:', error);
+    showToast('Failed to copy QR link. Please try again.', 'error');
+  }
+}
+
+function fallbackCopyTextToClipboard(text) {
+  const textArea = document.createElement('textarea');
+  textArea.value = text;
+  textArea.style.position = 'fixed';
+  textArea.style.left = '-999999px';
+  textArea.style.top = '-999999px';
+  document.body.appendChild(textArea);
+  textArea.focus();
+  textArea.select();
+
+  try {
+    const result = document.execCommand('copy');
+    document.body.removeChild(textArea);
+    if (result) {
+      showToast('QR link copied to clipboard!');
+    } else {
+      showToast('Failed to copy QR link. Please copy manually.', 'error');
+    }
+  } catch (error) {
+    document.body.removeChild(textArea);
+    showToast('Failed to copy QR link. Please copy manually.', 'error');
+  }
+}
+
+function showToast(message, type = 'success') {
+  const toast = document.getElementById('notification-toast');
+  const toastMessage = document.getElementById('toast-message');
+
+  if (toast && toastMessage) {
+    toastMessage.textContent = message;
+
+    // Set toast color based on type
+    toast.className = `toast align-items-center text-white border-0 ${type === 'error' ? 'bg-danger' : 'bg-success'}`;
+
+    // Check if Bootstrap is available
+    if (typeof bootstrap !== 'undefined') {
+      const bsToast = new bootstrap.Toast(toast);
+      bsToast.show();
+    } else {
+      // Fallback: show alert if Bootstrap toast is not available
+      alert(message);
+    }
+  }
+}
+
+// Auto-hide success message after form submission
+document.addEventListener('DOMContentLoaded', function() {
+  const qrSuccessDisplay = document.getElementById('qr-success-display');
+  if (qrSuccessDisplay) {
+    // Auto-scroll to the success message
+    qrSuccessDisplay.scrollIntoView({ behavior: 'smooth', block: 'center' });
+  }
+});
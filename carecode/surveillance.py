@@ -0,0 +1,259 @@
+"""Near-real-time disease surveillance counts by region.
+
+Each worker keeps, in memory, the (diagnosis code, province, district, day)
+of every encounter treated within the rolling window, fed by commit events
+from ``model_events``. Encounters written by other processes are picked up
+by a cheap catch-up query on ``updated_at`` at most every
+``CATCH_UP_INTERVAL`` seconds, and state is checkpointed to a JSON file so a
+restarted worker only reads what changed since the checkpoint.
+"""
+import json
+import math
+import os
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import or_, select
+from sqlalchemy.orm import Session
+
+from model_events import subscribe
+from models import db, MedicalEncounter, Patient, Hospital
+
+WINDOW_DAYS = 90
+BASELINE_DAYS = 28
+SPIKE_THRESHOLD = 3.0  # standard deviations above the baseline mean
+SPIKE_MIN_COUNT = 5
+CATCH_UP_INTERVAL = 30
+CHECKPOINT_INTERVAL = 300
+WATERMARK_OVERLAP = timedelta(minutes=5)
+UNKNOWN = "Unknown"
+
+
+def _region(patient_address, hospital_address):
+    """(province, district) from the patient's address, else the hospital's"""
+    for address in (patient_address, hospital_address):
+        if isinstance(address, dict) and address.get("province"):
+            district = address.get("district") or address.get("city") or UNKNOWN
+            return address["province"].strip().title(), district.strip().title()
+    return UNKNOWN, UNKNOWN
+
+
+def _capture(encounter):
+    return {
+        "id": encounter.id,
+        "patient_id": encounter.patient_id,
+        "hospital_id": encounter.hospital_id,
+        "diagnosis_code": encounter.diagnosis_code,
+        "treatment_date": encounter.treatment_date,
+    }
+
+
+class SurveillanceAggregator:
+    def __init__(self, checkpoint_path, window_days=WINDOW_DAYS):
+        self.checkpoint_path = checkpoint_path
+        self.window_days = window_days
+        self._lock = threading.RLock()
+        self._encounters = {}  # id -> (code, province, district, day ordinal)
+        self._counts = Counter()  # (code, province, district, day ordinal) -> encounters
+        self._watermark = None
+        self._max_id = 0
+        self._loaded = False
+        self._caught_up_at = 0.0
+        self._checkpointed_at = time.monotonic()
+
+    # ---- state changes -----------------------------------------------------
+
+    def _window_start(self):
+        return (date.today() - timedelta(days=self.window_days)).toordinal()
+
+    def _put(self, encounter_id, key):
+        previous = self._encounters.get(encounter_id)
+        if previous == key:
+            return
+        if previous is not None:
+            self._drop(encounter_id)
+        if key[3] < self._window_start():
+            return
+        self._encounters[encounter_id] = key
+        self._counts[key] += 1
+        self._max_id = max(self._max_id, encounter_id)
+
+    def _drop(self, encounter_id):
+        key = self._encounters.pop(encounter_id, None)
+        if key is not None:
+            self._counts[key] -= 1
+            if not self._counts[key]:
+                del self._counts[key]
+
+    def _expire(self):
+        start = self._window_start()
+        for encounter_id, key in list(self._encounters.items()):
+            if key[3] < start:
+                self._drop(encounter_id)
+
+    @staticmethod
+    def _key(code, treatment_date, patient_address, hospital_address):
+        province, district = _region(patient_address, hospital_address)
+        return ((code or "").strip().upper() or UNKNOWN, province, district, treatment_date.toordinal())
+
+    def handle_events(self, events):
+        """model_events handler for committed MedicalEncounter writes"""
+        if not self._loaded:
+            return  # the initial catch-up will read these rows
+        deleted = [values["id"] for kind, values in events if kind == "delete"]
+        changed = [values for kind, values in events if kind != "delete"]
+
+        addresses = {}
+        if changed:
+            with Session(db.engine) as lookup:
+                rows = lookup.execute(
+                    select(Patient.id, Patient.address, Hospital.id, Hospital.address)
+                    .join(MedicalEncounter, MedicalEncounter.patient_id == Patient.id)
+                    .join(Hospital, Hospital.id == MedicalEncounter.hospital_id)
+                    .where(MedicalEncounter.id.in_([values["id"] for values in changed]))
+                )
+                for patient_id, patient_address, hospital_id, hospital_address in rows:
+                    addresses[(patient_id, hospital_id)] = (patient_address, hospital_address)
+
+        with self._lock:
+            for encounter_id in deleted:
+                self._drop(encounter_id)
+            for values in changed:
+                patient_address, hospital_address = addresses.get(
+                    (values["patient_id"], values["hospital_id"]), (None, None)
+                )
+                self._put(values["id"], self._key(
+                    values["diagnosis_code"], values["treatment_date"], patient_address, hospital_address
+                ))
+        self._maybe_checkpoint()
+
+    def catch_up(self):
+        """Read encounters changed since the watermark (or the whole window on first run)"""
+        started_at = datetime.utcnow()
+        statement = (
+            select(
+                MedicalEncounter.id, MedicalEncounter.diagnosis_code, MedicalEncounter.treatment_date,
+                Patient.address, Hospital.address,
+            )
+            .join(Patient, Patient.id == MedicalEncounter.patient_id)
+            .join(Hospital, Hospital.id == MedicalEncounter.hospital_id)
+            .where(MedicalEncounter.treatment_date >= date.fromordinal(self._window_start()))
+            .execution_options(yield_per=5000)
+        )
+        if self._watermark is not None:
+            statement = statement.where(or_(
+                MedicalEncounter.updated_at >= self._watermark - WATERMARK_OVERLAP,
+                MedicalEncounter.id > self._max_id,
+            ))
+
+        with Session(db.engine) as session:
+            for partition in session.execute(statement).partitions():
+                with self._lock:
+                    for encounter_id, code, treatment_date, patient_address, hospital_address in partition:
+                        self._put(encounter_id, self._key(code, treatment_date, patient_address, hospital_address))
+
+        with self._lock:
+            self._expire()
+            self._watermark = started_at
+            self._caught_up_at = time.monotonic()
+
+    def ensure_current(self):
+        """Load the checkpoint once, then catch up when the last one is stale"""
+        with self._lock:
+            if not self._loaded:
+                self.load_checkpoint()
+                self.catch_up()
+                self._loaded = True
+                self.save_checkpoint()
+            elif time.monotonic() - self._caught_up_at > CATCH_UP_INTERVAL:
+                self.catch_up()
+                self._maybe_checkpoint()
+
+    # ---- checkpoints -------------------------------------------------------
+
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+        with self._lock:
+            for encounter_id, key in state["encounters"].items():
+                self._put(int(encounter_id), tuple(key))
+            self._max_id = max(self._max_id, state["max_id"])
+            self._watermark = datetime.fromisoformat(state["watermark"])
+        return True
+
+    def save_checkpoint(self):
+        with self._lock:
+            if self._watermark is None:
+                return
+            state = {
+                "watermark": self._watermark.isoformat(),
+                "max_id": self._max_id,
+                "encounters": {str(k): list(v) for k, v in self._encounters.items()},
+            }
+            self._checkpointed_at = time.monotonic()
+        os.makedirs(os.path.dirname(self.checkpoint_path) or ".", exist_ok=True)
+        tmp_path = f"{self.checkpoint_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, separators=(",", ":"))
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _maybe_checkpoint(self):
+        if time.monotonic() - self._checkpointed_at > CHECKPOINT_INTERVAL:
+            self.save_checkpoint()
+
+    # ---- queries -----------------------------------------------------------
+
+    def daily_counts(self, days=14, level="province", province=None, code=None):
+        """{(code, region): {day ordinal: count}} for the last `days` days"""
+        first_day = date.today().toordinal() - days + 1
+        series = {}
+        with self._lock:
+            items = list(self._counts.items())
+        for (key_code, key_province, district, day), count in items:
+            if day < first_day:
+                continue
+            if province and key_province != province:
+                continue
+            if code and not key_code.startswith(code):
+                continue
+            region = key_province if level == "province" else f"{key_province} / {district}"
+            cells = series.setdefault((key_code, region), {})
+            cells[day] = cells.get(day, 0) + count
+        return series
+
+    def spikes(self, level="province", province=None, code=None,
+               threshold=SPIKE_THRESHOLD, min_count=SPIKE_MIN_COUNT, baseline_days=BASELINE_DAYS):
+        """Today's counts well above the trailing baseline for the same code and region"""
+        today = date.today().toordinal()
+        flagged = []
+        for (key_code, region), cells in self.daily_counts(baseline_days + 1, level, province, code).items():
+            current = cells.get(today, 0)
+            if current < min_count:
+                continue
+            baseline = [cells.get(day, 0) for day in range(today - baseline_days, today)]
+            mean = sum(baseline) / len(baseline)
+            std = math.sqrt(sum((c - mean) ** 2 for c in baseline) / len(baseline))
+            score = (current - mean) / max(std, 1.0)
+            if score >= threshold:
+                flagged.append({
+                    "diagnosis_code": key_code,
+                    "region": region,
+                    "count": current,
+                    "baseline_mean": round(mean, 2),
+                    "baseline_std": round(std, 2),
+                    "score": round(score, 2),
+                })
+        return sorted(flagged, key=lambda s: -s["score"])
+
+
+def init_surveillance(app):
+    """Create the app's aggregator and feed it MedicalEncounter commits"""
+    aggregator = SurveillanceAggregator(os.path.join(app.instance_path, "surveillance.json"))
+    app.extensions["surveillance"] = aggregator
+    subscribe(MedicalEncounter, aggregator.handle_events, capture=_capture)
+    return aggregator
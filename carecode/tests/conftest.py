@@ -0,0 +1,73 @@
+import os
+import sys
+import tempfile
+from datetime import date
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_db_dir = tempfile.mkdtemp(prefix="carecode-tests-")
+os.environ["CARECODE_DATABASE_URL"] = "sqlite:///" + os.path.join(_db_dir, "carecode.db")
+os.environ["CARECODE_WARMUP"] = ""
+# As deployed, behind one reverse proxy
+os.environ["CARECODE_PROXY_X_FOR"] = "1"
+
+from werkzeug.security import generate_password_hash
+
+from app import app as flask_app
+from models import db, Ministry, Hospital, HospitalAdmin, Doctor, Patient
+
+flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False, JOB_WORKERS=0)
+
+
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+    # Indexes and caches held in memory belong to the previous test's database
+    flask_app.extensions["cohorts"]._loaded = False
+    flask_app.extensions["cache"].backend.clear()
+    yield flask_app
+    with flask_app.app_context():
+        db.session.remove()
+
+
+@pytest.fixture
+def seed(app):
+    """Two hospitals of one ministry, each with an admin, a doctor and a patient"""
+    with app.app_context():
+        ministry = Ministry(name="Ministry of Health", admin_username="moh",
+                            password_hash=generate_password_hash("password123"))
+        db.session.add(ministry)
+        db.session.flush()
+        ids = {"ministry": ministry.id}
+        for n in (1, 2):
+            hospital = Hospital(name=f"Hospital {n}", code=f"H{n}", ministry_id=ministry.id,
+                                address={"city": "Colombo", "province": "Western"})
+            db.session.add(hospital)
+            db.session.flush()
+            admin = HospitalAdmin(hospital_id=hospital.id, username=f"admin{n}", full_name=f"Admin {n}",
+                                  password_hash=generate_password_hash("password123"))
+            doctor = Doctor(hospital_id=hospital.id, license_no=f"DOC00{n}", full_name=f"Doctor {n}",
+                            email=f"doctor{n}@example.com", password_hash=generate_password_hash("password123"))
+            patient = Patient(full_name=f"Patient {n}", date_of_birth=date(1990, n, 1), gender="male",
+                              blood_type="O+", address={"province": "Western"}, created_by_hospital=hospital.id,
+                              contact_info={"phone_primary": f"07700000{n}"})
+            db.session.add_all([admin, doctor, patient])
+            db.session.flush()
+            ids.update({f"hospital{n}": hospital.id, f"admin{n}": admin.id,
+                        f"doctor{n}": doctor.id, f"patient{n}": patient.id})
+        db.session.commit()
+        return ids
+
+
+def login(client, user_type, user_id, hospital_id=None, ministry_id=None):
+    with client.session_transaction() as session:
+        session.update(user_id=user_id, user_type=user_type, username="test")
+        if hospital_id is not None:
+            session["hospital_id"] = hospital_id
+        if ministry_id is not None:
+            session["ministry_id"] = ministry_id
+    return client
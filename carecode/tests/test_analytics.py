@@ -0,0 +1,28 @@
+import os
+from datetime import date
+
+from analytics import build_snapshot, load_snapshot
+from models import db, MedicalEncounter
+
+
+def add_encounter(seed):
+    db.session.add(MedicalEncounter(patient_id=seed["patient1"], doctor_id=seed["doctor1"],
+                                    hospital_id=seed["hospital1"], diagnosis_text="Dengue",
+                                    diagnosis_code="A90", treatment_date=date(2026, 10, 1)))
+    db.session.commit()
+
+
+def test_snapshot_is_replaced_as_one_file(app, seed, tmp_path):
+    directory = str(tmp_path)
+    with app.app_context():
+        add_encounter(seed)
+        build_snapshot(directory)
+        assert len(load_snapshot(directory)) == 1
+        assert os.listdir(directory) == ["encounters.npz"]
+
+        add_encounter(seed)
+        build_snapshot(directory)
+        snapshot = load_snapshot(directory)
+        assert len(snapshot) == 2 and snapshot.meta["rows"] == 2
+        assert snapshot.group_counts(["diagnosis_code"]) == [{"diagnosis_code": "A90", "count": 2}]
+        assert os.listdir(directory) == ["encounters.npz"]
@@ -0,0 +1,70 @@
+import sys
+
+from cohorts import Bitmap, iter_members
+from conftest import login
+
+
+def cohort(client, criteria, **options):
+    return client.post("/api/cohorts", json={"criteria": criteria, "members": True, **options})
+
+
+def test_admin_cannot_list_another_hospitals_patients(app, seed):
+    client = login(app.test_client(), "hospital_admin", seed["admin1"], hospital_id=seed["hospital1"])
+
+    for hospitals in ([seed["hospital2"]], [999]):
+        assert cohort(client, {"hospital_id": hospitals}).status_code == 403
+
+    response = cohort(client, {"hospital_id": [seed["hospital1"], seed["hospital2"]]})
+    assert response.status_code == 200
+    assert [m["id"] for m in response.get_json()["members"]] == [seed["patient1"]]
+
+
+def test_cohort_without_hospital_filter_stays_in_scope(app, seed):
+    client = login(app.test_client(), "hospital_admin", seed["admin2"], hospital_id=seed["hospital2"])
+
+    body = cohort(client, {"blood_type": ["O+"]}).get_json()
+    assert body["count"] == 1
+    assert [m["id"] for m in body["members"]] == [seed["patient2"]]
+
+
+def test_ministry_sees_all_its_hospitals(app, seed):
+    client = login(app.test_client(), "ministry", 1, ministry_id=seed["ministry"])
+
+    body = cohort(client, {}).get_json()
+    assert sorted(m["id"] for m in body["members"]) == [seed["patient1"], seed["patient2"]]
+
+
+def test_evaluate_scope_overrides_empty_criteria(app, seed):
+    index = app.extensions["cohorts"]
+    with app.app_context():
+        index.ensure_current()
+        assert not index.evaluate({"hospital_id": []})
+        assert not index.evaluate({}, scope=[])
+        assert list(index.evaluate({}, scope=[seed["hospital2"]])) == [seed["patient2"]]
+
+
+def test_bitmap_matches_set_semantics_for_sparse_ids():
+    import random
+
+    rng = random.Random(7)
+    pool = [rng.randrange(1, 3_000_000_000) for _ in range(2000)] + [65535, 65536, 65537]
+    a_ids, b_ids = set(rng.sample(pool, 1200)), set(rng.sample(pool, 1200))
+    a, b = Bitmap(a_ids), Bitmap(b_ids)
+
+    assert list(a | b) == sorted(a_ids | b_ids)
+    assert list(a & b) == sorted(a_ids & b_ids)
+    assert list(a - b) == sorted(a_ids - b_ids)
+    assert len(a) == len(a_ids)
+    cursor = sorted(a_ids)[600]
+    assert list(iter_members(a, after=cursor)) == sorted(i for i in a_ids if i > cursor)
+    assert list(iter_members(Bitmap([65536]), after=65535)) == [65536]
+
+
+def test_edge_patient_ids_stay_small():
+    bitmap = Bitmap([1_000_000_001, 1_000_000_002])
+    # One chunk of at most 65536 bits instead of a billion-bit integer
+    assert len(bitmap._chunks) == 1
+    assert sys.getsizeof(next(iter(bitmap._chunks.values()))) <= 65536 // 8 + 64
+    bitmap.discard(1_000_000_001)
+    bitmap.discard(1_000_000_002)
+    assert not bitmap and not bitmap._chunks
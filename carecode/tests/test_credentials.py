@@ -0,0 +1,32 @@
+from credentials import authenticate
+from models import db, UserCredential
+
+
+def test_login_before_credentials_are_rebuilt(app, seed):
+    with app.app_context():
+        # Accounts created before user_credentials existed
+        db.session.execute(db.delete(UserCredential))
+        db.session.commit()
+
+        assert authenticate("admin1", "wrong") is None
+        credential = authenticate("DOC002", "password123")
+        assert (credential.user_type, credential.user_id) == ("doctor", seed["doctor2"])
+        assert UserCredential.query.filter_by(login_name="DOC002").count() == 1
+
+    response = app.test_client().post("/login", data={"username": "moh", "password": "password123"})
+    assert response.status_code == 302 and response.location.endswith("/dashboard")
+
+
+def test_login_with_indexed_credentials(app, seed):
+    client = app.test_client()
+    response = client.post("/login", data={"username": "admin2", "password": "password123"})
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        assert (session["user_type"], session["hospital_id"]) == ("hospital_admin", seed["hospital2"])
+
+    assert app.test_client().post("/login", data={"username": "admin2", "password": "nope"}).status_code == 200
+
+
+def test_unknown_login_name(app, seed):
+    with app.app_context():
+        assert authenticate("nobody", "password123") is None
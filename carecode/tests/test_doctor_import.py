@@ -0,0 +1,69 @@
+import io
+import os
+import re
+
+from conftest import login
+from doctor_import import import_doctors
+from jobs import claim, run_job
+from models import Doctor
+
+ROWS = [
+    {"license_no": f"IMP{n:03}", "full_name": f"Imported Doctor {n}", "email": f"imported{n}@example.com",
+     "password": "password123"}
+    for n in range(3)
+]
+
+
+def dashboard_counter(client, name):
+    html = client.get("/dashboard").get_data(as_text=True)
+    return int(re.search(rf'data-counter="{name}">(\d+)<', html).group(1))
+
+
+def test_import_refreshes_cached_dashboard_counts(app, seed):
+    client = login(app.test_client(), "hospital_admin", seed["admin1"], hospital_id=seed["hospital1"])
+    assert dashboard_counter(client, "total_doctors") == 1
+
+    with app.app_context():
+        assert import_doctors(ROWS, seed["hospital1"], workers=1)["imported"] == 3
+
+    assert dashboard_counter(client, "total_doctors") == 4
+
+
+def test_import_publishes_one_doctor_count_delta(app, seed):
+    broker = app.extensions["live_events"]
+    subscriber = broker.subscribe([f"hospital:{seed['hospital1']}"], lambda: None)
+    try:
+        with app.app_context():
+            import_doctors(ROWS, seed["hospital1"], workers=1)
+        events, _ = broker.drain(subscriber)
+    finally:
+        broker.unsubscribe(subscriber)
+
+    assert [(kind, data) for _, kind, data in events] == [("counters", {"total_doctors": 3})]
+
+
+def test_dashboard_stream_is_off_without_live_events(app, seed):
+    client = login(app.test_client(), "hospital_admin", seed["admin1"], hospital_id=seed["hospital1"])
+    assert client.get("/events/dashboard").status_code == 204
+    assert "data-events-url" not in client.get("/dashboard").get_data(as_text=True)
+
+
+def test_upload_imports_in_a_background_job(app, seed):
+    client = login(app.test_client(), "hospital_admin", seed["admin1"], hospital_id=seed["hospital1"])
+    csv = "license_no,full_name,email,password\n" + "".join(
+        f"{r['license_no']},{r['full_name']},{r['email']},{r['password']}\n" for r in ROWS
+    )
+    response = client.post("/doctors/import", data={"registry_file": (io.BytesIO(csv.encode()), "doctors.csv")},
+                           content_type="multipart/form-data")
+    job_id = int(re.search(r"job=(\d+)", response.headers["Location"]).group(1))
+    assert "queued" in client.get(f"/doctors/import?job={job_id}").get_data(as_text=True)
+
+    with app.app_context():
+        assert Doctor.query.filter_by(hospital_id=seed["hospital1"]).count() == 1
+        job = claim("worker-1")
+        assert job.id == job_id and run_job(job)
+        assert Doctor.query.filter_by(hospital_id=seed["hospital1"]).count() == 4
+    assert os.listdir(os.path.join(app.instance_path, "doctor_imports")) == []
+
+    html = client.get(f"/doctors/import?job={job_id}").get_data(as_text=True)
+    assert "3 imported" in html
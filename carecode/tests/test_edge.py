@@ -0,0 +1,28 @@
+from edge import make_token, revoke_token
+from models import db
+
+
+def issue(app, hospital_id):
+    with app.app_context():
+        token = make_token(app, hospital_id)
+        db.session.commit()
+    return token
+
+
+def pull(client, token):
+    return client.get("/api/edge/changes", headers={"Authorization": f"Bearer {token}"}).status_code
+
+
+def test_sync_tokens_can_be_replaced_and_revoked(app, seed):
+    client = app.test_client()
+    first = issue(app, seed["hospital1"])
+    assert pull(client, first) == 200
+
+    second = issue(app, seed["hospital1"])
+    assert pull(client, first) == 401
+    assert pull(client, second) == 200
+
+    with app.app_context():
+        revoke_token(seed["hospital1"])
+        db.session.commit()
+    assert pull(client, second) == 401
@@ -0,0 +1,48 @@
+from datetime import date
+
+import pytest
+
+from conftest import login
+from forms import MedicalEncounterForm
+from models import MedicalEncounter
+
+
+def validate_code(app, code):
+    with app.test_request_context(method="POST", data={
+        "patient_id": "1", "diagnosis_text": "Delivery", "diagnosis_code": code,
+        "treatment_date": date.today().isoformat(),
+    }):
+        form = MedicalEncounterForm()
+        valid = form.validate()
+        return valid, form.diagnosis_code.data, form.diagnosis_code_warning, form.errors
+
+
+@pytest.mark.parametrize("code, canonical", [("j45.9", "J45.9"), (" J459 ", "J45.9"), ("o80.9", "O80.9")])
+def test_known_codes_are_canonicalized(app, code, canonical):
+    valid, data, warning, _ = validate_code(app, code)
+    assert valid and data == canonical and warning is None
+
+
+@pytest.mark.parametrize("code, canonical", [("O80", "O80"), ("z37.0", "Z37.0"), ("y04.0", "Y04.0")])
+def test_uncatalogued_codes_are_kept_with_a_warning(app, code, canonical):
+    valid, data, warning, _ = validate_code(app, code)
+    assert valid and data == canonical
+    assert canonical in warning
+
+
+@pytest.mark.parametrize("code", ["asthma", "45.9", "J45.99999"])
+def test_malformed_codes_are_rejected(app, code):
+    valid, _, _, errors = validate_code(app, code)
+    assert not valid and "diagnosis_code" in errors
+
+
+def test_encounter_with_uncatalogued_code_is_saved(app, seed):
+    client = login(app.test_client(), "doctor", seed["doctor1"], hospital_id=seed["hospital1"])
+    response = client.post(f"/encounters/add/{seed['patient1']}", data={
+        "patient_id": seed["patient1"], "diagnosis_text": "Normal delivery", "diagnosis_code": "o80",
+        "treatment_date": date.today().isoformat(), "medicines-0-name": "",
+    }, follow_redirects=True)
+    assert response.status_code == 200
+    assert "O80 is not in the ICD-10 catalog" in response.get_data(as_text=True)
+    with app.app_context():
+        assert MedicalEncounter.query.one().diagnosis_code == "O80"
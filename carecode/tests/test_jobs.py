@@ -0,0 +1,54 @@
+import time
+from datetime import datetime, timedelta
+
+from jobs import claim, enqueue, requeue_stale, run_job, task
+from models import db, Job
+
+failures = []
+
+
+@task("test_slow")
+def slow_task(seconds):
+    time.sleep(seconds)
+    with db.engine.connect() as connection:
+        locked_at = connection.scalar(db.select(Job.locked_at).where(Job.status == "running"))
+    return locked_at.isoformat()
+
+
+@task("test_lossy", max_attempts=2, on_failure=lambda payload, error: failures.append((payload, error)))
+def lossy_task():
+    pass
+
+
+def test_heartbeat_refreshes_lock_while_job_runs(app):
+    with app.app_context():
+        enqueue("test_slow", {"seconds": 0.5})
+        db.session.commit()
+        job = claim("worker-1")
+        claimed_at = job.locked_at
+
+        assert run_job(job, heartbeat_interval=timedelta(seconds=0.1))
+        job = db.session.get(Job, job.id)
+        assert job.status == "succeeded"
+        assert datetime.fromisoformat(job.result) > claimed_at
+
+
+def test_stale_jobs_count_against_max_attempts(app):
+    failures.clear()
+    with app.app_context():
+        enqueue("test_lossy", {"n": 1})
+        db.session.commit()
+        lost_long_ago = datetime.utcnow() - timedelta(hours=1)
+
+        for attempt in (1, 2):
+            job = claim("worker-1")
+            assert job.attempts == attempt
+            job.locked_at = lost_long_ago
+            db.session.commit()
+            assert requeue_stale() == 1
+
+        job = db.session.get(Job, job.id)
+        db.session.refresh(job)
+        assert job.status == "failed" and job.finished_at is not None
+        assert claim("worker-1") is None
+        assert failures == [({"n": 1}, "Worker lost on the last attempt")]
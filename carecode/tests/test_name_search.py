@@ -0,0 +1,64 @@
+from datetime import date
+
+from conftest import login
+from models import db, Patient, PatientNameKey
+from name_keys import backfill_name_keys, name_search_clause
+
+
+def search(app, seed, term):
+    client = login(app.test_client(), "doctor", seed["doctor1"], hospital_id=seed["hospital1"])
+    return sorted(p["name"] for p in client.get("/search/patients", query_string={"term": term}).get_json())
+
+
+def add_patient(seed, full_name):
+    patient = Patient(full_name=full_name, date_of_birth=date(1985, 5, 5), created_by_hospital=seed["hospital1"])
+    db.session.add(patient)
+    db.session.commit()
+    return patient
+
+
+def keys(patient_id):
+    return sorted(k.key for k in PatientNameKey.query.filter_by(patient_id=patient_id))
+
+
+def test_keys_follow_patient_name_changes(app, seed):
+    with app.app_context():
+        patient = add_patient(seed, "Nimal Perera")
+        assert keys(patient.id) == ["NML", "PR"]
+
+        patient.full_name = "Nimal Jayakumar"
+        db.session.commit()
+        assert keys(patient.id) == ["JKMR", "NML"]
+
+        patient.blood_type = "A+"
+        db.session.commit()
+        assert keys(patient.id) == ["JKMR", "NML"]
+
+
+def test_spelling_variants_match(app, seed):
+    with app.app_context():
+        add_patient(seed, "Kamal Pereira")
+    assert search(app, seed, "kamal perera") == ["Kamal Pereira"]
+
+
+def test_patients_without_keys_until_backfilled(app, seed, monkeypatch):
+    with app.app_context():
+        patient = add_patient(seed, "Thilini Fernando")
+        # Registered before name keys existed
+        db.session.execute(db.delete(PatientNameKey).where(PatientNameKey.patient_id == patient.id))
+        db.session.commit()
+    assert search(app, seed, "Thilini Fern") == []
+
+    monkeypatch.setitem(app.config, "NAME_SEARCH_SUBSTRING_FALLBACK", True)
+    assert search(app, seed, "Thilini Fern") == ["Thilini Fernando"]
+
+    monkeypatch.setitem(app.config, "NAME_SEARCH_SUBSTRING_FALLBACK", False)
+    with app.app_context():
+        backfill_name_keys()
+    assert search(app, seed, "Tilini Fern") == ["Thilini Fernando"]
+
+
+def test_name_search_uses_only_the_key_index(app):
+    with app.app_context():
+        sql = str(name_search_clause("Nimal Perera").compile(compile_kwargs={"literal_binds": True}))
+    assert "patient_name_keys" in sql and "full_name" not in sql
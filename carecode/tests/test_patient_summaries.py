@@ -0,0 +1,29 @@
+import json
+from datetime import date
+
+from models import db, Doctor, Hospital, MedicalEncounter
+from patient_summaries import get_summary
+
+
+def card(patient_id):
+    summary = get_summary(patient_id)
+    return summary.etag, json.loads(summary.document)
+
+
+def test_renaming_doctor_or_hospital_refreshes_cards(app, seed):
+    with app.app_context():
+        db.session.add(MedicalEncounter(patient_id=seed["patient1"], doctor_id=seed["doctor1"],
+                                        hospital_id=seed["hospital1"], diagnosis_text="Review",
+                                        treatment_date=date(2026, 10, 1)))
+        db.session.commit()
+        etag, _ = card(seed["patient1"])
+
+        db.session.get(Doctor, seed["doctor1"]).full_name = "Dr. Renamed"
+        db.session.get(Hospital, seed["hospital1"]).name = "Renamed General"
+        db.session.commit()
+        db.session.expire_all()
+
+        new_etag, document = card(seed["patient1"])
+        assert new_etag != etag
+        assert document["recent_encounters"][0]["doctor"] == "Dr. Renamed"
+        assert document["last_visit"]["hospital"] == "Renamed General"
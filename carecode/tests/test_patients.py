@@ -0,0 +1,55 @@
+from conftest import login
+from models import db, Patient, PatientHospital
+from mpi import refresh_blocking_keys
+
+
+def link(client, patient_id, **details):
+    return client.post(f"/patients/{patient_id}/link-hospital", data=details)
+
+
+def index_patients(app):
+    with app.app_context():
+        for patient in Patient.query:
+            refresh_blocking_keys(patient)
+        db.session.commit()
+
+
+def links(app, patient_id):
+    with app.app_context():
+        return {link.hospital_id for link in PatientHospital.query.filter_by(patient_id=patient_id)}
+
+
+def test_link_requires_matching_registration_details(app, seed):
+    index_patients(app)
+    client = login(app.test_client(), "hospital_admin", seed["admin1"], hospital_id=seed["hospital1"])
+
+    assert link(client, seed["patient2"]).status_code == 302
+    assert link(client, seed["patient2"], full_name="Someone Else", date_of_birth="1990-02-01").status_code == 403
+    assert seed["hospital1"] not in links(app, seed["patient2"])
+
+
+def test_link_offered_duplicate(app, seed):
+    index_patients(app)
+    client = login(app.test_client(), "hospital_admin", seed["admin1"], hospital_id=seed["hospital1"])
+
+    response = link(client, seed["patient2"], full_name="Patient 2", date_of_birth="1990-02-01", gender="male")
+    assert response.status_code == 302
+    assert seed["hospital1"] in links(app, seed["patient2"])
+
+
+def test_registration_matches_on_nic(app, seed):
+    client = login(app.test_client(), "hospital_admin", seed["admin1"], hospital_id=seed["hospital1"])
+    details = {"full_name": "Kamal Silva", "date_of_birth": "1985-03-04", "gender": "male"}
+
+    assert client.post("/patients/add", data={**details, "nic": "851234567V"}).status_code == 302
+    with app.app_context():
+        patient = Patient.query.filter_by(full_name="Kamal Silva").one()
+        assert [(i.id_type, i.id_value) for i in patient.identifiers] == [("nic", "851234567V")]
+
+    # Same NIC in the new format, under a different spelling of the name and no date of birth
+    html = client.post("/patients/add", data={"full_name": "K. Silva", "nic": "198512304567"}).get_data(as_text=True)
+    assert "This patient may already be registered" in html
+
+    html = client.post("/patients/add", data={"full_name": "K. Silva", "nic": "198512304567",
+                                              "confirm_new": "1"}).get_data(as_text=True)
+    assert "This identifier already exists for another patient" in html
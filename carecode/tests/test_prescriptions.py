@@ -0,0 +1,54 @@
+from datetime import date
+
+from conftest import login
+from models import db, EncounterMedicine, MedicalEncounter
+from prescriptions import backfill_encounter_medicines
+
+LEGACY = [{"name": "Salbutamol", "dosage": "2 puffs", "frequency": "qid", "duration": "5 days"}]
+
+
+def add_encounter(seed, prescriptions=None):
+    encounter = MedicalEncounter(patient_id=seed["patient1"], doctor_id=seed["doctor1"], hospital_id=seed["hospital1"],
+                                 diagnosis_text="Asthma", treatment_date=date(2026, 10, 1), medicines=LEGACY)
+    if prescriptions is not None:
+        encounter.set_prescriptions(prescriptions)
+    db.session.add(encounter)
+    db.session.commit()
+    return encounter
+
+
+def test_legacy_medicines_until_backfilled(app, seed):
+    with app.app_context():
+        legacy = add_encounter(seed)
+        assert legacy.medicine_list() == [{"code": None, **LEGACY[0]}]
+
+        current = add_encounter(seed, [{"name": "Prednisolone", "code": "H02AB06", "dosage": "40 mg"}])
+        assert [m["name"] for m in current.medicine_list()] == ["Prednisolone"]
+
+
+def test_removing_all_medicines_of_a_backfilled_encounter(app, seed):
+    with app.app_context():
+        encounter_id = add_encounter(seed).id
+        assert backfill_encounter_medicines() == (1, 1)
+    client = login(app.test_client(), "doctor", seed["doctor1"], hospital_id=seed["hospital1"])
+
+    response = client.post(f"/encounters/{encounter_id}/edit", data={
+        "patient_id": seed["patient1"], "diagnosis_text": "Asthma", "treatment_date": "2026-10-01",
+        "medicines-0-name": "",
+    })
+    assert response.status_code == 302
+    with app.app_context():
+        encounter = db.session.get(MedicalEncounter, encounter_id)
+        assert encounter.medicines is None and encounter.medicine_list() == []
+        assert backfill_encounter_medicines() == (0, 0)
+        assert EncounterMedicine.query.count() == 0
+
+
+def test_timeline_and_records_show_legacy_medicines(app, seed):
+    with app.app_context():
+        add_encounter(seed)
+    client = login(app.test_client(), "doctor", seed["doctor1"], hospital_id=seed["hospital1"])
+
+    timeline = client.get(f"/api/patients/{seed['patient1']}/timeline").get_json()
+    assert [m["name"] for entry in timeline["encounters"] for m in entry["medicines"]] == ["Salbutamol"]
+    assert "Salbutamol" in client.get("/medical-records").get_data(as_text=True)
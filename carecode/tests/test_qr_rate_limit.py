@@ -0,0 +1,20 @@
+import random
+import uuid
+
+
+def client_address():
+    # Random, since the limiter's state file outlives a test run
+    return f"2001:db8::{random.getrandbits(16):x}:{random.getrandbits(16):x}"
+
+
+def scan(client, address):
+    return client.get(f"/patient/qr/{uuid.uuid4().hex}", headers={"X-Forwarded-For": address}).status_code
+
+
+def test_clients_behind_the_proxy_get_their_own_bucket(app, monkeypatch):
+    monkeypatch.setitem(app.extensions["qr_rate_limiter"].limits, "ip", (0.001, 2))
+    client = app.test_client()
+    first, second = client_address(), client_address()
+
+    assert [scan(client, first) for _ in range(3)] == [302, 302, 429]
+    assert scan(client, second) == 302
@@ -0,0 +1,42 @@
+from datetime import date, datetime, timedelta
+
+from models import db, Doctor, HospitalRollup, MedicalEncounter, Patient
+from rollups import refresh_rollups
+
+
+def encounter(seed, day):
+    return MedicalEncounter(patient_id=seed["patient1"], doctor_id=seed["doctor1"], hospital_id=seed["hospital1"],
+                            diagnosis_text="Review", treatment_date=day)
+
+
+def rollups(hospital_id):
+    return {
+        (row.period, row.period_start): row.encounters
+        for row in HospitalRollup.query.filter_by(hospital_id=hospital_id)
+        if row.period != "day" and row.encounters
+    }
+
+
+def test_incremental_refresh_when_month_begins_mid_week(app, seed):
+    with app.app_context():
+        db.session.add_all([encounter(seed, date(2026, 9, 29)), encounter(seed, date(2026, 10, 1))])
+        db.session.commit()
+        refresh_rollups(full=True)
+        # Only the 1 October encounter changes after the full refresh
+        an_hour_ago = datetime.utcnow() - timedelta(hours=1)
+        for model in (Patient, Doctor, MedicalEncounter):
+            db.session.execute(db.update(model).values(updated_at=an_hour_ago))
+        db.session.commit()
+        october = MedicalEncounter.query.filter_by(treatment_date=date(2026, 10, 1)).one()
+        db.session.add(encounter(seed, date(2026, 10, 2)))
+        october.diagnosis_text = "Follow-up"
+        db.session.commit()
+
+        refresh_rollups()
+
+        # 1 October is a Thursday; its week starts on 28 September
+        assert rollups(seed["hospital1"]) == {
+            ("week", date(2026, 9, 28)): 3,
+            ("month", date(2026, 9, 1)): 1,
+            ("month", date(2026, 10, 1)): 2,
+        }
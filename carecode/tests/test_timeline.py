@@ -0,0 +1,20 @@
+from conftest import login
+from models import db, PatientHospital
+
+
+def timeline(app, seed, user_type, user, hospital, patient):
+    client = login(app.test_client(), user_type, seed[user], hospital_id=seed[hospital])
+    return client.get(f"/api/patients/{seed[patient]}/timeline")
+
+
+def test_timeline_limited_to_patients_hospitals(app, seed):
+    assert timeline(app, seed, "doctor", "doctor1", "hospital1", "patient1").status_code == 200
+    assert timeline(app, seed, "doctor", "doctor1", "hospital1", "patient2").status_code == 403
+    assert timeline(app, seed, "hospital_admin", "admin2", "hospital2", "patient1").status_code == 403
+
+
+def test_timeline_of_patient_seen_at_hospital(app, seed):
+    with app.app_context():
+        db.session.add(PatientHospital(patient_id=seed["patient2"], hospital_id=seed["hospital1"]))
+        db.session.commit()
+    assert timeline(app, seed, "doctor", "doctor1", "hospital1", "patient2").status_code == 200
@@ -0,0 +1,87 @@
+"""Cursor-paged patient encounter timeline.
+
+Pages are ordered newest first by (treatment_date, id) and continue from a
+keyset cursor, served by ``ix_medical_encounters_patient_date``. Doctor,
+hospital and prescriptions are loaded eagerly with the page.
+"""
+import base64
+import json
+from datetime import date
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload, selectinload
+
+from models import MedicalEncounter
+
+PAGE_SIZE = 20
+
+
+def encode_cursor(encounter):
+    raw = json.dumps([encounter.treatment_date.isoformat(), encounter.id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """(treatment_date, id) from a cursor, or None for anything malformed"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        treatment_date, encounter_id = json.loads(base64.urlsafe_b64decode(padded))
+        return date.fromisoformat(treatment_date), int(encounter_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def patient_timeline(patient_id, hospital_id=None, date_from=None, date_to=None, cursor=None, limit=PAGE_SIZE):
+    """One page of a patient's encounters; returns (encounters, next_cursor)"""
+    query = (
+        MedicalEncounter.query
+        .options(
+            joinedload(MedicalEncounter.doctor),
+            joinedload(MedicalEncounter.hospital),
+            selectinload(MedicalEncounter.prescriptions),
+        )
+        .filter(MedicalEncounter.patient_id == patient_id)
+    )
+    if hospital_id:
+        query = query.filter(MedicalEncounter.hospital_id == hospital_id)
+    if date_from:
+        query = query.filter(MedicalEncounter.treatment_date >= date_from)
+    if date_to:
+        query = query.filter(MedicalEncounter.treatment_date <= date_to)
+
+    position = decode_cursor(cursor)
+    if position:
+        last_date, last_id = position
+        query = query.filter(or_(
+            MedicalEncounter.treatment_date < last_date,
+            and_(MedicalEncounter.treatment_date == last_date, MedicalEncounter.id < last_id),
+        ))
+
+    encounters = (
+        query.order_by(MedicalEncounter.treatment_date.desc(), MedicalEncounter.id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+    if len(encounters) > limit:
+        encounters = encounters[:limit]
+        return encounters, encode_cursor(encounters[-1])
+    return encounters, None
+
+
+def timeline_entry(encounter):
+    return {
+        "id": encounter.id,
+        "date": encounter.treatment_date.isoformat(),
+        "doctor_id": encounter.doctor_id,
+        "doctor": encounter.doctor.full_name if encounter.doctor else "Unknown",
+        "hospital_id": encounter.hospital_id,
+        "hospital": encounter.hospital.name if encounter.hospital else None,
+        "diagnosis_code": encounter.diagnosis_code,
+        "diagnosis": encounter.diagnosis_text,
+        "suggestions": encounter.suggestions,
+        "medicines": [
+            {k: m[k] for k in ("name", "dosage", "frequency", "duration")} for m in encounter.medicine_list()
+        ],
+    }